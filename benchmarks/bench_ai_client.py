@@ -0,0 +1,86 @@
+"""AI客户端复用基准测试
+
+对比每条消息新建 openai.OpenAI 客户端（旧实现）与 AIHandler 长连接客户端
+在本地桩服务上的单次请求延迟。
+
+用法: python benchmarks/bench_ai_client.py [-n 200]
+"""
+import argparse
+import logging
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import openai
+
+from benchmarks.stub_openai_server import StubOpenAIServer
+from src.ai_handler import AIHandler
+
+
+def _percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _report(name, samples, connections):
+    ms = [s * 1000 for s in samples]
+    print(f"{name:<16} 平均 {statistics.mean(ms):7.2f} ms  p50 {_percentile(ms, 50):7.2f} ms  "
+          f"p95 {_percentile(ms, 95):7.2f} ms  TCP连接数 {connections}")
+
+
+def bench_per_message_client(config, requests):
+    """旧实现：每条消息都新建客户端"""
+    samples = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        client = openai.OpenAI(api_key=config['api_key'], base_url=config['service'])
+        client.chat.completions.create(
+            model=config['model'],
+            messages=[{'role': 'user', 'content': '你好'}],
+            max_tokens=config['max_tokens']
+        )
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def bench_pooled_client(config, requests):
+    """新实现：AIHandler 持有长连接客户端"""
+    handler = AIHandler(config)
+    samples = []
+    try:
+        for _ in range(requests):
+            start = time.perf_counter()
+            handler.process_message('你好')
+            samples.append(time.perf_counter() - start)
+    finally:
+        handler.close()
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description='AI客户端复用基准测试')
+    parser.add_argument('-n', '--requests', type=int, default=200, help='每种方式的请求数')
+    parser.add_argument('--latency', type=float, default=0.0, help='桩服务模拟延迟（秒）')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+
+    for name, bench in (('每次新建客户端', bench_per_message_client), ('长连接客户端', bench_pooled_client)):
+        with StubOpenAIServer(latency=args.latency) as server:
+            config = {
+                'api_key': 'sk-bench',
+                'service': server.base_url,
+                'model': 'stub-model',
+                'max_tokens': 851,
+                'timeout': 30
+            }
+            samples = bench(config, args.requests)
+            _report(name, samples, server.connections)
+
+
+if __name__ == '__main__':
+    main()
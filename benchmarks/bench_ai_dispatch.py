@@ -0,0 +1,123 @@
+"""AI请求优先级分派基准测试
+
+模拟一波消息同时到达多个群（例如群发公告），其中一部分来自低优先级群，
+在相同并发数（--workers）下对比：
+    逐个处理: AIHandler + workers 个工作线程，按到达顺序先进先出
+    优先分派(同步): AIRequestDispatcher(max_concurrency=workers) + AIHandler
+    优先分派(异步): AIRequestDispatcher(max_concurrency=workers) + AsyncAIHandler
+两边的并发数相同，总吞吐量应基本一致；区别在于名额不足时普通请求先于低优先级请求处理。
+报告总耗时、吞吐量、普通/低优先级请求各自的延迟和TCP连接数。
+
+用法:
+    python benchmarks/bench_ai_dispatch.py --requests 50 100 --latency 0.5 --workers 4
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.stub_openai_server import StubOpenAIServer
+from src.ai_dispatcher import AIRequestDispatcher
+from src.ai_handler import AIHandler, AsyncAIHandler
+
+
+def _percentile(samples, pct):
+    if not samples:
+        return float('nan')
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _is_low(i, low_ratio):
+    return low_ratio > 0 and (i % round(1 / low_ratio)) == 0
+
+
+def _run_burst(submit, requests, spread, low_ratio):
+    """在 spread 秒内均匀提交 requests 个请求，返回 (总耗时, 普通请求延迟, 低优先级请求延迟)"""
+    futures, normal, low_latencies = [], [], []
+    start = time.perf_counter()
+    for i in range(requests):
+        target = start + spread * i / requests
+        delay = target - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        low = _is_low(i, low_ratio)
+        submitted = time.perf_counter()
+        future = submit(f'群{i}: 今晚8点开会，收到请回复', f'low_{i}' if low else f'group_{i}')
+        # 在完成时记录延迟，而不是按提交顺序依次等待时
+        future.add_done_callback(
+            lambda f, low=low, submitted=submitted: (low_latencies if low else normal).append(
+                time.perf_counter() - submitted))
+        futures.append(future)
+    for future in futures:
+        future.result()
+    return time.perf_counter() - start, normal, low_latencies
+
+
+def bench(name, server, config, args, requests, dispatcher_mode):
+    """运行一种分派方式并打印结果"""
+    handler = AsyncAIHandler(config) if config.get('async_backend') else AIHandler(config)
+    # 预热：建立客户端和连接，不计入结果
+    handler.process_message('预热')
+    connections_before = server.connections
+    pool = None
+    if dispatcher_mode:
+        low_targets = [f'low_{i}' for i in range(requests) if _is_low(i, args.low_ratio)]
+        dispatcher = AIRequestDispatcher(handler, max_concurrency=args.workers,
+                                      low_priority_targets=low_targets,
+                                      low_priority_concurrency=args.low_concurrency)
+        submit = lambda message, target: dispatcher.submit(message, target=target)
+    else:
+        dispatcher = handler
+        pool = ThreadPoolExecutor(max_workers=args.workers)
+        submit = lambda message, target: pool.submit(handler.process_message, message)
+    try:
+        elapsed, normal, low = _run_burst(submit, requests, args.spread, args.low_ratio)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        dispatcher.close()
+    print(f"{name:<14} {requests:>5} {elapsed:>8.2f} {requests / elapsed:>9.1f} "
+          f"{_percentile(normal, 50):>8.2f} {_percentile(normal, 95):>8.2f} "
+          f"{_percentile(low, 50):>8.2f} {_percentile(low, 95):>8.2f} "
+          f"{server.connections - connections_before:>6}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='AI请求优先级分派基准测试')
+    parser.add_argument('--requests', type=int, nargs='+', default=[20, 50, 100], help='一波请求的数量')
+    parser.add_argument('--latency', type=float, default=0.5, help='桩服务模拟延迟（秒）')
+    parser.add_argument('--spread', type=float, default=0.2, help='一波请求到达的时间跨度（秒）')
+    parser.add_argument('--workers', type=int, default=4, help='两种方式共同的并发数')
+    parser.add_argument('--low-ratio', type=float, default=0.5, help='低优先级请求的比例')
+    parser.add_argument('--low-concurrency', type=int, default=2, help='低优先级请求的并发上限')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+
+    print(f"并发数: {args.workers}，低优先级比例: {args.low_ratio}")
+    print(f"{'方式':<14} {'请求数':>5} {'总耗时(s)':>8} {'吞吐(个/s)':>9} {'普通p50':>8} {'普通p95':>8} "
+          f"{'低优p50':>8} {'低优p95':>8} {'连接数':>6}")
+    with StubOpenAIServer(latency=args.latency) as server:
+        base = {
+            'api_key': 'sk-bench',
+            'service': server.base_url,
+            'model': 'stub-model',
+            'timeout': 30,
+            'max_connections': args.workers,
+            'max_keepalive_connections': args.workers,
+            'max_concurrency': args.workers
+        }
+        for requests in args.requests:
+            bench('逐个处理', server, base, args, requests, False)
+            bench('优先分派(同步)', server, base, args, requests, True)
+            bench('优先分派(异步)', server, dict(base, async_backend=True), args, requests, True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""消息缓存到期检查基准测试
+
+对比旧实现（每次轮询遍历所有用户并逐个检查时间）与 MessageCache.pop_due()
+在大量空闲用户下的单次检查耗时。空闲用户指曾经发过消息、当前没有待处理消息
+的用户，另有少量用户的消息尚未到期。
+
+用法: python benchmarks/bench_message_cache.py [--senders 1000 10000 100000]
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.chat_message import ChatMessage
+from src.message_cache import MessageCache
+
+
+def legacy_check(cache: MessageCache):
+    """旧实现：遍历所有用户，每个用户调用一次 datetime.now()"""
+    due = []
+    for sender in list(cache.legacy_last_time.keys()):
+        if not cache.user_messages.get(sender):
+            continue
+        now = datetime.now()
+        last = cache.legacy_last_time[sender]
+        if (now - last).total_seconds() >= cache.response_delay:
+            due.append(sender)
+    return due
+
+
+def build_cache(idle_senders: int, pending_senders: int) -> MessageCache:
+    cache = MessageCache(response_delay=3)
+    cache.legacy_last_time = {}
+    for i in range(idle_senders):
+        sender = f'idle_{i}'
+        cache.add_message(sender, ChatMessage('Text', '你好'))
+        cache.legacy_last_time[sender] = datetime.now()
+    # 让空闲用户的消息全部到期并被取走（旧实现会为它们保留空列表）
+    cache.pop_due(now=time.monotonic() + cache.response_delay)
+    for i in range(pending_senders):
+        sender = f'pending_{i}'
+        cache.add_message(sender, ChatMessage('Text', '在吗'))
+        cache.legacy_last_time[sender] = datetime.now()
+    return cache
+
+
+def time_ticks(func, ticks: int) -> float:
+    start = time.perf_counter()
+    for _ in range(ticks):
+        func()
+    return (time.perf_counter() - start) / ticks
+
+
+def main():
+    parser = argparse.ArgumentParser(description='消息缓存到期检查基准测试')
+    parser.add_argument('--senders', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='空闲用户数量')
+    parser.add_argument('--pending', type=int, default=10, help='消息尚未到期的用户数量')
+    parser.add_argument('--ticks', type=int, default=200, help='检查次数')
+    args = parser.parse_args()
+
+    print(f"{'空闲用户数':>10} {'旧实现 每次检查':>16} {'pop_due 每次检查':>18}")
+    for senders in args.senders:
+        cache = build_cache(senders, args.pending)
+        legacy = time_ticks(lambda: legacy_check(cache), args.ticks)
+        heap = time_ticks(cache.pop_due, args.ticks)
+        print(f"{senders:>10} {legacy * 1e6:>13.1f} µs {heap * 1e6:>15.2f} µs")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""消息记录内存与分配基准测试
+
+对比两种消息表示在 N 条消息下的内存占用和创建耗时：
+    字典: 旧实现，每条消息一个字典（时间为提前格式化的字符串），
+          进入 MessageCache 时再创建一个 {'content', 'time': datetime} 字典
+    ChatMessage: __slots__ 不可变记录，时间为时间戳，消息本身直接进入缓存
+内存使用 tracemalloc 统计保留所有消息时的分配量和分配块数。
+
+用法:
+    python benchmarks/bench_message_memory.py --messages 1000000
+"""
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.chat_message import ChatMessage
+
+CONTENTS = ['在吗', '请问这个怎么用？', '收到，谢谢', '今天几点开会？', '哈哈哈']
+
+
+def build_dicts(count):
+    messages, cached = [], []
+    for i in range(count):
+        message = {
+            'type': 'Text',
+            'content': CONTENTS[i % len(CONTENTS)],
+            'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'id': f'fake_{i}'
+        }
+        messages.append(message)
+        cached.append({'content': message['content'], 'time': datetime.now()})
+    return messages, cached
+
+
+def build_records(count):
+    messages, cached = [], []
+    for i in range(count):
+        message = ChatMessage('Text', CONTENTS[i % len(CONTENTS)], time.time(), f'fake_{i}')
+        messages.append(message)
+        cached.append(message)
+    return messages, cached
+
+
+def measure(name, build, count):
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    data = build(count)
+    elapsed = time.perf_counter() - started
+    current, peak = tracemalloc.get_traced_memory()
+    blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics('filename'))
+    tracemalloc.stop()
+    del data
+    gc.collect()
+    print(f"{name:<12} {count:>9} {elapsed:>8.2f} {current / 1024 / 1024:>10.1f} {peak / 1024 / 1024:>10.1f} "
+          f"{current / count:>10.0f} {blocks / count:>10.1f}")
+    return current
+
+
+def main():
+    parser = argparse.ArgumentParser(description='消息记录内存与分配基准测试')
+    parser.add_argument('--messages', type=int, default=1_000_000, help='消息数量')
+    args = parser.parse_args()
+
+    print(f"{'表示':<12} {'消息数':>9} {'耗时(s)':>8} {'内存(MB)':>10} {'峰值(MB)':>10} {'字节/条':>10} {'分配块/条':>10}")
+    legacy = measure('字典', build_dicts, args.messages)
+    records = measure('ChatMessage', build_records, args.messages)
+    print(f"内存减少: {(1 - records / legacy) * 100:.1f}%")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+"""消息管线端到端吞吐/延迟基准测试
+
+使用模拟微信后端和本地OpenAI兼容桩服务，驱动
+MessageMonitor + MessageCache + AIHandler + WeChatHandler 完整运行，
+报告每秒接收消息数、从消息产生到回复发送的 p50/p95/p99 延迟、CPU占用和内存。
+
+用法:
+    python benchmarks/bench_pipeline.py --targets 10 50 100 --bursts 0 20 --llm-latency 0.2 1.0
+    python benchmarks/bench_pipeline.py --async-backend --json bench_output.json
+    python benchmarks/bench_pipeline.py --journal /tmp/bench_journal.jsonl  # 开启预写日志
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.stub_openai_server import StubOpenAIServer
+from src.ai_handler import create_ai_handler
+from src.message_monitor import MessageMonitor
+from src.wechat_backend import FakeWeChatBackend
+from src.wechat_handler import WeChatHandler
+
+
+def _percentile(samples, pct):
+    if not samples:
+        return float('nan')
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _rss_mb() -> float:
+    """当前进程常驻内存（MB）"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 1024 / 1024
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    except ImportError:
+        return float('nan')
+
+
+def run_scenario(targets, burst_size, llm_latency, args):
+    """运行单个场景并返回统计结果"""
+    fake = FakeWeChatBackend(
+        chats=targets,
+        rate=args.rate,
+        hot_chats=max(1, targets // 10),
+        hot_rate=args.hot_rate,
+        burst_size=burst_size,
+        burst_interval=args.burst_interval,
+        poll_delay=args.poll_delay,
+        send_delay=args.send_delay,
+        seed=42
+    )
+    with StubOpenAIServer(latency=llm_latency) as server:
+        ai = create_ai_handler({
+            'api_key': 'sk-bench',
+            'service': server.base_url,
+            'model': 'stub-model',
+            'timeout': 30,
+            'async_backend': args.async_backend,
+            'max_concurrency': args.max_concurrency
+        })
+        wechat = WeChatHandler({
+            'listen_targets': list(fake.chat_names),
+            'max_calls_per_second': args.max_calls_per_second
+        }, backend=fake)
+        monitor = MessageMonitor(wechat, ai, {
+            'max_workers': args.workers,
+            'response_delay': args.response_delay,
+            'journal': {'path': args.journal} if args.journal else {}
+        })
+        if args.journal and os.path.exists(args.journal):
+            os.remove(args.journal)  # 每个场景从空日志开始，不重放上一个场景的消息
+
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        monitor.start()
+        time.sleep(args.duration)
+        monitor.stop()
+        monitor.wait()
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+        ai.close()
+
+    stats = fake.stats()
+    latencies = fake.latencies
+    return {
+        'targets': targets,
+        'burst_size': burst_size,
+        'llm_latency': llm_latency,
+        'ingested_per_sec': stats['generated'] / wall,
+        'replied': stats['replied'],
+        'unreplied': stats['unreplied'],
+        'p50': _percentile(latencies, 50),
+        'p95': _percentile(latencies, 95),
+        'p99': _percentile(latencies, 99),
+        'cpu_percent': cpu / wall * 100,
+        'rss_mb': _rss_mb()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='消息管线端到端基准测试')
+    parser.add_argument('--targets', type=int, nargs='+', default=[10, 50, 100], help='监听目标数量')
+    parser.add_argument('--bursts', type=int, nargs='+', default=[0, 20], help='突发消息数量')
+    parser.add_argument('--llm-latency', type=float, nargs='+', default=[0.2, 1.0], help='模拟LLM延迟（秒）')
+    parser.add_argument('--duration', type=float, default=10.0, help='每个场景的运行时长（秒）')
+    parser.add_argument('--rate', type=float, default=0.05, help='普通聊天每秒消息数')
+    parser.add_argument('--hot-rate', type=float, default=1.0, help='高频聊天每秒消息数')
+    parser.add_argument('--burst-interval', type=float, default=5.0, help='突发周期（秒）')
+    parser.add_argument('--poll-delay', type=float, default=0.0, help='模拟每次获取消息的耗时（秒）')
+    parser.add_argument('--send-delay', type=float, default=0.0, help='模拟每次发送消息的耗时（秒）')
+    parser.add_argument('--response-delay', type=float, default=1.0, help='消息合并等待时间（秒）')
+    parser.add_argument('--workers', type=int, default=4, help='AI工作线程数')
+    parser.add_argument('--max-calls-per-second', type=float, default=200, help='获取消息的调用速率上限')
+    parser.add_argument('--async-backend', action='store_true', help='使用异步AI后端')
+    parser.add_argument('--max-concurrency', type=int, default=32, help='异步后端并发上限')
+    parser.add_argument('--journal', help='开启预写日志并写入该文件，用于测量其开销')
+    parser.add_argument('--json', help='将结果以JSON格式写入该文件')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+
+    print(f"{'目标数':>6} {'突发':>4} {'LLM延迟':>7} {'接收/秒':>8} {'已回复':>6} {'未回复':>6} "
+          f"{'p50(s)':>7} {'p95(s)':>7} {'p99(s)':>7} {'CPU%':>6} {'RSS(MB)':>8}")
+    results = []
+    for targets, burst_size, llm_latency in itertools.product(args.targets, args.bursts, args.llm_latency):
+        result = run_scenario(targets, burst_size, llm_latency, args)
+        results.append(result)
+        print(f"{targets:>6} {burst_size:>4} {llm_latency:>7.2f} {result['ingested_per_sec']:>8.1f} "
+              f"{result['replied']:>6} {result['unreplied']:>6} {result['p50']:>7.2f} {result['p95']:>7.2f} "
+              f"{result['p99']:>7.2f} {result['cpu_percent']:>6.1f} {result['rss_mb']:>8.1f}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
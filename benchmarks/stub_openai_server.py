@@ -0,0 +1,167 @@
+"""本地OpenAI兼容接口桩服务，用于基准测试
+
+只实现 /chat/completions 接口，返回固定内容，可配置模拟延迟和注入错误响应。
+"""
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # 支持长连接
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        self.server.count_connection()
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self.send_error(404)
+            return
+
+        self.server.count_request(body)
+        failure = self.server.next_failure()
+        if failure is not None:
+            self._send_failure(*failure)
+            return
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if body.get('stream'):
+            self._send_stream(body)
+            return
+
+        payload = json.dumps({
+            'id': 'chatcmpl-stub',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body.get('model', 'stub'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': self.server.reply},
+                'finish_reason': 'stop'
+            }],
+            'usage': {'prompt_tokens': 10, 'completion_tokens': 10, 'total_tokens': 20}
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_failure(self, status, retry_after):
+        payload = json.dumps({'error': {'message': f'stub error {status}', 'type': 'stub_error'}}).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        if retry_after is not None:
+            self.send_header('Retry-After', str(retry_after))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_stream(self, body):
+        """以SSE分块返回回复，每块之间间隔 stream_interval 秒"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        reply = self.server.reply
+        step = max(1, self.server.stream_chunk_chars)
+        pieces = [reply[i:i + step] for i in range(0, len(reply), step)]
+        for index, piece in enumerate(pieces):
+            if index and self.server.stream_interval:
+                time.sleep(self.server.stream_interval)
+            self._write_chunk(self._sse({
+                'id': 'chatcmpl-stub',
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': body.get('model', 'stub'),
+                'choices': [{'index': 0, 'delta': {'content': piece}, 'finish_reason': None}]
+            }))
+        self._write_chunk(b'data: [DONE]\n\n')
+        self.wfile.write(b'0\r\n\r\n')
+
+    @staticmethod
+    def _sse(data):
+        return b'data: ' + json.dumps(data).encode('utf-8') + b'\n\n'
+
+    def _write_chunk(self, data):
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        self.wfile.flush()
+
+
+class StubOpenAIServer(ThreadingHTTPServer):
+    """在后台线程中运行的OpenAI兼容桩服务
+
+    Args:
+        latency: 每个请求的模拟处理延迟（秒）
+        reply: 返回的回复内容
+        stream_interval: 流式响应中相邻两块的间隔（秒）
+        stream_chunk_chars: 流式响应每块的字符数
+    """
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, latency: float = 0.0, reply: str = '好的，收到。',
+                 stream_interval: float = 0.0, stream_chunk_chars: int = 2):
+        super().__init__(('127.0.0.1', 0), _StubHandler)
+        self.latency = latency
+        self.reply = reply
+        self.stream_interval = stream_interval
+        self.stream_chunk_chars = stream_chunk_chars
+        self.connections = 0
+        self.requests = 0
+        self.prompt_cache_keys = {}  # prompt_cache_key -> 请求数
+        self._failures = deque()  # 待返回的错误响应 (状态码, Retry-After)
+        self._count_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        return f'http://127.0.0.1:{self.server_address[1]}/v1'
+
+    def fail_next(self, status: int, count: int = 1, retry_after=None):
+        """接下来的 count 个请求返回 status 错误，可附带 Retry-After 响应头"""
+        with self._count_lock:
+            self._failures.extend([(status, retry_after)] * count)
+
+    def next_failure(self):
+        with self._count_lock:
+            return self._failures.popleft() if self._failures else None
+
+    def count_connection(self):
+        with self._count_lock:
+            self.connections += 1
+
+    def count_request(self, body=None):
+        with self._count_lock:
+            self.requests += 1
+            key = (body or {}).get('prompt_cache_key')
+            if key:
+                self.prompt_cache_keys[key] = self.prompt_cache_keys.get(key, 0) + 1
+
+    def handle_error(self, request, client_address):
+        # 客户端在压测结束时断开连接属于正常情况
+        pass
+
+    def start(self) -> 'StubOpenAIServer':
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -1,23 +1,21 @@
 import sys
-import time
-from collections import deque
-from datetime import datetime, timedelta
-from typing import Optional
 from PyQt5.QtWidgets import QApplication
-from PyQt5.QtCore import QThread, pyqtSignal, Qt, QtCriticalMsg, QtWarningMsg, QtFatalMsg, qInstallMessageHandler
+from PyQt5.QtCore import QThread, QTimer, pyqtSignal, QtCriticalMsg, QtWarningMsg, QtFatalMsg, qInstallMessageHandler
 from PyQt5.QtGui import QTextCursor
 import pywintypes  # 添加这一行
-from src.config import WECHAT_CONFIG, AI_CONFIG, UI_CONFIG
+from src.config import WECHAT_CONFIG, AI_CONFIG, UI_CONFIG, MONITOR_CONFIG, LOG_CONFIG, METRICS_CONFIG
 from src.wechat_handler import WeChatHandler
-from src.ai_handler import AIHandler
+from src.ai_handler import create_ai_handler
 from src.ui import ChatWindow
-from src.message_cache import MessageCache
+from src.ui_bridge import UIUpdateBridge
+from src.message_monitor import MessageMonitor
 from src.logger import setup_logger
+from src.metrics import MetricsExporter
 from src.exception_handler import GlobalExceptionHandler, setup_thread_exception_hook
 import logging
 
 # 初始化日志系统
-logger = setup_logger()
+logger = setup_logger(LOG_CONFIG)
 
 # 安装全局异常处理器
 exception_handler = GlobalExceptionHandler(logger)
@@ -30,120 +28,6 @@ setup_thread_exception_hook()
 from PyQt5.QtCore import QMetaType
 QMetaType.type("QTextCursor")
 
-from src.message_cache import MessageCache
-
-class MessageMonitor(QThread):
-    message_received = pyqtSignal(str, dict)  # 添加这行
-    status_updated = pyqtSignal(str)  # 添加这行
-    
-    def __init__(self, wechat_handler: WeChatHandler, ai_handler: AIHandler):
-        super().__init__()
-        self.logger = logging.getLogger(__name__)
-        self.wechat = wechat_handler
-        self.ai = ai_handler
-        self.running = False
-        self.message_cache = MessageCache()
-        self.last_ai_responses = {}  # 记录每个用户最近3次AI的回复
-        self.listen_targets = set()  # 添加监听目标集合
-        self.logger.info("消息监控器初始化完成")
-
-    def update_listen_targets(self, targets):
-        """更新监听目标列表"""
-        self.listen_targets = set(targets)
-        self.logger.info(f"更新监听目标: {', '.join(targets)}")
-
-    def check_and_process_messages(self):
-        """检查并处理所有用户的缓存消息"""
-        for sender in list(self.message_cache.user_messages.keys()):
-            combined_message = self.message_cache.get_combined_messages(sender)
-            if combined_message:
-                try:
-                    status_msg = f'开始处理来自 {sender} 的消息组合'
-                    self.logger.info(status_msg)
-                    self.status_updated.emit(status_msg)
-                    
-                    prompt = f"用户发送了以下多条消息：\n{combined_message}\n请统一回复这些消息。"
-                    self.logger.debug(f'发送到AI的消息: {prompt}')
-                    self.status_updated.emit(f'发送到AI的消息: {prompt}')
-                    
-                    ai_response = self.ai.process_message(prompt)
-                    if ai_response:
-                        # 保存AI的回复到历史记录
-                        if sender not in self.last_ai_responses:
-                            self.last_ai_responses[sender] = []
-                        self.last_ai_responses[sender].append(ai_response)
-                        if len(self.last_ai_responses[sender]) > 3:
-                            self.last_ai_responses[sender].pop(0)  # 保持最近3条记录
-                            
-                        self.logger.info(f'收到AI回复: {ai_response[:100]}{"..." if len(ai_response) > 100 else ""}')
-                        self.status_updated.emit(f'收到AI回复: {ai_response}')
-                        
-                        if self.wechat.send_message(ai_response, sender):
-                            self.logger.info(f'已成功发送回复到 {sender}')
-                            self.status_updated.emit(f'已成功发送回复到 {sender}')
-                            self.message_received.emit('AI助手', {
-                                'type': 'Text',
-                                'content': ai_response,
-                                'time': datetime.now(),
-                                'id': 'ai_response'
-                            })
-                        else:
-                            self.logger.error(f'发送消息到 {sender} 失败')
-                            self.status_updated.emit(f'发送消息到 {sender} 失败')
-                except Exception as e:
-                    self.logger.error(f'AI处理失败: {str(e)}', exc_info=True)
-                    self.status_updated.emit(f'AI处理失败: {str(e)}')
-
-    def run(self):
-        self.logger.info("消息监控线程启动")
-        self.running = True
-        while self.running:
-            try:
-                messages = self.wechat.get_new_messages()
-                for sender, msg_list in messages.items():
-                    # 只处理在监听列表中的目标消息
-                    if self.listen_targets and sender not in self.listen_targets:
-                        self.logger.debug(f"跳过非监听目标 {sender} 的消息")
-                        continue
-                        
-                    for msg in msg_list:
-                        self.logger.info(f"收到来自 {sender} 的消息: {msg.get('content', '')[:100]}")
-                        self.message_received.emit(sender, msg)
-                        
-                        if msg['type'] == 'Text' or msg['type'] == '文本消息':
-                            if sender == 'AI助手' or msg.get('id') == 'ai_response':
-                                self.logger.debug("跳过AI助手自己的消息")
-                                continue
-                            
-                            if not self.wechat.ui.is_auto_reply_enabled():
-                                self.logger.debug("自动回复已禁用，跳过处理")
-                                continue
-                            
-                            # 检查消息内容是否在最近3次AI回复中
-                            content = msg.get('content', '')
-                            if sender in self.last_ai_responses and content in self.last_ai_responses[sender]:
-                                self.logger.info(f'跳过缓存AI回复内容: {content[:50]}{"..." if len(content) > 50 else ""}')
-                                self.status_updated.emit(f'跳过缓存AI回复内容: {content}')
-                                continue
-                            
-                            # 缓存消息
-                            self.message_cache.add_message(sender, content)
-                            self.logger.info(f'已缓存来自 {sender} 的消息: {content[:50]}{"..." if len(content) > 50 else ""}')
-                            self.status_updated.emit(f'已缓存来自 {sender} 的消息: {content}')
-                
-                # 定期检查是否有需要处理的消息
-                self.check_and_process_messages()
-                
-            except Exception as e:
-                self.logger.error(f'监听出错: {str(e)}', exc_info=True)
-                self.status_updated.emit(f'监听出错: {str(e)}')
-            
-            time.sleep(0.1)
-    
-    def stop(self):
-        self.logger.info("停止消息监控线程")
-        self.running = False
-
 class MainApp:
     def __init__(self):
         self.logger = logging.getLogger(__name__)
@@ -163,11 +47,31 @@ class MainApp:
         
         self.window = ChatWindow(UI_CONFIG)
         
+        # 指标导出：本地HTTP端点和定期JSON快照（未配置时不启动）
+        self.metrics_exporter = MetricsExporter(
+            http_host=METRICS_CONFIG['http_host'],
+            http_port=METRICS_CONFIG['http_port'],
+            snapshot_path=METRICS_CONFIG['snapshot_path'] or None,
+            snapshot_interval=METRICS_CONFIG['snapshot_interval']
+        )
+        self.metrics_exporter.start()
+        self.app.aboutToQuit.connect(self.metrics_exporter.stop)
+        # 监控线程的界面更新经由桥接对象合并后批量刷新
+        self.ui_bridge = UIUpdateBridge(
+            self.window,
+            max_flush_per_second=UI_CONFIG['ui_refresh_rate'],
+            max_pending_status=UI_CONFIG['max_pending_status'],
+            max_status_chars=UI_CONFIG['max_status_chars']
+        )
+        # 退出时停止定时刷新，并把剩余的更新交给界面；之后再关闭并删除日志的溢出文件
+        self.app.aboutToQuit.connect(self.ui_bridge.stop)
+        self.app.aboutToQuit.connect(self.window.message_log.close)
+        
         # 提前初始化微信处理器
         self.logger.info("提前初始化微信处理器")
         try:
             self.wechat = WeChatHandler(WECHAT_CONFIG)
-            self.wechat.set_ui(self.window)
+            self.wechat.set_ui(self.window, self.ui_bridge)
         except Exception as e:
             self.logger.error(f"微信处理器初始化失败: {str(e)}", exc_info=True)
             from PyQt5.QtWidgets import QMessageBox
@@ -177,7 +81,7 @@ class MainApp:
         # 提前初始化AI处理器
         self.logger.info("提前初始化AI处理器")
         try:
-            self.ai = AIHandler(AI_CONFIG)
+            self.ai = create_ai_handler(AI_CONFIG)
         except Exception as e:
             self.logger.warning(f"AI处理器初始化失败: {str(e)}")
             self.ai = None  # 设置为None，后续在start_monitoring时再次尝试初始化
@@ -194,9 +98,35 @@ class MainApp:
             self.window.update_status(f'微信初始化失败: {str(e)}，请确保微信已登录')
         
         self.monitor = None
+        # 退出时写入消息去重快照，并关闭AI处理器（分派器、事件循环线程和回复缓存的写入线程）
+        self.app.aboutToQuit.connect(self.save_dedup_snapshot)
+        self.app.aboutToQuit.connect(self.close_ai_handler)
+        
+        # 定时刷新AI服务池各后端的状态和延迟
+        self.provider_stats_timer = QTimer()
+        self.provider_stats_timer.timeout.connect(self.refresh_provider_stats)
+        self.provider_stats_timer.start(UI_CONFIG['provider_stats_interval'])
+        self.refresh_provider_stats()
         
         self.setup_handlers()
     
+    def save_dedup_snapshot(self):
+        if self.wechat is not None:
+            self.wechat.dedup.save()
+    
+    def close_ai_handler(self):
+        if self.ai is not None:
+            try:
+                self.ai.close()
+            except Exception as e:
+                self.logger.error(f"关闭AI处理器失败: {str(e)}", exc_info=True)
+            self.ai = None
+    
+    def refresh_provider_stats(self):
+        """更新界面上的AI服务状态"""
+        if self.ai is not None:
+            self.window.update_provider_stats(self.ai.provider_stats())
+    
     # 在 MainApp 类的 setup_handlers 方法中添加以下代码
     
     def setup_handlers(self):
@@ -279,7 +209,7 @@ class MainApp:
             if not self.ai:
                 self.logger.info("AI处理器未初始化，尝试初始化")
                 try:
-                    self.ai = AIHandler(AI_CONFIG)
+                    self.ai = create_ai_handler(AI_CONFIG)
                     self.logger.info("AI处理器初始化成功")
                 except Exception as e:
                     self.logger.error(f"AI处理器初始化失败: {str(e)}")
@@ -303,7 +233,7 @@ class MainApp:
             if not self.wechat or not hasattr(self.wechat, 'wx') or not self.wechat.wx:
                 self.logger.info("微信未初始化或已失效，尝试重新初始化")
                 self.wechat = WeChatHandler(WECHAT_CONFIG)
-                self.wechat.set_ui(self.window)
+                self.wechat.set_ui(self.window, self.ui_bridge)
                 nickname = self.wechat.initialize()
                 self.logger.info(f"已重新连接微信账号: {nickname}")
                 self.window.update_status(f'已重新连接微信账号: {nickname}')
@@ -318,9 +248,8 @@ class MainApp:
             
             # 先创建监控实例
             self.logger.info("创建消息监控器")
-            self.monitor = MessageMonitor(self.wechat, self.ai)
-            self.monitor.message_received.connect(self.window.add_message)
-            self.monitor.status_updated.connect(self.window.update_status)
+            self.monitor = MessageMonitor(self.wechat, self.ai, MONITOR_CONFIG)
+            self.ui_bridge.attach(self.monitor)
             
             # 设置监听前显示提示
             from PyQt5.QtWidgets import QMessageBox
@@ -409,11 +338,12 @@ class MainApp:
             finished = pyqtSignal()
             status = pyqtSignal(str)
             
-            def __init__(self, monitor, wechat):
+            def __init__(self, monitor, wechat, timeout):
                 super().__init__()
                 self.logger = logging.getLogger(__name__)
                 self.monitor = monitor
                 self.wechat = wechat
+                self.timeout = timeout
                 
             def run(self):
                 try:
@@ -421,7 +351,18 @@ class MainApp:
                         self.status.emit("正在停止消息监控...")
                         self.logger.info("停止消息监控线程")
                         self.monitor.stop()
-                        self.monitor.wait(3000)  # 修改这里，直接传入毫秒值
+                        # 监控线程退出前要等待发送队列发完、预写日志和上下文数据库写完，
+                        # 等待期间每秒刷新一次进度，超过总时限（例如获取消息卡住）时放弃等待
+                        waited = 0
+                        while not self.monitor.wait(1000):
+                            waited += 1
+                            if waited >= self.timeout:
+                                self.logger.warning(f"消息监控线程在 {self.timeout} 秒内没有退出，放弃等待")
+                                self.status.emit(f'停止监听超时：消息监控线程在 {self.timeout} 秒内没有退出，'
+                                                 f'未回复的消息将在下次启动时从预写日志恢复')
+                                self.finished.emit()
+                                return
+                            self.status.emit(f"正在等待未发送的回复和日志写完...（{waited} 秒）")
                         self.logger.info("消息监控线程已停止")
                     
                     if self.wechat:
@@ -438,7 +379,7 @@ class MainApp:
                     self.finished.emit()
         
         # 创建并启动停止线程
-        self.stop_thread = StopMonitorThread(self.monitor, self.wechat)
+        self.stop_thread = StopMonitorThread(self.monitor, self.wechat, MONITOR_CONFIG['stop_timeout'])
         
         # 连接信号
         def on_stop_finished():
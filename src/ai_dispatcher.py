@@ -0,0 +1,169 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Deque, Dict, Iterable, List, Optional
+
+from src.ai_handler import AIHandler, AsyncAIHandler
+from src.metrics import REGISTRY
+
+AI_DISPATCH_WAIT_SECONDS = REGISTRY.histogram('ai_dispatch_wait_seconds', 'AI请求在分派队列中等待并发名额的时间')
+
+class _DispatchRequest:
+    __slots__ = ('message', 'context', 'on_delta', 'future', 'created')
+
+    def __init__(self, message: str, context: Optional[List[Dict]], on_delta: Optional[Callable[[str], None]]):
+        self.message = message
+        self.context = context
+        self.on_delta = on_delta
+        self.future = Future()
+        self.created = time.monotonic()
+
+class AIRequestDispatcher:
+    """按优先级分派AI请求
+
+    所有聊天的AI请求共用 max_concurrency 个并发名额（由消息监控器设为其 max_workers），
+    有空闲名额时立即分派，不额外等待；名额用满时请求排队，名额释放后优先分派普通请求。
+    低优先级目标的请求只在没有普通请求等待时分派，并限制同时进行的数量，
+    避免与需要及时回复的聊天争抢并发。
+    每个请求仍单独发给底层处理器：不同聊天的提示词和上下文不能合并到同一个请求中。
+    """
+
+    def __init__(self, handler: AIHandler, max_concurrency: int = 32,
+                 low_priority_targets: Iterable[str] = (), low_priority_concurrency: int = 2):
+        """
+        Args:
+            handler: 底层AI处理器（同步或异步）
+            max_concurrency: 同时进行的AI请求数上限
+            low_priority_targets: 低优先级的聊天
+            low_priority_concurrency: 同时进行的低优先级请求数上限
+        """
+        self.logger = logging.getLogger(__name__)
+        self.handler = handler
+        self.max_concurrency = max(1, max_concurrency)
+        self.low_priority_targets = set(low_priority_targets)
+        self.low_priority_concurrency = max(1, low_priority_concurrency)
+
+        self._normal: Deque[_DispatchRequest] = deque()
+        self._low: Deque[_DispatchRequest] = deque()
+        self._inflight = 0
+        self._low_inflight = 0
+        self._cond = threading.Condition()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='ai_dispatcher', daemon=True)
+        self._thread.start()
+        self.logger.info(f'AI请求优先级分派已启用: 并发上限 {self.max_concurrency}，'
+                         f'低优先级并发上限 {self.low_priority_concurrency}')
+
+    def __getattr__(self, name):
+        # config、response_cache 等属性直接使用底层处理器的
+        if name == 'handler':
+            raise AttributeError(name)
+        return getattr(self.handler, name)
+
+    def set_max_concurrency(self, max_concurrency: int) -> None:
+        """设置并发上限，消息监控器用它与工作线程数保持一致"""
+        with self._cond:
+            self.max_concurrency = max(1, max_concurrency)
+            self._cond.notify()
+
+    def submit(self, message: str, context: List[Dict] = None,
+               on_delta: Callable[[str], None] = None, target: Optional[str] = None) -> Future:
+        """加入分派队列，返回 concurrent.futures.Future"""
+        request = _DispatchRequest(message, context, on_delta)
+        with self._cond:
+            if not self._running:
+                request.future.set_exception(RuntimeError('AI请求分派器已关闭'))
+                return request.future
+            if target in self.low_priority_targets:
+                self._low.append(request)
+            else:
+                self._normal.append(request)
+            self._cond.notify()
+        return request.future
+
+    def process_message(self, message: str, context: List[Dict] = None,
+                        on_delta: Callable[[str], None] = None) -> Optional[str]:
+        """同步处理消息，阻塞直到AI响应返回"""
+        return self.submit(message, context, on_delta).result()
+
+    def _take(self):
+        """取出下一个可分派的请求，返回 (请求, 是否低优先级)，没有时返回 (None, False)（调用方需持有锁）"""
+        if self._inflight >= self.max_concurrency:
+            return None, False
+        if self._normal:
+            request, low_priority = self._normal.popleft(), False
+        elif self._low and self._low_inflight < self.low_priority_concurrency:
+            request, low_priority = self._low.popleft(), True
+            self._low_inflight += 1
+        else:
+            return None, False
+        self._inflight += 1
+        return request, low_priority
+
+    def _run(self) -> None:
+        # 异步处理器自身即可并发执行；同步处理器需要与并发上限同样大小的线程池，
+        # 线程池只在本线程中创建、使用和替换，并发上限变化时按新的上限重新创建
+        executor = None
+        workers = 0
+        try:
+            while True:
+                retired = None
+                with self._cond:
+                    while True:
+                        if not self._running and not self._normal and not self._low:
+                            return
+                        request, low_priority = self._take()
+                        if request is not None:
+                            break
+                        self._cond.wait()
+                    if not isinstance(self.handler, AsyncAIHandler) and workers != self.max_concurrency:
+                        retired, workers = executor, self.max_concurrency
+                        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ai_dispatch')
+                if retired is not None:
+                    # 进行中的请求照常完成
+                    retired.shutdown(wait=False)
+                AI_DISPATCH_WAIT_SECONDS.observe(time.monotonic() - request.created)
+                self._dispatch(request, low_priority, executor)
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True)
+
+    def _dispatch(self, request: _DispatchRequest, low_priority: bool,
+                  executor: Optional[ThreadPoolExecutor]) -> None:
+        """将单个请求交给底层处理器，完成后释放并发名额并转发结果"""
+        def on_done(future: Future):
+            with self._cond:
+                self._inflight -= 1
+                if low_priority:
+                    self._low_inflight -= 1
+                self._cond.notify()
+            if future.cancelled():
+                request.future.cancel()
+            elif future.exception() is not None:
+                request.future.set_exception(future.exception())
+            else:
+                request.future.set_result(future.result())
+
+        try:
+            if isinstance(self.handler, AsyncAIHandler):
+                future = self.handler.submit(request.message, request.context, request.on_delta)
+            else:
+                future = executor.submit(self.handler.process_message,
+                                         request.message, request.context, request.on_delta)
+        except Exception as e:
+            future = Future()
+            future.set_exception(e)
+        future.add_done_callback(on_done)
+
+    def update_config(self, config: dict) -> None:
+        self.handler.update_config(config)
+
+    def close(self) -> None:
+        """分派完队列中剩余的请求、等待进行中的请求完成后关闭底层处理器"""
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        self._thread.join()
+        self.handler.close()
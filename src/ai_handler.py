@@ -1,6 +1,18 @@
+import asyncio
+import hashlib
 import logging
+import threading
+import time
+from concurrent.futures import Future
+import httpx
 import openai
-from typing import Dict, Optional, List
+from src.conversation_store import estimate_tokens
+from src.provider_pool import Provider, ProviderPool
+from src.rate_limiter import RateLimiter
+from src.response_cache import ResponseCache
+from src.resilience import RetryPolicy
+from src.metrics import ERRORS, LLM_LATENCY_SECONDS, LLM_REQUESTS, LLM_TOKENS, LLM_TOKENS_PER_REQUEST
+from typing import Callable, Dict, Optional, List
 
 class AIServiceError(Exception):
     """AI服务异常基类"""
@@ -14,56 +26,438 @@ class ProcessingError(AIServiceError):
     """消息处理异常"""
     pass
 
+class CircuitOpenError(ProcessingError):
+    """AI服务熔断中，请求被直接拒绝"""
+    def __init__(self, message: str, retry_in: float = 0.0):
+        super().__init__(message)
+        self.retry_in = retry_in  # 距离熔断器允许探测的秒数
+
+class RateLimitedError(ProcessingError):
+    """客户端限流额度不足，请求被拒绝"""
+    def __init__(self, message: str, retry_in: float = 0.0):
+        super().__init__(message)
+        self.retry_in = retry_in  # 按当前余额距离有额度的秒数
+
+def _http2_available() -> bool:
+    """检查是否安装了HTTP/2支持库(h2)"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
 class AIHandler:
     def __init__(self, config: dict):
         self.logger = logging.getLogger(__name__)
         self.config = config
         self.service = 'openai'  # 默认使用openai服务
+        self._client_lock = threading.Lock()
+        self.response_cache = self._create_response_cache(config.get('response_cache') or {})
+        self.rate_limiter = self._create_rate_limiter(config.get('rate_limit') or {})
+        self.provider_pool = ProviderPool([])
+        self._configure_resilience(config)
         self.setup_service()
+        self._ensure_client()
     
-    def process_message(self, message: str, context: List[Dict] = None) -> Optional[str]:
-        """处理消息并获取AI响应"""
+    def process_message(self, message: str, context: List[Dict] = None,
+                        on_delta: Callable[[str], None] = None) -> Optional[str]:
+        """处理消息并获取AI响应
+        
+        Args:
+            message: 用户消息
+            context: 上下文消息列表
+            on_delta: 流式模式回调，传入时以 stream=True 请求，每收到一段内容调用一次
+            
+        Returns:
+            完整的AI回复
+        """
         try:
             self.logger.info(f'开始处理消息: {message[:100]}{"..." if len(message) > 100 else ""}')
-            messages = [
-                {
-                    "role": "system",
-                    "content": self.config.get('system_prompt', 
-                        "你是一个友好的AI助手，请用简洁自然的方式回复用户的问题。")
-                }
-            ]
-            if context:
-                self.logger.debug(f'使用上下文: {len(context)} 条消息')
-                messages.extend(context)
-            messages.append({
-                'role': 'user',
-                'content': message
-            })
+            messages = self._build_messages(message, context)
+            params = self._completion_params(messages)
+            cache_key, cached = self._cache_lookup(params, context, on_delta)
+            if cached is not None:
+                return cached
             
             self.logger.info(f'使用模型 {self.config.get("model")} 发送请求')
-            client = openai.OpenAI(
-                api_key=self.config['api_key'],
-                base_url=self.config.get('service')
-            )
-            
-            response = client.chat.completions.create(
-                model=self.config.get('model'),
-                messages=messages,
-                temperature=self.config.get('temperature', 0.7),
-                max_tokens=self.config.get('max_tokens', 800),
-                presence_penalty=self.config.get('presence_penalty', 0.9),
-                frequency_penalty=self.config.get('frequency_penalty', 0.0),
-                top_p=self.config.get('top_p', 0.0)
-            )
-            
-            reply = response.choices[0].message.content
+            reply = self._request_with_retry(params, on_delta)
             self.logger.info(f'收到AI响应: {reply[:100]}{"..." if len(reply) > 100 else ""}')
+            self._cache_store(cache_key, reply)
             return reply
+        except (CircuitOpenError, RateLimitedError):
+            raise
         except Exception as e:
+            LLM_REQUESTS.inc(result='error')
+            ERRORS.inc(stage='llm', type=type(e).__name__)
             error_msg = f'处理消息失败: {str(e)}'
             self.logger.error(error_msg, exc_info=True)  # 添加异常堆栈信息
             raise ProcessingError(error_msg)
     
+    def _request_with_retry(self, params: Dict, on_delta: Callable[[str], None] = None) -> str:
+        """从服务池分配后端发送请求，失败时切换到其他健康后端，没有可切换的后端时按重试策略退避重试
+        
+        流式请求一旦已经输出内容就不再重试，避免重复显示或重复提前发送。
+        """
+        # 限流额度按逻辑请求预留一次，切换后端和重试不再重复扣减
+        reserved = self._estimate_tokens(params)
+        if self.rate_limiter is not None and not self.rate_limiter.acquire(reserved):
+            self._raise_rate_limited(reserved)
+        failed = []
+        attempt = 0
+        sent = False  # 是否有一次请求到达了服务端
+        try:
+            while True:
+                provider = self.provider_pool.acquire(reserved, failed, timeout=self.provider_wait_timeout)
+                if provider is None:
+                    self._raise_unavailable()
+                emitted = []
+                forward = None
+                if on_delta is not None:
+                    def forward(delta):
+                        emitted.append(True)
+                        on_delta(delta)
+                started = time.perf_counter()
+                try:
+                    reply, used = self._request(self._ensure_client(provider), provider, params, forward)
+                except Exception as e:
+                    sent = sent or bool(emitted) or self._reached_provider(e)
+                    delay = self._handle_request_failure(provider, e, reserved, attempt, bool(emitted), failed)
+                    if delay is None:
+                        raise
+                    if delay:
+                        attempt += 1
+                        time.sleep(delay)
+                    continue
+                sent = True
+                self._settle(provider, reserved, used, started)
+                return reply
+        except BaseException:
+            if not sent:
+                self._cancel_reservation(reserved)
+            raise
+    
+    def _request(self, client, provider: Provider, params: Dict,
+                 on_delta: Callable[[str], None] = None) -> tuple:
+        """向指定后端发送一次请求，返回 (完整回复, 实际消耗的token数)"""
+        params = dict(params, model=provider.model)
+        started = time.perf_counter()
+        usage = None
+        if on_delta is not None:
+            parts = []
+            stream = client.chat.completions.create(stream=True, **params)
+            for chunk in stream:
+                usage = getattr(chunk, 'usage', None) or usage
+                delta = self._chunk_text(chunk)
+                if delta:
+                    parts.append(delta)
+                    on_delta(delta)
+            reply = ''.join(parts)
+        else:
+            response = client.chat.completions.create(**params)
+            usage = response.usage
+            reply = response.choices[0].message.content
+        self._observe_request(started, usage, provider.name)
+        return reply, usage.total_tokens if usage is not None else None
+    
+    def _configure_resilience(self, config: dict) -> None:
+        """重试、熔断与服务池：临时性错误按退避重试，后端持续故障时熔断并切换到其他后端"""
+        retry_config = config.get('retry') or {}
+        self.retry_policy = RetryPolicy(
+            max_retries=retry_config.get('max_retries', 3),
+            base_delay=retry_config.get('base_delay', 0.5),
+            max_delay=retry_config.get('max_delay', 20.0)
+        )
+        self.provider_wait_timeout = config.get('provider_wait_timeout', 30.0)
+        breaker_config = config.get('circuit_breaker') or {}
+        failure_threshold = breaker_config.get('failure_threshold', 5)
+        recovery_timeout = breaker_config.get('recovery_timeout', 30.0)
+        
+        # 未配置 providers 时服务池只有一个使用顶层配置的后端
+        base = {k: v for k, v in config.items() if k != 'providers'}
+        specs = config.get('providers') or [{'name': 'default'}]
+        existing = {p.name: p for p in self.provider_pool.providers}
+        providers = []
+        for index, spec in enumerate(specs):
+            provider_config = dict(base, **{k: v for k, v in spec.items()
+                                            if k not in ('name', 'weight', 'max_concurrency', 'tpm')})
+            name = spec.get('name') or f'{provider_config.get("model")}#{index + 1}'
+            provider = existing.pop(name, None)
+            if provider is None:
+                provider = Provider(name, provider_config, failure_threshold=failure_threshold,
+                                    recovery_timeout=recovery_timeout)
+            else:
+                # 保留已有后端的熔断状态、统计和客户端，只更新配置
+                provider.config = provider_config
+                provider.breaker.failure_threshold = max(1, failure_threshold)
+                provider.breaker.recovery_timeout = recovery_timeout
+            provider.weight = max(0.01, float(spec.get('weight', 1.0)))
+            provider.max_concurrency = max(0, int(spec.get('max_concurrency', 0)))
+            provider.tpm = max(0, int(spec.get('tpm', 0)))
+            providers.append(provider)
+        self.provider_pool.set_providers(providers)
+        for provider in existing.values():
+            self._release_client(provider)
+        if len(providers) > 1:
+            self.logger.info(f'AI服务池: {", ".join(p.name for p in providers)}')
+    
+    def _estimate_tokens(self, params: Dict) -> int:
+        """估算请求的token数（提示词 + 最大生成长度），用于每分钟token预算"""
+        prompt = sum(estimate_tokens(m.get('content') or '') for m in params['messages'])
+        return prompt + int(params.get('max_tokens') or 0)
+    
+    def _create_rate_limiter(self, limit_config: dict) -> Optional[RateLimiter]:
+        """按配置创建客户端限流器，未设置 rpm 和 tpm 时返回None"""
+        if not limit_config.get('rpm') and not limit_config.get('tpm'):
+            return None
+        self.logger.info(f'启用客户端限流: RPM {limit_config.get("rpm", 0)}, TPM {limit_config.get("tpm", 0)}, '
+                         f'模式 {limit_config.get("mode", "queue")}')
+        return RateLimiter(
+            rpm=limit_config.get('rpm', 0),
+            tpm=limit_config.get('tpm', 0),
+            mode=limit_config.get('mode', 'queue'),
+            max_wait=limit_config.get('max_wait', 30.0),
+            burst_seconds=limit_config.get('burst_seconds', 6.0)
+        )
+    
+    def _raise_rate_limited(self, reserved: int) -> None:
+        LLM_REQUESTS.inc(result='rate_limited')
+        retry_in = self.rate_limiter.retry_in(reserved)
+        raise RateLimitedError(f'AI请求超出客户端限流额度，约 {retry_in:.0f} 秒后有额度', retry_in)
+    
+    def _settle(self, provider: Provider, reserved: int, used: Optional[int], started: float) -> None:
+        """请求成功：归还后端并按实际token用量修正限流额度"""
+        self.provider_pool.release(provider, 'ok', reserved, used, time.perf_counter() - started)
+        if self.rate_limiter is not None and used is not None:
+            self.rate_limiter.refund(reserved - used)
+    
+    @staticmethod
+    def _reached_provider(exc: Exception) -> bool:
+        """请求是否可能已被服务端受理：连接失败的请求没有发出，超时的请求可能已在服务端处理"""
+        return not isinstance(exc, openai.APIConnectionError) or isinstance(exc, openai.APITimeoutError)
+
+    def _cancel_reservation(self, reserved: int) -> None:
+        """请求在本地被拒绝（熔断、等待后端超时）或始终没有连上服务端时，退还预留的限流额度"""
+        if self.rate_limiter is not None:
+            self.rate_limiter.cancel(reserved)
+
+    def _raise_unavailable(self) -> None:
+        """没有可用后端：全部熔断时抛出 CircuitOpenError，否则是等待容量超时"""
+        if not self.provider_pool.has_alternative(()):
+            LLM_REQUESTS.inc(result='circuit_open')
+            retry_in = self.provider_pool.retry_in()
+            raise CircuitOpenError(f'AI服务暂时不可用（已熔断），{retry_in:.0f} 秒后重试', retry_in)
+        raise ProcessingError(f'等待 {self.provider_wait_timeout} 秒后所有AI服务仍已达到并发或token上限')
+    
+    def _is_provider_error(self, exc: Exception) -> bool:
+        """是否为后端自身的故障（可重试的错误，或密钥、权限、模型不可用），计入熔断并切换后端"""
+        return self.retry_policy.is_retryable(exc) or isinstance(
+            exc, (openai.AuthenticationError, openai.PermissionDeniedError, openai.NotFoundError))
+    
+    def _handle_request_failure(self, provider: Provider, exc: Exception, reserved: int, attempt: int,
+                                emitted: bool, failed: List[Provider]) -> Optional[float]:
+        """归还后端并决定下一步：切换后端返回0，退避重试返回等待秒数，不再重试返回None"""
+        provider_error = self._is_provider_error(exc)
+        if not provider_error or emitted:
+            self.provider_pool.release(provider, 'failure' if provider_error else 'abort', reserved)
+            return None
+        failed.append(provider)
+        if self.provider_pool.has_alternative(failed):
+            self.provider_pool.release(provider, 'failure', reserved)
+            LLM_REQUESTS.inc(result='fallback')
+            self.logger.warning('AI服务 %s 请求失败（%s），切换到其他服务', provider.name, type(exc).__name__)
+            return 0.0
+        if not self.retry_policy.is_retryable(exc) or attempt >= self.retry_policy.max_retries:
+            self.provider_pool.release(provider, 'failure', reserved)
+            return None
+        # 原地重试的中间失败不计入熔断，一个请求最终失败才算一次
+        self.provider_pool.release(provider, 'retry', reserved)
+        delay = self.retry_policy.delay(attempt, exc)
+        LLM_REQUESTS.inc(result='retry')
+        self.logger.warning('AI服务 %s 请求失败（%s），%.1f 秒后第 %d 次重试',
+                            provider.name, type(exc).__name__, delay, attempt + 1)
+        return delay
+    
+    def provider_stats(self) -> List[Dict]:
+        """各后端的状态、负载和延迟统计"""
+        return self.provider_pool.stats()
+    
+    def _build_messages(self, message: str, context: List[Dict] = None) -> List[Dict]:
+        """构建发送给模型的消息列表"""
+        messages = [
+            {
+                "role": "system",
+                "content": self.config.get('system_prompt', 
+                    "你是一个友好的AI助手，请用简洁自然的方式回复用户的问题。")
+            }
+        ]
+        if context:
+            self.logger.debug(f'使用上下文: {len(context)} 条消息')
+            messages.extend(context)
+        messages.append({
+            'role': 'user',
+            'content': message
+        })
+        return messages
+    
+    @staticmethod
+    def _observe_request(started: float, usage, provider: str) -> None:
+        """记录一次AI请求的耗时和token用量"""
+        LLM_LATENCY_SECONDS.observe(time.perf_counter() - started, provider=provider)
+        LLM_REQUESTS.inc(result='ok')
+        if usage is not None:
+            LLM_TOKENS.inc(usage.prompt_tokens or 0, kind='prompt')
+            LLM_TOKENS.inc(usage.completion_tokens or 0, kind='completion')
+            LLM_TOKENS_PER_REQUEST.observe(usage.total_tokens or 0)
+    
+    @staticmethod
+    def _chunk_text(chunk) -> str:
+        """提取流式响应块中的增量文本"""
+        if not chunk.choices:
+            return ''
+        return chunk.choices[0].delta.content or ''
+    
+    def _completion_params(self, messages: List[Dict]) -> Dict:
+        """构建chat.completions.create的请求参数"""
+        params = {
+            'model': self.config.get('model'),
+            'messages': messages,
+            'temperature': self.config.get('temperature', 0.7),
+            'max_tokens': self.config.get('max_tokens', 800),
+            'presence_penalty': self.config.get('presence_penalty', 0.9),
+            'frequency_penalty': self.config.get('frequency_penalty', 0.0),
+            'top_p': self.config.get('top_p', 0.0)
+        }
+        if self.config.get('prompt_cache_hint'):
+            # 共享同一系统提示词的请求使用相同的缓存键，便于服务端命中前缀缓存
+            params['extra_body'] = {'prompt_cache_key': self._prompt_cache_key(messages)}
+        return params
+    
+    def _prompt_cache_key(self, messages: List[Dict]) -> str:
+        """根据模型和系统提示词生成服务端前缀缓存键"""
+        prefix = f"{self.config.get('model')}\n{messages[0]['content'] if messages else ''}"
+        return 'wxai-' + hashlib.sha256(prefix.encode('utf-8')).hexdigest()[:32]
+    
+    def _create_response_cache(self, cache_config: dict) -> Optional[ResponseCache]:
+        """按配置创建AI回复缓存，未启用时返回None"""
+        if not cache_config.get('enabled'):
+            return None
+        self.logger.info('已启用AI回复缓存')
+        return ResponseCache(
+            max_entries=cache_config.get('max_entries', 1000),
+            max_bytes=cache_config.get('max_bytes', 4 * 1024 * 1024),
+            ttl=cache_config.get('ttl', 3600),
+            db_path=cache_config.get('db_path'),
+            commit_interval=cache_config.get('commit_interval', 0.5)
+        )
+    
+    def _cache_lookup(self, params: Dict, context: Optional[List[Dict]],
+                      on_delta: Callable[[str], None] = None) -> tuple:
+        """查询回复缓存
+        
+        Returns:
+            (缓存键, 缓存的回复)；不适用缓存时缓存键为None，未命中时回复为None
+        """
+        if self.response_cache is None:
+            return None, None
+        cache_config = self.config.get('response_cache') or {}
+        # 高创造性的请求期望每次回复不同，不使用缓存
+        bypass_above = cache_config.get('bypass_temperature_above')
+        if bypass_above is not None and params['temperature'] > bypass_above:
+            return None, None
+        # 缓存键包含上下文，带上下文的请求几乎不会命中，默认不查询也不写入
+        if context and not cache_config.get('cache_with_context', False):
+            return None, None
+        
+        sampling = {k: v for k, v in params.items() if k not in ('model', 'messages', 'extra_body')}
+        key = ResponseCache.make_key(params['model'], sampling, params['messages'])
+        reply = self.response_cache.get(key)
+        if reply is not None:
+            LLM_REQUESTS.inc(result='cache_hit')
+            self.logger.info(f'命中AI回复缓存: {reply[:100]}{"..." if len(reply) > 100 else ""}')
+            if on_delta is not None:
+                on_delta(reply)
+        return key, reply
+    
+    def _cache_store(self, key: Optional[str], reply: Optional[str]) -> None:
+        """将回复写入缓存"""
+        if key is not None and reply:
+            self.response_cache.put(key, reply)
+    
+    def _get_client_settings(self, config: dict) -> tuple:
+        """返回决定客户端是否需要重建的配置项"""
+        return (
+            config.get('api_key'),
+            config.get('service') or None,
+            config.get('timeout', 30),
+            config.get('max_connections', 20),
+            config.get('max_keepalive_connections', 10),
+            config.get('keepalive_expiry', 60),
+            bool(config.get('http2', True))
+        )
+    
+    @staticmethod
+    def _http_timeout(timeout: float) -> httpx.Timeout:
+        """连接超时单独设短，服务不可达时尽快失败并进入重试，而不是等满整个请求超时"""
+        return httpx.Timeout(timeout, connect=min(5.0, timeout))
+    
+    def _build_client(self, settings: tuple) -> openai.OpenAI:
+        """创建带连接池的长连接客户端"""
+        api_key, base_url, timeout, max_connections, max_keepalive, keepalive_expiry, http2 = settings
+        if http2 and not _http2_available():
+            self.logger.info('未安装h2库，HTTP/2不可用，使用HTTP/1.1长连接')
+            http2 = False
+        
+        http_client = httpx.Client(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive,
+                keepalive_expiry=keepalive_expiry
+            ),
+            timeout=self._http_timeout(timeout),
+            http2=http2
+        )
+        self.logger.info(f'创建AI客户端: 最大连接数 {max_connections}, 长连接数 {max_keepalive}, HTTP/2: {http2}')
+        return openai.OpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            timeout=self._http_timeout(timeout),
+            max_retries=0,  # 重试由 RetryPolicy 统一处理
+            http_client=http_client
+        )
+    
+    def _ensure_client(self, provider: Optional[Provider] = None) -> openai.OpenAI:
+        """获取后端的客户端（默认第一个后端），仅在连接相关配置变化时重建"""
+        if provider is None:
+            provider = self.provider_pool.providers[0]
+        settings = self._get_client_settings(provider.config)
+        with self._client_lock:
+            if provider.client is None or settings != provider.client_settings:
+                old_client = provider.client
+                provider.client = self._build_client(settings)
+                provider.client_settings = settings
+                if old_client is not None:
+                    self.logger.info(f'AI服务 {provider.name} 连接配置已变化，关闭旧客户端')
+                    self._close_client(old_client)
+            return provider.client
+    
+    def _release_client(self, provider: Provider) -> None:
+        """关闭已移出服务池的后端的客户端"""
+        with self._client_lock:
+            client, provider.client, provider.client_settings = provider.client, None, None
+        if client is not None:
+            self._close_client(client)
+    
+    def _close_client(self, client) -> None:
+        """关闭指定客户端"""
+        client.close()
+    
+    def close(self) -> None:
+        """关闭所有后端的客户端及其连接池"""
+        for provider in self.provider_pool.providers:
+            self._release_client(provider)
+        if self.response_cache is not None:
+            self.response_cache.close()
+    
     def setup_service(self) -> None:
         """设置AI服务配置"""
         try:
@@ -91,6 +485,7 @@ class AIHandler:
     def update_config(self, config: dict) -> None:
         """更新AI配置"""
         self.logger.info("更新AI配置")
+        self.config = config
         self.api_key = config.get('api_key', '')
         self.service = config.get('service', '')
         self.model = config.get('model', 'gpt-3.5-turbo')
@@ -100,6 +495,7 @@ class AIHandler:
         self.presence_penalty = config.get('presence_penalty', 0)
         self.frequency_penalty = config.get('frequency_penalty', 0)
         self.top_p = config.get('top_p', 1.0)
+        self._configure_resilience(config)
         
         # 重新初始化客户端
         # 使用与__init__方法中相同的初始化逻辑，而不是调用不存在的_init_client方法
@@ -114,7 +510,213 @@ class AIHandler:
                 self.logger.info(f"使用自定义服务地址: {self.service}")
                 openai.api_base = self.service
             
+            # 仅在api_key/服务地址/超时等连接配置变化时重建客户端
+            for provider in self.provider_pool.providers:
+                self._ensure_client(provider)
+            
             self.logger.info("AI服务配置完成")
         except Exception as e:
             self.logger.error(f"AI服务配置失败: {str(e)}")
-            raise ConfigurationError(f"AI服务配置失败: {str(e)}")
\ No newline at end of file
+            raise ConfigurationError(f"AI服务配置失败: {str(e)}")
+
+
+class AsyncAIHandler(AIHandler):
+    """基于 openai.AsyncOpenAI 的异步AI处理器
+    
+    在独立线程中运行asyncio事件循环，与Qt主循环互不干扰。
+    submit() 可从任意线程提交请求，所有进行中的请求共享同一个事件循环线程，
+    并发数由 max_concurrency 限制。
+    """
+    
+    def __init__(self, config: dict):
+        self.max_concurrency = max(1, int(config.get('max_concurrency', 32)))
+        self._semaphore = None
+        self._loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(target=self._run_loop, name='ai_event_loop', daemon=True)
+        self._loop_thread.start()
+        try:
+            super().__init__(config)
+        except BaseException:
+            # 配置无效时没有调用方持有本对象，不能留下无人关闭的事件循环线程
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._loop_thread.join(timeout=5)
+            if not self._loop_thread.is_alive():
+                self._loop.close()
+            raise
+        self.logger.info(f'异步AI处理器已启动，并发上限: {self.max_concurrency}')
+    
+    def _run_loop(self) -> None:
+        """事件循环线程入口"""
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+    
+    def _build_client(self, settings: tuple) -> openai.AsyncOpenAI:
+        """创建带连接池的异步客户端"""
+        api_key, base_url, timeout, max_connections, max_keepalive, keepalive_expiry, http2 = settings
+        if http2 and not _http2_available():
+            self.logger.info('未安装h2库，HTTP/2不可用，使用HTTP/1.1长连接')
+            http2 = False
+        
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive,
+                keepalive_expiry=keepalive_expiry
+            ),
+            timeout=self._http_timeout(timeout),
+            http2=http2
+        )
+        self.logger.info(f'创建异步AI客户端: 最大连接数 {max_connections}, 长连接数 {max_keepalive}, HTTP/2: {http2}')
+        return openai.AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            timeout=self._http_timeout(timeout),
+            max_retries=0,  # 重试由 RetryPolicy 统一处理
+            http_client=http_client
+        )
+    
+    def _close_client(self, client) -> None:
+        """在事件循环中关闭异步客户端"""
+        if self._loop.is_running():
+            asyncio.run_coroutine_threadsafe(client.close(), self._loop)
+    
+    async def process_message_async(self, message: str, context: List[Dict] = None,
+                                    on_delta: Callable[[str], None] = None) -> Optional[str]:
+        """在事件循环中处理消息并获取AI响应，on_delta 在事件循环线程中被调用"""
+        try:
+            if self._semaphore is None:
+                self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self.logger.info(f'开始处理消息: {message[:100]}{"..." if len(message) > 100 else ""}')
+            messages = self._build_messages(message, context)
+            params = self._completion_params(messages)
+            cache_key, cached = self._cache_lookup(params, context, on_delta)
+            if cached is not None:
+                return cached
+            
+            self.logger.info(f'使用模型 {self.config.get("model")} 发送异步请求')
+            reply = await self._request_with_retry_async(params, on_delta)
+            self.logger.info(f'收到AI响应: {reply[:100]}{"..." if len(reply) > 100 else ""}')
+            self._cache_store(cache_key, reply)
+            return reply
+        except (CircuitOpenError, RateLimitedError):
+            raise
+        except Exception as e:
+            LLM_REQUESTS.inc(result='error')
+            ERRORS.inc(stage='llm', type=type(e).__name__)
+            error_msg = f'处理消息失败: {str(e)}'
+            self.logger.error(error_msg, exc_info=True)
+            raise ProcessingError(error_msg)
+    
+    async def _request_with_retry_async(self, params: Dict, on_delta: Callable[[str], None] = None) -> str:
+        """异步版本的 _request_with_retry，等待容量和退避期间不占用并发名额"""
+        reserved = self._estimate_tokens(params)
+        if self.rate_limiter is not None and not await self.rate_limiter.acquire_async(reserved):
+            self._raise_rate_limited(reserved)
+        failed = []
+        attempt = 0
+        sent = False
+        try:
+            while True:
+                provider = await self._acquire_provider_async(reserved, failed)
+                emitted = []
+                forward = None
+                if on_delta is not None:
+                    def forward(delta):
+                        emitted.append(True)
+                        on_delta(delta)
+                started = time.perf_counter()
+                try:
+                    async with self._semaphore:
+                        reply, used = await self._request_async(self._ensure_client(provider), provider, params, forward)
+                except Exception as e:
+                    sent = sent or bool(emitted) or self._reached_provider(e)
+                    delay = self._handle_request_failure(provider, e, reserved, attempt, bool(emitted), failed)
+                    if delay is None:
+                        raise
+                    if delay:
+                        attempt += 1
+                        await asyncio.sleep(delay)
+                    continue
+                sent = True
+                self._settle(provider, reserved, used, started)
+                return reply
+        except BaseException:
+            if not sent:
+                self._cancel_reservation(reserved)
+            raise
+    
+    async def _acquire_provider_async(self, reserved: int, failed: List[Provider]) -> Provider:
+        """在事件循环中等待可用后端，不阻塞其他请求"""
+        deadline = time.monotonic() + self.provider_wait_timeout
+        while True:
+            provider, wait = self.provider_pool.try_acquire(reserved, failed)
+            if provider is not None:
+                return provider
+            if wait is None or time.monotonic() >= deadline:
+                self._raise_unavailable()
+            await asyncio.sleep(min(wait, max(0.0, deadline - time.monotonic())))
+    
+    async def _request_async(self, client, provider: Provider, params: Dict,
+                             on_delta: Callable[[str], None] = None) -> tuple:
+        """向指定后端发送一次异步请求，返回 (完整回复, 实际消耗的token数)"""
+        params = dict(params, model=provider.model)
+        started = time.perf_counter()
+        usage = None
+        if on_delta is not None:
+            parts = []
+            stream = await client.chat.completions.create(stream=True, **params)
+            async for chunk in stream:
+                usage = getattr(chunk, 'usage', None) or usage
+                delta = self._chunk_text(chunk)
+                if delta:
+                    parts.append(delta)
+                    on_delta(delta)
+            reply = ''.join(parts)
+        else:
+            response = await client.chat.completions.create(**params)
+            usage = response.usage
+            reply = response.choices[0].message.content
+        self._observe_request(started, usage, provider.name)
+        return reply, usage.total_tokens if usage is not None else None
+    
+    def submit(self, message: str, context: List[Dict] = None,
+               on_delta: Callable[[str], None] = None) -> Future:
+        """从任意线程提交请求，返回 concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(
+            self.process_message_async(message, context, on_delta), self._loop)
+    
+    def process_message(self, message: str, context: List[Dict] = None,
+                        on_delta: Callable[[str], None] = None) -> Optional[str]:
+        """同步处理消息，阻塞直到AI响应返回"""
+        return self.submit(message, context, on_delta).result()
+    
+    def close(self) -> None:
+        """关闭所有后端的客户端并停止事件循环线程"""
+        for provider in self.provider_pool.providers:
+            with self._client_lock:
+                client, provider.client, provider.client_settings = provider.client, None, None
+            if client is not None and self._loop.is_running():
+                try:
+                    asyncio.run_coroutine_threadsafe(client.close(), self._loop).result(timeout=5)
+                except Exception as e:
+                    self.logger.warning(f'关闭异步AI客户端失败: {str(e)}')
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop_thread.join(timeout=5)
+        if self.response_cache is not None:
+            self.response_cache.close()
+
+
+def create_ai_handler(config: dict) -> AIHandler:
+    """根据配置创建同步或异步AI处理器，启用优先级分派时外层包装 AIRequestDispatcher"""
+    handler = AsyncAIHandler(config) if config.get('async_backend') else AIHandler(config)
+    dispatch = config.get('dispatch') or {}
+    if not dispatch.get('enabled'):
+        return handler
+    from src.ai_dispatcher import AIRequestDispatcher  # ai_dispatcher 依赖本模块，延迟导入避免循环引用
+    # 并发上限由消息监控器按其 max_workers 设置
+    return AIRequestDispatcher(
+        handler,
+        max_concurrency=config.get('max_concurrency', 32),
+        low_priority_targets=dispatch.get('low_priority_targets', []),
+        low_priority_concurrency=dispatch.get('low_priority_concurrency', 2)
+    )
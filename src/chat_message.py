@@ -0,0 +1,61 @@
+import time
+from datetime import datetime
+from typing import Optional
+
+# MessageCache 中回填的已合并消息组合的类型
+COMBINED_TYPE = '合并消息'
+
+class ChatMessage:
+    """在消息管线中传递的一条聊天消息
+
+    使用 __slots__ 且创建后不可修改：每条消息只占一个小对象，没有逐条的字典，
+    时间保存为 time.time() 时间戳，只在界面显示或导出时才格式化。
+    """
+
+    __slots__ = ('type', 'content', 'timestamp', 'id', 'partial')
+
+    def __init__(self, type: str, content: str, timestamp: Optional[float] = None,
+                 id: Optional[str] = None, partial: bool = False):
+        """
+        Args:
+            type: 消息类型（如 Text、系统消息、处理错误）
+            content: 消息内容
+            timestamp: 收到消息的时间（time.time()），为None时取当前时间
+            id: 消息ID，流式回复用同一ID原地更新
+            partial: 是否为流式回复的中间内容
+        """
+        object.__setattr__(self, 'type', type)
+        object.__setattr__(self, 'content', content)
+        object.__setattr__(self, 'timestamp', time.time() if timestamp is None else timestamp)
+        object.__setattr__(self, 'id', id)
+        object.__setattr__(self, 'partial', partial)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('ChatMessage 不可修改')
+
+    def __delattr__(self, name):
+        raise AttributeError('ChatMessage 不可修改')
+
+    def __repr__(self) -> str:
+        return (f'ChatMessage(type={self.type!r}, content={self.content!r}, '
+                f'timestamp={self.timestamp!r}, id={self.id!r}, partial={self.partial!r})')
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, ChatMessage):
+            return NotImplemented
+        return (self.type, self.content, self.timestamp, self.id, self.partial) == \
+            (other.type, other.content, other.timestamp, other.id, other.partial)
+
+    def __hash__(self) -> int:
+        return hash((self.type, self.content, self.timestamp, self.id, self.partial))
+
+    def __reduce__(self):
+        return ChatMessage, (self.type, self.content, self.timestamp, self.id, self.partial)
+
+    @property
+    def time_str(self) -> str:
+        """格式化的时间，显示时才计算"""
+        return datetime.fromtimestamp(self.timestamp).strftime('%Y-%m-%d %H:%M:%S')
+
+    def is_text(self) -> bool:
+        return self.type == 'Text' or self.type == '文本消息'
@@ -13,12 +13,30 @@ except Exception as e:
 # UI配置
 UI_CONFIG = {
     'window_title': config.get('window_title', '微信AI助手'),
-    'window_size': config.get('window_size', [800, 600])
+    'window_size': config.get('window_size', [800, 600]),
+    'log_capacity': config.get('log_capacity', 5000),  # 日志区内存中保留的最大条数，更早的记录溢出到磁盘
+    # 界面刷新：每秒最多刷新次数、两次刷新间最多保留的状态条数、单条状态最大长度
+    'ui_refresh_rate': config.get('ui', {}).get('refresh_rate', 10),
+    'max_pending_status': config.get('ui', {}).get('max_pending_status', 50),
+    'max_status_chars': config.get('ui', {}).get('max_status_chars', 200),
+    # AI服务状态栏的刷新间隔（毫秒）
+    'provider_stats_interval': config.get('ui', {}).get('provider_stats_interval', 2000)
 }
 
 # 微信配置
 WECHAT_CONFIG = {
-    'listen_targets': config.get('listen_targets', [])
+    'listen_targets': config.get('listen_targets', []),
+    # 微信后端：wxauto（默认）或 fake（模拟流量，用于压测）
+    'backend': config.get('backend', 'wxauto'),
+    'fake_backend': config.get('fake_backend', {}),
+    # 按目标自适应轮询（秒）及界面自动化调用速率上限（次/秒）
+    'poll_interval_min': config.get('polling', {}).get('poll_interval_min', 0.5),
+    'poll_interval_max': config.get('polling', {}).get('poll_interval_max', 10.0),
+    'poll_backoff': config.get('polling', {}).get('poll_backoff', 1.5),
+    'max_calls_per_second': config.get('polling', {}).get('max_calls_per_second', 20),
+    # 消息去重：ttl（消息id保留秒数）, max_per_target, reply_ttl（AI回复回显的识别时限，秒）,
+    # snapshot_path（快照文件，重启后不重复处理积压消息）, snapshot_interval（秒）
+    'dedup': config.get('dedup', {})
 }
 
 # AI配置
@@ -33,5 +51,92 @@ AI_CONFIG = {
     'presence_penalty': config.get('ai_behavior', {}).get('presence_penalty', 0.9),
     'frequency_penalty': config.get('ai_behavior', {}).get('frequency_penalty', 0.0),
     'top_p': config.get('ai_behavior', {}).get('top_p', 0.0),
-    'timeout': config.get('timeout', 30)
-}
\ No newline at end of file
+    'timeout': config.get('timeout', 30),
+    # HTTP连接池配置（长连接复用）
+    'max_connections': config.get('http_pool', {}).get('max_connections', 20),
+    'max_keepalive_connections': config.get('http_pool', {}).get('max_keepalive_connections', 10),
+    'keepalive_expiry': config.get('http_pool', {}).get('keepalive_expiry', 60),
+    'http2': config.get('http_pool', {}).get('http2', True),
+    # 异步AI后端：所有请求共享一个事件循环线程
+    'async_backend': config.get('async_backend', False),
+    'max_concurrency': config.get('max_concurrency', 32),
+    # AI回复缓存：enabled, max_entries, max_bytes, ttl(秒), db_path, commit_interval（持久化批量提交间隔，秒）,
+    # bypass_temperature_above（温度高于该值时不缓存）, cache_with_context（默认false）。
+    # 缓存键包含对话上下文，而 monitor.context 默认启用，带上下文的请求几乎不会命中，
+    # 因此默认只缓存没有上下文的请求（每个聊天的第一条或关闭上下文时）
+    'response_cache': config.get('response_cache', {}),
+    # 在请求中附带 prompt_cache_key，提示服务端对相同系统提示词的请求复用前缀缓存
+    'prompt_cache_hint': config.get('prompt_cache_hint', False),
+    # 优先级分派：enabled, low_priority_targets, low_priority_concurrency；
+    # 总并发上限与 monitor.max_workers 一致。旧版本的配置键为 batching，仍可读取
+    'dispatch': config.get('dispatch', config.get('batching', {})),
+    # 重试：max_retries, base_delay(秒，之后每次翻倍并加随机抖动), max_delay(秒)；
+    # 只重试429、5xx、超时和连接错误，服务端返回 Retry-After 时以其为准
+    'retry': config.get('retry', {}),
+    # 熔断：某个后端连续 failure_threshold 次请求失败后 recovery_timeout 秒内不再分配请求
+    'circuit_breaker': config.get('circuit_breaker', {}),
+    # AI服务池：多个后端（name, api_key, service, model, weight, max_concurrency, tpm），
+    # 未填写的连接参数沿用顶层配置；为空时只使用顶层的 api_key/service/model
+    'providers': config.get('providers', []),
+    # 所有后端都达到并发或token上限时，请求最多等待的时间（秒）
+    'provider_wait_timeout': config.get('provider_wait_timeout', 30),
+    # 客户端限流：rpm, tpm（每分钟请求数/token数，0为不限）, mode（queue 排队或 shed 拒绝）,
+    # max_wait（排队最长等待秒数）, burst_seconds（空闲后允许的突发额度，按秒计）
+    'rate_limit': config.get('rate_limit', {})
+}
+
+# 消息监控配置
+MONITOR_CONFIG = {
+    'max_workers': config.get('monitor', {}).get('max_workers', 4),  # AI处理的全局并发上限
+    'response_delay': config.get('monitor', {}).get('response_delay', 3),  # 消息合并等待时间（秒）
+    # 持续有消息时，一组消息最多等待 max_batch_age 秒、攒到 max_batch_messages 条就分派（0为不限）
+    'max_batch_age': config.get('monitor', {}).get('max_batch_age', 15),
+    'max_batch_messages': config.get('monitor', {}).get('max_batch_messages', 20),
+    # 按聊天覆盖以上三项：{"聊天名": {"response_delay": 1, "max_batch_age": 5, "max_batch_messages": 10}}
+    'debounce_targets': config.get('monitor', {}).get('debounce_targets', {}),
+    'stream_replies': config.get('monitor', {}).get('stream_replies', False),  # 流式显示AI回复
+    'early_send': config.get('monitor', {}).get('early_send', False),  # 首句生成后提前发送
+    'early_send_min_chars': config.get('monitor', {}).get('early_send_min_chars', 8),
+    # 自适应轮询调度（秒）
+    'poll_interval_min': config.get('monitor', {}).get('poll_interval_min', 0.1),
+    'poll_interval_max': config.get('monitor', {}).get('poll_interval_max', 1.0),
+    'poll_backoff': config.get('monitor', {}).get('poll_backoff', 2.0),
+    # 对话上下文：enabled, max_tokens（每个聊天的token预算）, max_conversations, db_path, retention(秒),
+    # commit_interval（持久化批量提交间隔，秒）；启用时回复缓存默认不处理带上下文的请求，见 response_cache
+    'context': config.get('context', {}),
+    # 发送队列：min_interval（相邻发送间隔）, chat_interval（同一聊天两轮发送间隔）, max_burst,
+    # max_retries, retry_backoff, max_backoff（秒）, drain_timeout（停止时等待发送完的时间）
+    'send_queue': config.get('send_queue', {}),
+    # AI处理失败的消息组合放回缓存，requeue_delay 秒后重新处理，最多 max_requeues 次
+    'requeue_delay': config.get('monitor', {}).get('requeue_delay', 5),
+    'max_requeues': config.get('monitor', {}).get('max_requeues', 3),
+    # 停止监听时最多等待监控线程退出的时间（秒），超时后放弃等待并提示
+    'stop_timeout': config.get('monitor', {}).get('stop_timeout', 10),
+    # 消息缓存上限：max_messages_per_sender, max_bytes_per_sender, max_total_bytes（0为不限），
+    # overflow_policy（drop/summarize）, idle_ttl（空闲用户记录的保留时间，秒）
+    'message_cache': config.get('message_cache', {}),
+    # 预写日志：path（为空时不启用）, flush_interval（相邻两次fsync的最小间隔，秒）, max_batch,
+    # compact_min_records（文件记录数超过该值且大多已确认时重写）
+    'journal': config.get('journal', {})
+}
+
+# 日志配置
+LOG_CONFIG = {
+    'level': config.get('logging', {}).get('level', 'INFO'),
+    # 异步日志：日志先写入有界队列，由后台线程输出到控制台和文件
+    'async': config.get('logging', {}).get('async', True),
+    'queue_size': config.get('logging', {}).get('queue_size', 10000),
+    'drop_policy': config.get('logging', {}).get('drop_policy', 'drop_new'),  # drop_new, drop_old 或 block
+    'max_bytes': config.get('logging', {}).get('max_bytes', 10 * 1024 * 1024),
+    'backup_count': config.get('logging', {}).get('backup_count', 5)
+}
+
+# 指标导出配置
+METRICS_CONFIG = {
+    # 本地Prometheus文本格式HTTP端点，端口为0时不启动
+    'http_host': config.get('metrics', {}).get('http_host', '127.0.0.1'),
+    'http_port': config.get('metrics', {}).get('http_port', 0),
+    # 定期写入的JSON快照文件，为空时不写入
+    'snapshot_path': config.get('metrics', {}).get('snapshot_path', ''),
+    'snapshot_interval': config.get('metrics', {}).get('snapshot_interval', 10)
+}
@@ -0,0 +1,182 @@
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from src.sqlite_writer import SqliteWriter
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算文本的token数：中日韩字符约1个token，其余字符约4个字符1个token"""
+    cjk = sum(1 for ch in text if '\u3000' <= ch <= '\u9fff' or '\uac00' <= ch <= '\ud7af' or '\uff00' <= ch <= '\uffef')
+    return cjk + (len(text) - cjk + 3) // 4 + 4  # 每条消息额外约4个token的格式开销
+
+class _Conversation:
+    """单个聊天的对话窗口"""
+    __slots__ = ('turns', 'tokens')
+
+    def __init__(self):
+        self.turns: Deque[Tuple[str, str, int]] = deque()  # (角色, 内容, token数)
+        self.tokens = 0
+
+class ConversationStore:
+    """按聊天保存对话上下文
+
+    每个聊天保留最近的用户/助手对话轮次，按估算的token预算从最早的轮次开始裁剪；
+    聊天数超过上限时淘汰最久未活动的聊天，内存占用与聊天总数无关。
+    可选使用SQLite持久化，被淘汰或重启后的聊天可从数据库恢复；写入由后台线程批量提交，
+    不在锁内等待磁盘。
+    """
+
+    def __init__(self, max_tokens: int = 1500, max_conversations: int = 1000,
+                 db_path: Optional[str] = None, retention: float = 7 * 24 * 3600,
+                 commit_interval: float = 0.5):
+        """
+        Args:
+            max_tokens: 每个聊天上下文的token预算
+            max_conversations: 内存中保留的聊天数量上限
+            db_path: SQLite数据库路径，为None时只保存在内存中
+            retention: 数据库中对话记录的保留时长（秒），打开数据库时清理更早的记录
+            commit_interval: 持久化写入的批量提交间隔（秒）
+        """
+        self.logger = logging.getLogger(__name__)
+        self.max_tokens = max_tokens
+        self.max_conversations = max_conversations
+        self._conversations: 'OrderedDict[str, _Conversation]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None  # 只用于读取，写入经由 _writer
+        self._db_lock = threading.Lock()  # 读取连接在锁外使用，多个线程之间串行
+        self._writer: Optional[SqliteWriter] = None
+        self._last_write: Dict[str, int] = {}  # 聊天 -> 最近一条写语句的序号，用于恢复前只等待该聊天的写入
+        if db_path:
+            self._open_db(db_path, retention, commit_interval)
+
+    def append(self, target: str, role: str, content: str) -> None:
+        """追加一轮对话并按token预算裁剪"""
+        tokens = estimate_tokens(content)
+        loaded = self._preload(target)
+        with self._lock:
+            conversation = self._get(target, loaded)
+            conversation.turns.append((role, content, tokens))
+            conversation.tokens += tokens
+            while conversation.tokens > self.max_tokens and len(conversation.turns) > 1:
+                _, _, removed = conversation.turns.popleft()
+                conversation.tokens -= removed
+            if self._writer is not None:
+                self._record_write(target, self._writer.execute(
+                    'INSERT INTO conversation_turns (target, role, content, tokens, created_at) '
+                    'VALUES (?, ?, ?, ?, ?)', (target, role, content, tokens, time.time())))
+
+    def get_context(self, target: str) -> List[Dict[str, str]]:
+        """返回聊天的上下文消息列表，开销只与窗口大小有关"""
+        loaded = self._preload(target)
+        with self._lock:
+            conversation = self._conversations.get(target)
+            if conversation is None:
+                if loaded is None:
+                    return []
+                conversation = self._get(target, loaded)
+            else:
+                self._conversations.move_to_end(target)
+            return [{'role': role, 'content': content} for role, content, _ in conversation.turns]
+
+    def clear(self, target: str) -> None:
+        """清空某个聊天的上下文"""
+        with self._lock:
+            self._conversations.pop(target, None)
+            if self._writer is not None:
+                self._record_write(target, self._writer.execute(
+                    'DELETE FROM conversation_turns WHERE target = ?', (target,)))
+
+    def _record_write(self, target: str, seq: int) -> None:
+        """记录聊天最近一条写语句的序号，并清理已提交的记录（调用方需持有锁）"""
+        self._last_write[target] = seq
+        if len(self._last_write) > 2 * self.max_conversations:
+            self._last_write = {t: s for t, s in self._last_write.items() if not self._writer.committed(s)}
+
+    def _preload(self, target: str) -> Optional[_Conversation]:
+        """不在内存中的聊天在锁外从数据库读取
+
+        Returns:
+            读取到的聊天窗口；已在内存中或未启用持久化时为None
+        """
+        with self._lock:
+            if target in self._conversations or self._db is None:
+                return None
+            seq = self._last_write.pop(target, 0)
+        return self._load(target, seq)
+
+    def _get(self, target: str, loaded: Optional[_Conversation] = None) -> _Conversation:
+        """获取或创建聊天窗口，并淘汰超出数量上限的聊天（调用方需持有锁）
+
+        Args:
+            loaded: _preload 在锁外读取的结果；读取期间其他线程已把该聊天放回内存时以内存中的为准
+        """
+        conversation = self._conversations.get(target)
+        if conversation is not None:
+            self._conversations.move_to_end(target)
+            return conversation
+
+        conversation = loaded if loaded is not None else _Conversation()
+        self._conversations[target] = conversation
+        while len(self._conversations) > self.max_conversations:
+            self._conversations.popitem(last=False)
+        return conversation
+
+    def _load(self, target: str, seq: int = 0) -> _Conversation:
+        """从数据库恢复聊天窗口，只读取预算内的最近轮次（不持有 _lock）
+
+        Args:
+            seq: 该聊天最近一条写语句的序号，尚未提交时先等待它提交
+        """
+        conversation = _Conversation()
+        if seq and self._writer is not None:
+            # 被淘汰的聊天最近的轮次可能还在写入队列中
+            self._writer.flush(upto=seq)
+        with self._db_lock:
+            if self._db is None:
+                return conversation
+            rows = self._db.execute('SELECT role, content, tokens FROM conversation_turns '
+                                    'WHERE target = ? ORDER BY id DESC', (target,)).fetchall()
+        for role, content, tokens in rows:
+            if conversation.turns and conversation.tokens + tokens > self.max_tokens:
+                break
+            conversation.turns.appendleft((role, content, tokens))
+            conversation.tokens += tokens
+        return conversation
+
+    def _open_db(self, db_path: str, retention: float, commit_interval: float) -> None:
+        """打开持久化数据库并清理过期记录"""
+        try:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS conversation_turns '
+                             '(id INTEGER PRIMARY KEY AUTOINCREMENT, target TEXT NOT NULL, role TEXT NOT NULL, '
+                             'content TEXT NOT NULL, tokens INTEGER NOT NULL, created_at REAL NOT NULL)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS idx_conversation_target ON conversation_turns (target, id)')
+            self._db.execute('DELETE FROM conversation_turns WHERE created_at < ?', (time.time() - retention,))
+            self._db.commit()
+            self._writer = SqliteWriter(db_path, commit_interval, name='conversation_writer')
+            self.logger.info(f'对话上下文持久化已启用: {db_path}')
+        except sqlite3.Error as e:
+            self.logger.error(f'打开对话上下文数据库失败: {str(e)}，仅保存在内存中', exc_info=True)
+            self._db = None
+
+    def stats(self) -> Dict[str, int]:
+        """返回内存中的聊天数和总token数"""
+        with self._lock:
+            return {
+                'conversations': len(self._conversations),
+                'tokens': sum(c.tokens for c in self._conversations.values())
+            }
+
+    def close(self) -> None:
+        """提交剩余写入并关闭持久化数据库"""
+        with self._lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+            with self._db_lock:
+                if self._db is not None:
+                    self._db.close()
+                    self._db = None
@@ -0,0 +1,200 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set
+
+from src.metrics import REGISTRY
+
+DUPLICATE_MESSAGES = REGISTRY.counter('duplicate_messages_total', '被去重跳过的消息数（按原因）')
+
+FINGERPRINT_PREFIX = 'fp_'
+
+def message_fingerprint(target: str, msg_type: str, content: str, msg_time: str, occurrence: int = 0) -> str:
+    """wxauto 未提供消息id时，按聊天、类型、内容和时间生成的消息指纹
+
+    同一次轮询中内容和时间都相同的消息用 occurrence（第几次出现）区分，
+    避免连续发送的相同消息被误判为重复。指纹不是真正的消息id：
+    不同时间重复发送的“好的”可能得到相同的指纹，因此只用于和上一次轮询的结果比对。
+    """
+    raw = '\x1f'.join((target, msg_type, content, msg_time, str(occurrence)))
+    return FINGERPRINT_PREFIX + hashlib.sha1(raw.encode('utf-8')).hexdigest()[:20]
+
+def is_fingerprint(msg_id: str) -> bool:
+    return msg_id.startswith(FINGERPRINT_PREFIX)
+
+def _content_key(content: str) -> str:
+    return hashlib.sha1(content.strip().encode('utf-8')).hexdigest()[:16]
+
+class DedupIndex:
+    """按聊天划分的消息去重索引
+
+    每个聊天保存最近见过的消息id（按插入顺序的有序字典，查询和插入均为O(1)），
+    超过 ttl 的记录在访问时从头部淘汰，超过 max_per_target 条时淘汰最早的记录。
+    没有消息id的消息只与该聊天上一次轮询的指纹比对（overlaps_last_poll），不进入索引。
+    同时记录最近发出的AI回复内容，用于跳过微信回显的自身消息。
+    可选定期写入磁盘快照，重启后不会重复处理或重复回复积压的消息。
+    """
+
+    def __init__(self, ttl: float = 24 * 3600, max_per_target: int = 10000, reply_ttl: float = 600,
+                 snapshot_path: Optional[str] = None, snapshot_interval: float = 30.0):
+        """
+        Args:
+            ttl: 消息id的保留时间（秒）
+            max_per_target: 每个聊天最多保留的消息id数
+            reply_ttl: AI回复内容的保留时间（秒），超过后不再视为回显
+            snapshot_path: 快照文件路径，为None时不持久化
+            snapshot_interval: 两次写入快照的最小间隔（秒）
+        """
+        self.logger = logging.getLogger(__name__)
+        self.ttl = ttl
+        self.max_per_target = max(1, max_per_target)
+        self.reply_ttl = reply_ttl
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        # 过期时间使用墙上时间，快照重启后仍然有效
+        self._seen: Dict[str, 'OrderedDict[str, float]'] = {}
+        self._replies: Dict[str, 'OrderedDict[str, float]'] = {}
+        self._last_poll: Dict[str, Set[str]] = {}  # 每个聊天上一次轮询中无id消息的指纹
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._last_save = time.monotonic()
+        self.duplicates = 0
+        self.echoes = 0
+        if snapshot_path:
+            self.load()
+
+    @staticmethod
+    def _expire(entries: 'OrderedDict[str, float]', now: float) -> None:
+        while entries:
+            key, expires = next(iter(entries.items()))
+            if expires > now:
+                return
+            entries.popitem(last=False)
+
+    def seen(self, target: str, msg_id: str) -> bool:
+        """检查消息是否已处理过，未处理过时记录下来
+
+        Returns:
+            True 表示重复消息
+        """
+        now = time.time()
+        with self._lock:
+            entries = self._seen.get(target)
+            if entries is None:
+                entries = self._seen[target] = OrderedDict()
+            else:
+                self._expire(entries, now)
+                if msg_id in entries:
+                    self.duplicates += 1
+                    DUPLICATE_MESSAGES.inc(reason='id')
+                    return True
+            entries[msg_id] = now + self.ttl
+            if len(entries) > self.max_per_target:
+                entries.popitem(last=False)
+            self._dirty = True
+            return False
+
+    def overlaps_last_poll(self, target: str, fingerprints: List[str]) -> Set[str]:
+        """返回本次轮询的指纹中在上一次轮询里也出现过的部分，并记录本次的指纹
+
+        只覆盖相邻两次轮询的重叠窗口：隔了一次以上轮询再出现的相同内容视为新消息。
+        """
+        with self._lock:
+            previous = self._last_poll.get(target, set())
+            current = set(fingerprints)
+            if current:
+                self._last_poll[target] = current
+            else:
+                self._last_poll.pop(target, None)
+        overlap = current & previous
+        if overlap:
+            self.duplicates += len(overlap)
+            DUPLICATE_MESSAGES.inc(len(overlap), reason='poll_overlap')
+        return overlap
+
+    def remember_reply(self, target: str, text: str) -> None:
+        """记录发往某个聊天的AI回复内容"""
+        now = time.time()
+        with self._lock:
+            replies = self._replies.setdefault(target, OrderedDict())
+            self._expire(replies, now)
+            key = _content_key(text)
+            replies.pop(key, None)
+            replies[key] = now + self.reply_ttl
+            if len(replies) > self.max_per_target:
+                replies.popitem(last=False)
+
+    def is_reply_echo(self, target: str, content: str) -> bool:
+        """消息内容是否为最近发出的AI回复的回显，匹配后移除该记录（每条回复只回显一次）"""
+        with self._lock:
+            replies = self._replies.get(target)
+            if not replies:
+                return False
+            self._expire(replies, time.time())
+            if replies.pop(_content_key(content), None) is None:
+                return False
+            self.echoes += 1
+            DUPLICATE_MESSAGES.inc(reason='echo')
+            return True
+
+    def forget_target(self, target: str) -> None:
+        with self._lock:
+            self._seen.pop(target, None)
+            self._replies.pop(target, None)
+            self._last_poll.pop(target, None)
+            self._dirty = True
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'targets': len(self._seen),
+                'ids': sum(len(entries) for entries in self._seen.values()),
+                'duplicates': self.duplicates,
+                'echoes': self.echoes
+            }
+
+    def load(self) -> None:
+        """从快照恢复未过期的消息id"""
+        try:
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            self.logger.warning(f'读取去重快照失败: {str(e)}')
+            return
+        now = time.time()
+        with self._lock:
+            for target, items in data.get('seen', {}).items():
+                entries = OrderedDict((msg_id, expires) for msg_id, expires in items if expires > now)
+                if entries:
+                    self._seen[target] = entries
+        self.logger.info(f'已从去重快照恢复 {sum(len(e) for e in self._seen.values())} 条消息记录')
+
+    def maybe_save(self) -> None:
+        """距离上次写入超过 snapshot_interval 且有新记录时写入快照"""
+        if self.snapshot_path and self._dirty and time.monotonic() - self._last_save >= self.snapshot_interval:
+            self.save()
+
+    def save(self) -> None:
+        """原子地写入快照文件"""
+        if not self.snapshot_path:
+            return
+        now = time.time()
+        with self._lock:
+            for entries in self._seen.values():
+                self._expire(entries, now)
+            data = {'seen': {target: list(entries.items()) for target, entries in self._seen.items() if entries}}
+            self._dirty = False
+            self._last_save = time.monotonic()
+        tmp_path = f'{self.snapshot_path}.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.snapshot_path)
+        except Exception as e:
+            self.logger.warning(f'写入去重快照失败: {str(e)}')
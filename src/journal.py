@@ -0,0 +1,255 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from src.chat_message import ChatMessage
+from src.metrics import REGISTRY
+
+JOURNAL_FSYNC_SECONDS = REGISTRY.histogram('journal_fsync_seconds', '预写日志一次批量写入并fsync的耗时')
+JOURNAL_RECORDS = REGISTRY.counter('journal_records_total', '写入预写日志的记录数（按类型）')
+
+# 一个消息组合覆盖的序号区间列表，[(起始序号, 结束序号)]，两端均包含
+SeqRanges = List[Tuple[int, int]]
+
+class MessageJournal:
+    """已收到但尚未回复的消息的预写日志
+
+    追加写入的 JSON Lines 文件，每条消息一行 msg 记录（带全局递增序号），
+    回复发送完成或放弃后写一行 ack 记录，标记该聊天某些序号区间的消息已处理完。
+    启动时读取日志，未确认的消息重新放回消息缓存，实现至少一次回复。
+
+    写入采用组提交：调用方只把记录放入内存缓冲区后立即返回，由后台线程批量写入
+    并调用一次 fsync，相邻两次 fsync 至少间隔 flush_interval（缓冲区达到 max_batch
+    条时立即写入），负载高时一次 fsync 覆盖大量记录，不拖慢消息轮询。
+    已确认的记录占多数时在后台重写文件，只保留未确认的消息。
+    """
+
+    def __init__(self, path: str, flush_interval: float = 0.05, max_batch: int = 512,
+                 compact_min_records: int = 10000):
+        """
+        Args:
+            path: 日志文件路径
+            flush_interval: 相邻两次 fsync 的最小间隔（秒），即崩溃时最多丢失的时间窗口
+            max_batch: 缓冲区达到该条数时不等待 flush_interval 立即写入
+            compact_min_records: 文件记录数超过该值且未确认的消息不足四分之一时重写文件
+        """
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_batch = max(1, max_batch)
+        self.compact_min_records = compact_min_records
+        # 未确认的消息：聊天 -> {序号: 日志行}，按序号递增
+        self._live: Dict[str, 'OrderedDict[int, str]'] = {}
+        self._live_count = 0
+        self._last_seq: Dict[str, int] = {}
+        self._seq = 0
+        self._buffer: List[str] = []
+        self._file_records = 0
+        self._appended = 0  # 已放入缓冲区的记录总数
+        self._durable = 0  # 已 fsync 的记录总数
+        self._cond = threading.Condition()
+        self._closing = False
+        self.fsyncs = 0
+        self.compactions = 0
+        self.replayed = 0
+
+        self._load()
+        lines = self._snapshot()
+        self._file = self._rewrite(lines)
+        self._file_records = len(lines)
+        self._thread = threading.Thread(target=self._run, name='message_journal', daemon=True)
+        self._thread.start()
+
+    def _load(self) -> None:
+        """读取已有日志，恢复未确认的消息；末尾写了一半的行直接跳过"""
+        try:
+            f = open(self.path, 'r', encoding='utf-8')
+        except FileNotFoundError:
+            return
+        skipped = 0
+        with f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    self._apply(record, line if line.endswith('\n') else line + '\n')
+                except (ValueError, KeyError, TypeError):
+                    skipped += 1
+        if skipped:
+            self.logger.warning('预写日志中有 %d 行无法解析，已跳过', skipped)
+        self.replayed = self._live_count
+        if self.replayed:
+            self.logger.info('预写日志中有 %d 条未回复的消息', self.replayed)
+
+    def _apply(self, record: dict, line: str) -> None:
+        target = record['t']
+        if record['op'] == 'msg':
+            seq = int(record['seq'])
+            entries = self._live.setdefault(target, OrderedDict())
+            if seq not in entries:
+                entries[seq] = line
+                self._live_count += 1
+            self._seq = max(self._seq, seq)
+            self._last_seq[target] = max(self._last_seq.get(target, 0), seq)
+        elif record['op'] == 'ack':
+            self._remove(target, record['r'])
+
+    def _remove(self, target: str, ranges: Sequence[Sequence[int]]) -> None:
+        entries = self._live.get(target)
+        if not entries:
+            return
+        for seq in [seq for seq in entries if any(lo <= seq <= hi for lo, hi in ranges)]:
+            del entries[seq]
+            self._live_count -= 1
+        if not entries:
+            del self._live[target]
+
+    def _snapshot(self) -> List[str]:
+        """未确认消息的日志行（调用方需持有锁）"""
+        return [line for entries in self._live.values() for line in entries.values()]
+
+    def _rewrite(self, lines: List[str]):
+        """把日志行原子地写入新文件，返回追加写入的文件对象（不需要持有锁）"""
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        return open(self.path, 'a', encoding='utf-8')
+
+    def pending(self) -> Dict[str, List[ChatMessage]]:
+        """返回日志中未确认的消息，按聊天分组、按收到顺序排列，用于启动时重放"""
+        result = {}
+        with self._cond:
+            for target, entries in self._live.items():
+                messages = []
+                for line in entries.values():
+                    record = json.loads(line)
+                    messages.append(ChatMessage(record['type'], record['c'], record['ts'], record.get('id')))
+                result[target] = messages
+        return result
+
+    def append(self, target: str, message: ChatMessage) -> int:
+        """记录一条收到的消息，返回其序号；只写入缓冲区，不等待落盘"""
+        with self._cond:
+            self._seq += 1
+            seq = self._seq
+            line = json.dumps({'op': 'msg', 'seq': seq, 't': target, 'type': message.type,
+                               'c': message.content, 'ts': message.timestamp, 'id': message.id},
+                              ensure_ascii=False) + '\n'
+            self._live.setdefault(target, OrderedDict())[seq] = line
+            self._live_count += 1
+            self._last_seq[target] = seq
+            self._push(line)
+        JOURNAL_RECORDS.inc(op='msg')
+        return seq
+
+    def last_seq(self, target: str) -> int:
+        """该聊天最近一条消息的序号，没有消息时为0"""
+        with self._cond:
+            return self._last_seq.get(target, 0)
+
+    def ack(self, target: str, ranges: SeqRanges) -> None:
+        """标记该聊天这些序号区间内的消息已处理完"""
+        if not ranges:
+            return
+        with self._cond:
+            self._remove(target, ranges)
+            self._push(json.dumps({'op': 'ack', 't': target, 'r': ranges}, ensure_ascii=False) + '\n')
+        JOURNAL_RECORDS.inc(op='ack')
+
+    def _push(self, line: str) -> None:
+        self._buffer.append(line)
+        self._appended += 1
+        if len(self._buffer) == 1 or len(self._buffer) >= self.max_batch:
+            self._cond.notify_all()
+
+    def _run(self) -> None:
+        last_sync = 0.0
+        while True:
+            snapshot = None
+            with self._cond:
+                while not self._buffer and not self._closing:
+                    self._cond.wait()
+                # 组提交：距上次 fsync 不足 flush_interval 时继续收集记录
+                remaining = last_sync + self.flush_interval - time.monotonic()
+                if remaining > 0 and len(self._buffer) < self.max_batch and not self._closing:
+                    self._cond.wait(remaining)
+                if not self._buffer and self._closing:
+                    return
+                lines, self._buffer = self._buffer, []
+                appended = self._appended
+                if (self._file_records + len(lines) >= self.compact_min_records and
+                        self._live_count * 4 < self._file_records + len(lines)):
+                    # 快照已包含取出的这些消息并反映了其中的确认；之后的记录留在缓冲区写入新文件
+                    snapshot = self._snapshot()
+            # 磁盘读写都在锁外进行，不阻塞 append() 和 ack()
+            if snapshot is not None and self._compact(snapshot):
+                lines = []
+            if lines:
+                try:
+                    with JOURNAL_FSYNC_SECONDS.time():
+                        self._file.writelines(lines)
+                        self._file.flush()
+                        os.fsync(self._file.fileno())
+                    self.fsyncs += 1
+                    self._file_records += len(lines)
+                except OSError as e:
+                    self.logger.error('写入预写日志失败: %s', e)
+            last_sync = time.monotonic()
+            with self._cond:
+                self._durable = appended
+                self._cond.notify_all()
+
+    def _compact(self, snapshot: List[str]) -> bool:
+        """用快照重写日志文件，失败时继续追加写入原文件"""
+        try:
+            new_file = self._rewrite(snapshot)
+        except OSError as e:
+            self.logger.error('重写预写日志失败: %s', e)
+            return False
+        old_file, self._file = self._file, new_file
+        old_file.close()
+        self._file_records = len(snapshot)
+        self.compactions += 1
+        return True
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """等待目前为止的记录全部落盘
+
+        Returns:
+            是否在 timeout 内完成
+        """
+        with self._cond:
+            target = self._appended
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: self._durable >= target, timeout)
+
+    def close(self, timeout: float = 5.0) -> None:
+        """写入剩余记录并关闭文件"""
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            # 写入线程仍在使用文件，不能关闭；未写入的记录下次启动时按未确认处理
+            self.logger.warning('预写日志在 %.0f 秒内没有写完，未关闭文件', timeout)
+            return
+        self._file.close()
+
+    def stats(self) -> Dict[str, float]:
+        with self._cond:
+            return {
+                'pending_messages': self._live_count,
+                'file_records': self._file_records,
+                'buffered': len(self._buffer),
+                'records': self._appended,
+                'fsyncs': self.fsyncs,
+                'records_per_fsync': self._durable / self.fsyncs if self.fsyncs else 0.0,
+                'compactions': self.compactions,
+                'replayed': self.replayed
+            }
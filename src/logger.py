@@ -1,47 +1,158 @@
+import atexit
 import logging
 import os
+import queue
 import sys
-from logging.handlers import RotatingFileHandler
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Dict, Optional
 
-def setup_logger():
+_listener: Optional['_BoundedQueueListener'] = None
+_queue_handler: Optional['BoundedQueueHandler'] = None
+
+class shorten:
+    """延迟截断的日志参数，只有日志真正输出时才截断文本
+
+    用法: logger.info('收到消息: %s', shorten(content, 50))
+    """
+    __slots__ = ('text', 'limit')
+
+    def __init__(self, text: str, limit: int):
+        self.text = text
+        self.limit = limit
+
+    def __str__(self) -> str:
+        if len(self.text) > self.limit:
+            return self.text[:self.limit] + '...'
+        return self.text
+
+class BoundedQueueHandler(QueueHandler):
+    """写入有界队列的日志处理器，队列满时按策略丢弃或阻塞
+
+    drop_policy:
+        drop_new: 丢弃新日志（默认，调用线程永不阻塞）
+        drop_old: 丢弃队列中最早的日志
+        block: 阻塞调用线程直到队列有空位
+    WARNING 及以上级别的日志总是等待写入，不会被丢弃。
+    """
+
+    def __init__(self, log_queue: queue.Queue, drop_policy: str = 'drop_new'):
+        super().__init__(log_queue)
+        self.drop_policy = drop_policy
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """消息格式化留给后台线程完成，只有带异常信息的记录在当前线程格式化"""
+        if record.exc_info:
+            return super().prepare(record)
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self.drop_policy == 'block' or record.levelno >= logging.WARNING:
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+            return
+        except queue.Full:
+            pass
+        if self.drop_policy == 'drop_old':
+            try:
+                self.queue.get_nowait()
+                self.queue.put_nowait(record)
+            except (queue.Empty, queue.Full):
+                pass
+        with self._dropped_lock:
+            self.dropped += 1
+
+class _BoundedQueueListener(QueueListener):
+    """停止时阻塞等待队列空位放入结束标记，避免有界队列已满时无法停止"""
+
+    def enqueue_sentinel(self) -> None:
+        self.queue.put(self._sentinel)
+
+def setup_logger(config: Optional[Dict] = None):
     """
     设置全局日志系统，将日志输出到控制台和文件
+
+    config 中 async 为 True 时（默认），日志先写入有界内存队列，
+    由后台线程完成格式化、控制台输出和文件写入/轮转，不阻塞调用线程。
     """
+    global _listener, _queue_handler
+    config = config or {}
+    level = getattr(logging, str(config.get('level', 'INFO')).upper(), logging.INFO)
+
     # 创建根日志记录器
     root_logger = logging.getLogger()
-    root_logger.setLevel(logging.INFO)
-    
+    root_logger.setLevel(level)
+
     # 清除已有的处理器
     for handler in root_logger.handlers[:]:
         root_logger.removeHandler(handler)
-    
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+        _queue_handler = None
+
     # 创建格式化器 - 去掉了 %(name)s 部分
     formatter = logging.Formatter(
         '%(asctime)s [%(levelname)s] - %(message)s',
         datefmt='%Y-%m-%d %H:%M:%S'
     )
-    
+
     # 创建控制台处理器
     console_handler = logging.StreamHandler(sys.stdout)
     console_handler.setFormatter(formatter)
-    console_handler.setLevel(logging.INFO)
-    root_logger.addHandler(console_handler)
-    
+    console_handler.setLevel(level)
+
     # 创建文件处理器
-    log_file = os.path.join(os.path.dirname(os.path.dirname(__file__)), '@AutomationLog.txt')
+    log_file = config.get('log_file') or os.path.join(os.path.dirname(os.path.dirname(__file__)), '@AutomationLog.txt')
     file_handler = RotatingFileHandler(
-        log_file, 
-        maxBytes=10*1024*1024,  # 10MB
-        backupCount=5,
+        log_file,
+        maxBytes=config.get('max_bytes', 10*1024*1024),  # 10MB
+        backupCount=config.get('backup_count', 5),
         encoding='utf-8'
     )
     file_handler.setFormatter(formatter)
-    file_handler.setLevel(logging.INFO)
-    root_logger.addHandler(file_handler)
-    
+    file_handler.setLevel(level)
+
+    if config.get('async', True):
+        log_queue = queue.Queue(maxsize=config.get('queue_size', 10000))
+        _queue_handler = BoundedQueueHandler(log_queue, config.get('drop_policy', 'drop_new'))
+        root_logger.addHandler(_queue_handler)
+        _listener = _BoundedQueueListener(log_queue, console_handler, file_handler, respect_handler_level=True)
+        _listener.start()
+    else:
+        root_logger.addHandler(console_handler)
+        root_logger.addHandler(file_handler)
+
     # 设置第三方库的日志级别
     logging.getLogger('openai').setLevel(logging.WARNING)
     logging.getLogger('urllib3').setLevel(logging.WARNING)
     logging.getLogger('httpx').setLevel(logging.WARNING)
-    
-    return root_logger
\ No newline at end of file
+
+    return root_logger
+
+def get_log_stats() -> Dict[str, int]:
+    """返回异步日志队列的积压和丢弃数量"""
+    if _queue_handler is None:
+        return {'queued': 0, 'dropped': 0}
+    return {'queued': _queue_handler.queue.qsize(), 'dropped': _queue_handler.dropped}
+
+def shutdown_logger() -> None:
+    """停止后台日志线程，写完队列中剩余的日志"""
+    global _listener, _queue_handler
+    if _listener is None:
+        return
+    _listener.stop()
+    if _queue_handler is not None and _queue_handler.dropped:
+        for handler in _listener.handlers:
+            handler.handle(logging.makeLogRecord({
+                'name': __name__, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                'msg': '日志队列已满，共丢弃 %d 条日志', 'args': (_queue_handler.dropped,)
+            }))
+    _listener = None
+    _queue_handler = None
+
+atexit.register(shutdown_logger)
@@ -1,35 +1,276 @@
-from datetime import datetime
-from typing import Optional, Dict, List
+import heapq
+import itertools
+import logging
+import threading
+import time
+from typing import Optional, Dict, List, Tuple
+from src.chat_message import COMBINED_TYPE, ChatMessage
+from src.metrics import DEBOUNCE_WAIT_SECONDS, REGISTRY
+
+CACHE_DROPPED_MESSAGES = REGISTRY.counter('message_cache_dropped_total', '因缓存超出上限被丢弃的消息数（按原因）')
+DEBOUNCE_FLUSHES = REGISTRY.counter('debounce_flushes_total', '合并分派的消息组合数（按触发原因）')
+
+OVERFLOW_POLICIES = ('drop', 'summarize')
+
+def _message_bytes(message: ChatMessage) -> int:
+    return len(message.content.encode('utf-8'))
 
 class MessageCache:
-    def __init__(self, response_delay: int = 3):
-        self.user_messages: Dict[str, List[Dict]] = {}
-        self.last_message_time: Dict[str, datetime] = {}
+    """按用户缓存消息，静默一段时间后合并分派
+
+    合并时机由两个阈值共同决定：最后一条消息后静默 response_delay 秒，
+    或本组第一条消息已等待 max_batch_age 秒（持续有消息的群也能及时回复）；
+    本组消息达到 max_batch_messages 条时立即分派，限制提示词长度。
+    """
+
+    def __init__(self, response_delay: int = 3, max_messages_per_sender: int = 200,
+                 max_bytes_per_sender: int = 64 * 1024, max_total_bytes: int = 8 * 1024 * 1024,
+                 overflow_policy: str = 'summarize', idle_ttl: float = 600,
+                 max_batch_age: float = 15, max_batch_messages: int = 20,
+                 target_debounce: Optional[Dict[str, dict]] = None):
+        """
+        Args:
+            response_delay: 最后一条消息后的静默等待时间（秒）
+            max_messages_per_sender: 每个用户最多缓存的消息条数（0为不限）
+            max_bytes_per_sender: 每个用户缓存消息内容的字节数上限（0为不限）
+            max_total_bytes: 所有用户缓存消息内容的总字节数上限（0为不限），超出时从占用最多的用户开始淘汰
+            overflow_policy: 超出上限时的处理方式：drop 直接丢弃最早的消息，
+                summarize 丢弃后在合并消息开头注明省略了多少条
+            idle_ttl: 没有待处理消息的用户记录保留时间（秒），超过后清理
+            max_batch_age: 一组消息从第一条到分派的最长等待时间（秒，0为不限）
+            max_batch_messages: 一组消息达到该条数时立即分派（0为不限）
+            target_debounce: 按聊天覆盖 response_delay、max_batch_age、max_batch_messages
+        """
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f'不支持的溢出策略: {overflow_policy}')
+        self.logger = logging.getLogger(__name__)
+        self.user_messages: Dict[str, List[ChatMessage]] = {}
+        self.last_message_time: Dict[str, float] = {}  # time.monotonic() 时间戳
         self.response_delay = response_delay  # 延迟响应时间（秒）
-    
-    def add_message(self, sender: str, content: str) -> None:
-        """添加新消息到缓存，并重置计时"""
-        if sender not in self.user_messages:
-            self.user_messages[sender] = []
-            
-        self.user_messages[sender].append({
-            'content': content,
-            'time': datetime.now()
-        })
-        # 更新最后消息时间
-        self.last_message_time[sender] = datetime.now()
-    
+        self.max_messages_per_sender = max_messages_per_sender
+        self.max_bytes_per_sender = max_bytes_per_sender
+        self.max_total_bytes = max_total_bytes
+        self.overflow_policy = overflow_policy
+        self.idle_ttl = idle_ttl
+        self.max_batch_age = max_batch_age
+        self.max_batch_messages = max_batch_messages
+        self.target_debounce = dict(target_debounce or {})
+        # 到期队列：最小堆保存 (到期时间, 序号, 用户)，_deadlines 保存每个用户当前有效的到期时间。
+        # 重新计时只压入新条目，旧条目在出堆时按 _deadlines 判断为过期并丢弃。
+        self._deadlines: Dict[str, float] = {}
+        self._heap: List[Tuple[float, int, str]] = []
+        self._seq = itertools.count()
+        # 本组第一条消息的时间，以及失败回填要求的最早处理时间（time.monotonic() 时间戳）
+        self._batch_start: Dict[str, float] = {}
+        self._not_before: Dict[str, float] = {}
+        # 占用统计：每个用户缓存内容的字节数、总字节数和被省略的消息数
+        self._bytes: Dict[str, int] = {}
+        self._total_bytes = 0
+        self._omitted: Dict[str, int] = {}
+        self._next_idle_sweep = time.monotonic() + idle_ttl
+        self.dropped = 0
+        self.evicted_senders = 0
+        # 轮询线程写入、AI失败回调线程回填，需要加锁
+        self._lock = threading.RLock()
+
+    def debounce_settings(self, sender: str) -> Tuple[float, float, int]:
+        """返回该聊天的 (response_delay, max_batch_age, max_batch_messages)"""
+        override = self.target_debounce.get(sender)
+        if not override:
+            return self.response_delay, self.max_batch_age, self.max_batch_messages
+        return (override.get('response_delay', self.response_delay),
+                override.get('max_batch_age', self.max_batch_age),
+                override.get('max_batch_messages', self.max_batch_messages))
+
+    def add_message(self, sender: str, message: ChatMessage) -> None:
+        """添加新消息到缓存，并重新计算到期时间"""
+        with self._lock:
+            self._append(sender, message, at_head=False)
+            # 更新最后消息时间
+            now = time.monotonic()
+            self.last_message_time[sender] = now
+            self._batch_start.setdefault(sender, now)
+            self._reschedule(sender, now)
+
+    def requeue(self, sender: str, combined_message: str, delay: float) -> None:
+        """将处理失败的合并消息放回缓存队首，delay 秒后与期间新到的消息一起重新处理"""
+        with self._lock:
+            self._append(sender, ChatMessage(COMBINED_TYPE, combined_message), at_head=True)
+            now = time.monotonic()
+            self._batch_start.setdefault(sender, now)
+            self._not_before[sender] = max(now + delay, self._not_before.get(sender, 0.0))
+            self._schedule(sender, max(self._not_before[sender], self._deadlines.get(sender, now)))
+
+    def _reschedule(self, sender: str, now: float) -> None:
+        """到期时间 = min(最后一条消息 + response_delay, 第一条消息 + max_batch_age)，
+        消息数达到 max_batch_messages 时立即到期"""
+        delay, max_age, max_messages = self.debounce_settings(sender)
+        deadline = now + delay
+        if max_age:
+            deadline = min(deadline, self._batch_start[sender] + max_age)
+        if max_messages and len(self.user_messages[sender]) >= max_messages:
+            deadline = now
+        # 回填的失败消息可能要求更晚处理（如AI服务熔断中），不提前
+        self._schedule(sender, max(deadline, self._not_before.get(sender, deadline)))
+
+    def _append(self, sender: str, message: ChatMessage, at_head: bool) -> None:
+        """加入消息并按单用户和全局上限淘汰最早的消息"""
+        messages = self.user_messages.get(sender)
+        if messages is None:
+            messages = self.user_messages[sender] = []
+        if at_head:
+            messages.insert(0, message)
+        else:
+            messages.append(message)
+        size = _message_bytes(message)
+        self._bytes[sender] = self._bytes.get(sender, 0) + size
+        self._total_bytes += size
+
+        # 单用户上限：至少保留刚加入的一条
+        while len(messages) > 1 and (
+                (self.max_messages_per_sender and len(messages) > self.max_messages_per_sender) or
+                (self.max_bytes_per_sender and self._bytes[sender] > self.max_bytes_per_sender)):
+            self._drop_oldest(sender, 'sender_limit', keep=message)
+
+        # 全局上限：从占用最多的用户开始淘汰，刚加入的消息不淘汰
+        while self.max_total_bytes and self._total_bytes > self.max_total_bytes:
+            candidates = [s for s in self._bytes if s != sender or len(messages) > 1]
+            if not candidates:
+                break
+            self._drop_oldest(max(candidates, key=self._bytes.get), 'global_limit', keep=message)
+
+    def _drop_oldest(self, sender: str, reason: str, keep: ChatMessage) -> None:
+        """丢弃用户最早的一条消息，该消息是 keep 时改为丢弃下一条"""
+        messages = self.user_messages[sender]
+        dropped = messages.pop(1 if messages[0] is keep else 0)
+        size = _message_bytes(dropped)
+        self._bytes[sender] -= size
+        self._total_bytes -= size
+        self.dropped += 1
+        CACHE_DROPPED_MESSAGES.inc(reason=reason)
+        if dropped.type == COMBINED_TYPE:
+            # 回填的合并消息可能包含多条用户消息
+            omitted = dropped.content.count('\n') + 1
+        else:
+            omitted = 1
+        if not self._omitted.get(sender):
+            self.logger.warning('%s 的缓存消息超出上限（%s），开始丢弃最早的消息', sender, reason)
+        self._omitted[sender] = self._omitted.get(sender, 0) + omitted
+        if not messages:
+            # 整个用户的待处理消息都被全局上限淘汰
+            self._clear(sender)
+
+    def _clear(self, sender: str) -> None:
+        self.user_messages.pop(sender, None)
+        self._total_bytes -= self._bytes.pop(sender, 0)
+        self._deadlines.pop(sender, None)
+        self._batch_start.pop(sender, None)
+        self._not_before.pop(sender, None)
+
+    def _schedule(self, sender: str, deadline: float) -> None:
+        """设置用户的到期时间，O(log n)"""
+        self._deadlines[sender] = deadline
+        heapq.heappush(self._heap, (deadline, next(self._seq), sender))
+        # 过期条目过多时重建堆，避免频繁重新计时的用户让堆无限增长
+        if len(self._heap) > 2 * len(self._deadlines) + 64:
+            self._heap = [(d, next(self._seq), s) for s, d in self._deadlines.items()]
+            heapq.heapify(self._heap)
+
+    def _combine(self, sender: str, now: float) -> str:
+        """合并并清空用户的缓存消息"""
+        messages = self.user_messages[sender]
+        DEBOUNCE_WAIT_SECONDS.observe(time.time() - messages[0].timestamp)
+        DEBOUNCE_FLUSHES.inc(reason=self._flush_reason(sender, now))
+        # 回填的消息已经是合并后的格式，直接使用
+        lines = [msg.content if msg.type == COMBINED_TYPE else f"用户: {msg.content}" for msg in messages]
+        omitted = self._omitted.pop(sender, 0)
+        if omitted and self.overflow_policy == 'summarize':
+            lines.insert(0, f"（消息过多，已省略更早的 {omitted} 条消息）")
+        self._clear(sender)
+        return "\n".join(lines)
+
+    def _flush_reason(self, sender: str, now: float) -> str:
+        delay, max_age, max_messages = self.debounce_settings(sender)
+        if sender in self._not_before:
+            return 'requeue'
+        if max_messages and len(self.user_messages[sender]) >= max_messages:
+            return 'max_messages'
+        if now - self.last_message_time.get(sender, now) < delay:
+            return 'max_age'
+        return 'idle'
+
+    def _evict_idle(self, now: float) -> None:
+        """清理超过 idle_ttl 没有新消息且没有待处理消息的用户记录"""
+        self._next_idle_sweep = now + self.idle_ttl
+        idle = [sender for sender, last in self.last_message_time.items()
+                if now - last >= self.idle_ttl and sender not in self.user_messages]
+        for sender in idle:
+            del self.last_message_time[sender]
+            self._omitted.pop(sender, None)
+        self.evicted_senders += len(idle)
+
+    def pending_senders(self) -> int:
+        """返回有待合并消息的用户数"""
+        with self._lock:
+            return len(self._deadlines)
+
+    def stats(self) -> Dict[str, float]:
+        """缓存占用统计，用于确定上限配置"""
+        with self._lock:
+            return {
+                'senders': len(self.last_message_time),
+                'pending_senders': len(self._deadlines),
+                'messages': sum(len(messages) for messages in self.user_messages.values()),
+                'bytes': self._total_bytes,
+                'max_total_bytes': self.max_total_bytes,
+                'utilization': self._total_bytes / self.max_total_bytes if self.max_total_bytes else 0.0,
+                'largest_sender_bytes': max(self._bytes.values(), default=0),
+                'dropped': self.dropped,
+                'evicted_senders': self.evicted_senders
+            }
+
+    def next_deadline(self) -> Optional[float]:
+        """返回最早到期的时间（time.monotonic() 时间戳），没有待处理消息时返回None"""
+        with self._lock:
+            while self._heap:
+                deadline, _, sender = self._heap[0]
+                if self._deadlines.get(sender) == deadline:
+                    return deadline
+                heapq.heappop(self._heap)  # 丢弃过期条目
+            return None
+
+    def pop_due(self, now: Optional[float] = None) -> List[Tuple[str, str]]:
+        """取出所有已到期用户的合并消息
+
+        只访问已到期的堆顶条目，开销与到期用户数相关，与缓存中的用户总数无关。
+
+        Returns:
+            (用户, 合并后的消息) 列表，按到期时间排序
+        """
+        if now is None:
+            now = time.monotonic()
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                deadline, _, sender = heapq.heappop(self._heap)
+                if self._deadlines.get(sender) != deadline:
+                    continue  # 已被重新计时的过期条目
+                if self.user_messages.get(sender):
+                    due.append((sender, self._combine(sender, now)))
+                else:
+                    self._deadlines.pop(sender, None)
+            if now >= self._next_idle_sweep:
+                self._evict_idle(now)
+        return due
+
     def get_combined_messages(self, sender: str) -> Optional[str]:
         """获取并清空用户的缓存消息"""
-        if sender not in self.user_messages or not self.user_messages[sender]:
+        with self._lock:
+            if sender not in self.user_messages or not self.user_messages[sender]:
+                return None
+
+            now = time.monotonic()
+            # 静默超过 response_delay、等待超过 max_batch_age 或消息数达到上限时才返回
+            if self._deadlines.get(sender, now) <= now:
+                return self._combine(sender, now)
             return None
-            
-        current_time = datetime.now()
-        if sender in self.last_message_time:
-            time_diff = (current_time - self.last_message_time[sender]).total_seconds()
-            # 只有当距离最后一条消息超过3秒时才返回
-            if time_diff >= self.response_delay:
-                combined_message = "\n".join([f"用户: {msg['content']}" for msg in self.user_messages[sender]])
-                self.user_messages[sender] = []
-                return combined_message
-        return None
\ No newline at end of file
@@ -0,0 +1,202 @@
+import os
+import tempfile
+import threading
+from collections import deque
+from typing import Iterable, List
+
+from PyQt5.QtCore import QAbstractListModel, QModelIndex, QRect, QSize, Qt
+from PyQt5.QtGui import QColor, QFont, QFontMetrics
+from PyQt5.QtWidgets import QStyle, QStyledItemDelegate
+
+from src.chat_message import ChatMessage
+
+# 日志条目字段下标：[标题, 正文, 颜色, 消息ID, 缓存的(宽度, 高度)]
+HEADER, BODY, COLOR, MSG_ID, SIZE = range(5)
+
+def format_message_entry(sender: str, message: ChatMessage) -> list:
+    """将聊天消息转换为日志条目，时间在此时才格式化"""
+    return [
+        f"{sender} ({message.time_str})",
+        f"[{message.type}] {message.content}",
+        'red' if message.type == '处理错误' else 'blue',
+        message.id,
+        None
+    ]
+
+def format_status_entry(status: str) -> list:
+    """将状态信息转换为日志条目"""
+    return [None, f"[系统] {status}", '#555555', None, None]
+
+def entry_text(entry: list) -> str:
+    """日志条目的纯文本形式，用于导出"""
+    if entry[HEADER] is None:
+        return entry[BODY]
+    return f"{entry[HEADER]}\n{entry[BODY]}"
+
+
+class MessageLogModel(QAbstractListModel):
+    """有容量上限的消息日志模型
+
+    内存中只保留最近 capacity 条记录（环形缓冲），超出的旧记录以纯文本
+    追加写入临时溢出文件，导出时与内存中的记录合并，保证日志完整。
+    """
+
+    def __init__(self, capacity: int = 5000, parent=None):
+        super().__init__(parent)
+        self.capacity = max(1, capacity)
+        self._entries = deque()
+        self._spill_lock = threading.Lock()
+        self._spill_file = None
+        self._spilled = 0
+
+    def rowCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self._entries)
+
+    def data(self, index: QModelIndex, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self._entries):
+            return None
+        entry = self._entries[index.row()]
+        if role == Qt.DisplayRole:
+            return entry_text(entry)
+        if role == Qt.UserRole:
+            return entry
+        return None
+
+    def append_entries(self, entries: Iterable[list]) -> None:
+        """批量追加日志条目，超出容量时将最早的条目溢出到磁盘"""
+        entries = list(entries)
+        if not entries:
+            return
+        if len(entries) > self.capacity:
+            self._spill(entries[:-self.capacity])
+            entries = entries[-self.capacity:]
+
+        overflow = len(self._entries) + len(entries) - self.capacity
+        if overflow > 0:
+            self.beginRemoveRows(QModelIndex(), 0, overflow - 1)
+            self._spill([self._entries.popleft() for _ in range(overflow)])
+            self.endRemoveRows()
+
+        first = len(self._entries)
+        self.beginInsertRows(QModelIndex(), first, first + len(entries) - 1)
+        self._entries.extend(entries)
+        self.endInsertRows()
+
+    def append_entry(self, entry: list) -> None:
+        """追加单条日志条目"""
+        self.append_entries([entry])
+
+    def update_entry(self, entry: list) -> bool:
+        """按消息ID原地更新条目（用于流式回复），找不到时返回False
+
+        流式消息总是最近的记录，因此从末尾向前查找。
+        """
+        msg_id = entry[MSG_ID]
+        if msg_id is None:
+            return False
+        for row in range(len(self._entries) - 1, -1, -1):
+            if self._entries[row][MSG_ID] == msg_id:
+                self._entries[row] = entry
+                index = self.index(row)
+                self.dataChanged.emit(index, index)
+                return True
+        return False
+
+    def clear(self) -> None:
+        """清空所有日志，包括溢出文件"""
+        self.beginResetModel()
+        self._entries.clear()
+        self.endResetModel()
+        with self._spill_lock:
+            if self._spill_file is not None:
+                self._spill_file.seek(0)
+                self._spill_file.truncate()
+            self._spilled = 0
+
+    def export(self, file_path: str) -> None:
+        """导出全部日志（溢出文件 + 内存中的记录）到文本文件"""
+        with open(file_path, 'w', encoding='utf-8') as out:
+            with self._spill_lock:
+                if self._spill_file is not None:
+                    self._spill_file.flush()
+                    self._spill_file.seek(0)
+                    for line in self._spill_file:
+                        out.write(line)
+                    self._spill_file.seek(0, os.SEEK_END)
+            for entry in self._entries:
+                out.write(entry_text(entry) + '\n')
+
+    def _spill(self, entries: List[list]) -> None:
+        """将移出内存的条目写入溢出文件"""
+        with self._spill_lock:
+            if self._spill_file is None:
+                self._spill_file = tempfile.NamedTemporaryFile(
+                    mode='w+', encoding='utf-8', prefix='wxai_log_', suffix='.txt')
+            self._spill_file.write(''.join(entry_text(entry) + '\n' for entry in entries))
+            self._spilled += len(entries)
+
+    @property
+    def spilled_count(self) -> int:
+        """已溢出到磁盘的条目数"""
+        return self._spilled
+
+    def close(self) -> None:
+        """关闭并删除溢出文件"""
+        with self._spill_lock:
+            if self._spill_file is not None:
+                self._spill_file.close()
+                self._spill_file = None
+
+
+class MessageLogDelegate(QStyledItemDelegate):
+    """绘制日志条目：加粗的标题行 + 按类型着色的正文，正文自动换行"""
+
+    PADDING = 4
+
+    def _text_width(self, option) -> int:
+        width = option.rect.width()
+        if width <= 0 and self.parent() is not None:
+            width = self.parent().viewport().width()
+        return max(50, width - 2 * self.PADDING)
+
+    def sizeHint(self, option, index) -> QSize:
+        """计算条目高度，结果按宽度缓存在条目中，避免每次重新布局都重新测量文本"""
+        entry = index.data(Qt.UserRole)
+        if entry is None:
+            return super().sizeHint(option, index)
+        width = self._text_width(option)
+        if entry[SIZE] is not None and entry[SIZE][0] == width:
+            return QSize(width, entry[SIZE][1])
+        height = 2 * self.PADDING
+        if entry[HEADER] is not None:
+            bold = QFont(option.font)
+            bold.setBold(True)
+            height += QFontMetrics(bold).height()
+        height += QFontMetrics(option.font).boundingRect(
+            QRect(0, 0, width, 0), Qt.TextWordWrap, entry[BODY]).height()
+        entry[SIZE] = (width, height)
+        return QSize(width, height)
+
+    def paint(self, painter, option, index) -> None:
+        entry = index.data(Qt.UserRole)
+        if entry is None:
+            return super().paint(painter, option, index)
+        painter.save()
+        if option.state & QStyle.State_Selected:
+            painter.fillRect(option.rect, option.palette.highlight())
+
+        rect = option.rect.adjusted(self.PADDING, self.PADDING, -self.PADDING, -self.PADDING)
+        if entry[HEADER] is not None:
+            bold = QFont(option.font)
+            bold.setBold(True)
+            painter.setFont(bold)
+            painter.setPen(option.palette.text().color())
+            header_height = QFontMetrics(bold).height()
+            painter.drawText(QRect(rect.left(), rect.top(), rect.width(), header_height),
+                             Qt.AlignLeft | Qt.AlignVCenter, entry[HEADER])
+            rect.setTop(rect.top() + header_height)
+
+        painter.setFont(option.font)
+        painter.setPen(QColor(entry[COLOR]))
+        painter.drawText(rect, Qt.AlignLeft | Qt.AlignTop | Qt.TextWordWrap, entry[BODY])
+        painter.restore()
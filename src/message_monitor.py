@@ -0,0 +1,593 @@
+import time
+import itertools
+import threading
+import logging
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional
+from PyQt5.QtCore import QThread, pyqtSignal
+from src.wechat_handler import WeChatHandler
+from src.ai_handler import AIHandler, AsyncAIHandler, CircuitOpenError, RateLimitedError
+from src.ai_dispatcher import AIRequestDispatcher
+from src.message_cache import MessageCache
+from src.journal import MessageJournal, SeqRanges
+from src.conversation_store import ConversationStore
+from src.chat_message import ChatMessage
+from src.reply_stream import StreamingReply
+from src.send_queue import SendQueue
+from src.logger import get_log_stats, shorten
+from src.metrics import ERRORS, MESSAGES_RECEIVED, POLL_INTERVAL_SECONDS, POLL_SWEEP_SECONDS, REGISTRY
+
+class MessageMonitor(QThread):
+    message_received = pyqtSignal(str, object)  # (发送者, ChatMessage)
+    status_updated = pyqtSignal(str)  # 添加这行
+    
+    def __init__(self, wechat_handler: WeChatHandler, ai_handler: AIHandler, config: dict = None):
+        super().__init__()
+        self.logger = logging.getLogger(__name__)
+        self.wechat = wechat_handler
+        self.ai = ai_handler
+        self.config = config or {}
+        self.running = False
+        self.message_cache = self._create_message_cache(self.config.get('message_cache') or {})
+        self.conversations = self._create_conversation_store(self.config.get('context') or {})
+        self.listen_targets = set()  # 添加监听目标集合
+        
+        # AI处理工作线程池：轮询线程只负责分派，不等待AI响应
+        self.max_workers = max(1, int(self.config.get('max_workers', 4)))
+        self._executor = None
+        self._executor_tasks = 0  # 已提交到线程池但尚未完成的任务数（排队中和执行中）
+        self._pending_lock = threading.Lock()
+        self._pending_batches = {}  # 每个用户待处理的消息组合队列
+        self._active_senders = set()  # 正在处理中的用户
+        # 异步后端或优先级分派下AI请求并发执行，线程池只负责收尾
+        self._use_dispatcher = isinstance(ai_handler, AIRequestDispatcher)
+        if self._use_dispatcher:
+            # 分派器的并发上限与工作线程数一致，不超过配置的 max_workers
+            ai_handler.set_max_concurrency(self.max_workers)
+        self._use_async = self._use_dispatcher or isinstance(ai_handler, AsyncAIHandler)
+        # AI请求失败（重试已用尽或服务熔断中）时，消息组合放回缓存稍后重新处理
+        self.requeue_delay = float(self.config.get('requeue_delay', 5.0))
+        self.max_requeues = int(self.config.get('max_requeues', 3))
+        self._requeue_counts: Dict[str, int] = {}
+        
+        # 发送队列：由专用线程按聊天分组、限速并重试发送回复
+        send_config = self.config.get('send_queue') or {}
+        self.send_queue = SendQueue(
+            wechat_handler,
+            min_interval=send_config.get('min_interval', 0.2),
+            chat_interval=send_config.get('chat_interval', 1.0),
+            max_burst=send_config.get('max_burst', 5),
+            max_retries=send_config.get('max_retries', 3),
+            retry_backoff=send_config.get('retry_backoff', 1.0),
+            max_backoff=send_config.get('max_backoff', 30.0)
+        )
+        self.send_drain_timeout = send_config.get('drain_timeout', 5.0)
+        
+        # 流式回复：逐步显示生成内容，可选在首句完成时提前发送
+        self.stream_replies = bool(self.config.get('stream_replies', False))
+        self.early_send = self.stream_replies and bool(self.config.get('early_send', False))
+        self.early_send_min_chars = int(self.config.get('early_send_min_chars', 8))
+        self._stream_seq = itertools.count(1)
+        
+        # 预写日志：记录已缓存但尚未回复的消息，启动时重放（在 run() 中打开，停止时关闭）
+        self.journal_config = self.config.get('journal') or {}
+        self.journal: Optional[MessageJournal] = None
+        # 每个用户已分派到消息组合的最大日志序号、处理中消息组合的序号区间（按分派顺序），
+        # 以及放回缓存的消息组合的序号区间（随下一个消息组合一起确认）
+        self._journal_marks: Dict[str, int] = {}
+        self._journal_inflight: Dict[str, deque] = {}
+        self._journal_requeued: Dict[str, SeqRanges] = {}
+        
+        # 自适应调度：空闲时轮询间隔指数退避，收到消息后恢复最短间隔；
+        # 两次轮询之间按最早的消息到期时间唤醒，而不是固定间隔空转
+        self.poll_interval_min = float(self.config.get('poll_interval_min', 0.1))
+        self.poll_interval_max = max(self.poll_interval_min, float(self.config.get('poll_interval_max', 1.0)))
+        self.poll_backoff = max(1.0, float(self.config.get('poll_backoff', 2.0)))
+        self._wakeup = threading.Event()
+        self._poll_interval_targets = set()  # 已导出轮询间隔的目标
+        self.scheduler_metrics = {
+            'poll_interval': self.poll_interval_min,  # 当前轮询间隔（秒）
+            'last_wait': 0.0,  # 最近一次休眠时长（秒）
+            'polls': 0,  # 轮询次数
+            'idle_polls': 0,  # 没有新消息的轮询次数
+            'wakeups': 0  # 调度循环唤醒次数
+        }
+        self.logger.info("消息监控器初始化完成")
+
+    def _create_conversation_store(self, context_config: dict) -> Optional[ConversationStore]:
+        """按配置创建对话上下文存储，未启用时返回None"""
+        if not context_config.get('enabled', True):
+            return None
+        return ConversationStore(
+            max_tokens=context_config.get('max_tokens', 1000),
+            max_conversations=context_config.get('max_conversations', 1000),
+            db_path=context_config.get('db_path'),
+            retention=context_config.get('retention', 7 * 24 * 3600),
+            commit_interval=context_config.get('commit_interval', 0.5)
+        )
+
+    def _create_message_cache(self, cache_config: dict) -> MessageCache:
+        """按配置创建消息缓存，限制每个用户和全部用户缓存的消息量"""
+        return MessageCache(
+            self.config.get('response_delay', 3),
+            max_messages_per_sender=cache_config.get('max_messages_per_sender', 200),
+            max_bytes_per_sender=cache_config.get('max_bytes_per_sender', 64 * 1024),
+            max_total_bytes=cache_config.get('max_total_bytes', 8 * 1024 * 1024),
+            overflow_policy=cache_config.get('overflow_policy', 'summarize'),
+            idle_ttl=cache_config.get('idle_ttl', 600),
+            max_batch_age=self.config.get('max_batch_age', 15),
+            max_batch_messages=self.config.get('max_batch_messages', 20),
+            target_debounce=self.config.get('debounce_targets') or {}
+        )
+
+    def update_listen_targets(self, targets):
+        """更新监听目标列表"""
+        self.listen_targets = set(targets)
+        self.logger.info(f"更新监听目标: {', '.join(targets)}")
+
+    def _open_journal(self):
+        """打开预写日志，并把上次未回复的消息放回消息缓存"""
+        path = self.journal_config.get('path')
+        if not path:
+            return
+        try:
+            self.journal = MessageJournal(
+                path,
+                flush_interval=self.journal_config.get('flush_interval', 0.05),
+                max_batch=self.journal_config.get('max_batch', 512),
+                compact_min_records=self.journal_config.get('compact_min_records', 10000)
+            )
+        except Exception as e:
+            self.logger.error(f'打开预写日志失败，本次运行不记录待回复消息: {str(e)}', exc_info=True)
+            self.status_updated.emit(f'打开预写日志失败: {str(e)}')
+            return
+        pending = self.journal.pending()
+        for sender, messages in pending.items():
+            for msg in messages:
+                self.message_cache.add_message(sender, msg)
+        if pending:
+            count = sum(len(messages) for messages in pending.values())
+            self.logger.info('从预写日志恢复了 %d 个聊天的 %d 条未回复消息', len(pending), count)
+            self.status_updated.emit(f'恢复了 {count} 条上次未回复的消息')
+
+    def _close_journal(self):
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+    def _journal_dispatch(self, sender: str):
+        """记录新分派的消息组合覆盖的日志序号区间（在调度线程中，紧接着 pop_due 调用）"""
+        last = self.journal.last_seq(sender)
+        first = self._journal_marks.get(sender, 0) + 1
+        self._journal_marks[sender] = last
+        with self._pending_lock:
+            ranges = self._journal_requeued.pop(sender, [])
+            if first <= last:
+                ranges.append((first, last))
+            self._journal_inflight.setdefault(sender, deque()).append(ranges)
+
+    def _journal_take(self, sender: str) -> SeqRanges:
+        """取出该用户最早分派、当前开始处理的消息组合的序号区间
+
+        同一用户的消息组合按分派顺序串行处理，因此处理顺序与分派顺序一致。
+        """
+        if self.journal is None:
+            return []
+        with self._pending_lock:
+            queue = self._journal_inflight.get(sender)
+            if not queue:
+                return []
+            ranges = queue.popleft()
+            if not queue:
+                del self._journal_inflight[sender]
+            return ranges
+
+    def _journal_ack(self, sender: str, ranges: SeqRanges):
+        journal = self.journal
+        if journal is not None and ranges:
+            journal.ack(sender, ranges)
+
+    def check_and_process_messages(self):
+        """取出已到期的缓存消息，将消息组合分派给工作线程池"""
+        for sender, combined_message in self.message_cache.pop_due():
+            if self.journal is not None:
+                self._journal_dispatch(sender)
+            self.dispatch_batch(sender, combined_message)
+
+    def dispatch_batch(self, sender: str, combined_message: str):
+        """将消息组合加入该用户的待处理队列
+
+        同一用户的消息组合按顺序串行处理，不同用户之间并发处理，
+        并发总数受线程池大小限制。
+        """
+        with self._pending_lock:
+            self._pending_batches.setdefault(sender, deque()).append(combined_message)
+            if sender in self._active_senders:
+                return
+            self._active_senders.add(sender)
+        if self._use_async:
+            self._submit_next_async(sender)
+        else:
+            self._submit_work(self._drain_sender, sender)
+
+    def _submit_work(self, fn, *args) -> None:
+        """向工作线程池提交任务，并维护未完成任务数用于导出指标"""
+        future = self._executor.submit(fn, *args)
+        with self._pending_lock:
+            self._executor_tasks += 1
+        future.add_done_callback(self._on_work_done)
+
+    def _on_work_done(self, future) -> None:
+        with self._pending_lock:
+            self._executor_tasks -= 1
+
+    def _next_batch(self, sender: str) -> Optional[str]:
+        """取出某个用户的下一个待处理消息组合，没有时将其标记为空闲"""
+        with self._pending_lock:
+            queue = self._pending_batches.get(sender)
+            if not queue or not self.running:
+                self._pending_batches.pop(sender, None)
+                self._active_senders.discard(sender)
+                return None
+            return queue.popleft()
+
+    def _drain_sender(self, sender: str):
+        """在工作线程中依次处理某个用户的所有待处理消息组合"""
+        while True:
+            combined_message = self._next_batch(sender)
+            if combined_message is None:
+                return
+            self.process_batch(sender, combined_message)
+
+    def _submit_next_async(self, sender: str):
+        """异步后端：提交某个用户的下一个消息组合，完成后再提交下一个以保证顺序"""
+        combined_message = self._next_batch(sender)
+        if combined_message is None:
+            return
+        prompt = self._build_prompt(sender, combined_message)
+        stream = self._create_stream(sender)
+        on_delta = stream.feed if stream else None
+        if self._use_dispatcher:
+            future = self.ai.submit(prompt, self._get_context(sender), on_delta=on_delta, target=sender)
+        else:
+            future = self.ai.submit(prompt, self._get_context(sender), on_delta=on_delta)
+        future.add_done_callback(lambda f: self._on_async_reply(sender, combined_message, f, stream))
+
+    def _on_async_reply(self, sender: str, combined_message: str, future,
+                        stream: Optional[StreamingReply] = None):
+        """异步请求完成回调（在事件循环线程中执行），发送环节交给工作线程"""
+        try:
+            self._submit_work(self._finish_async_batch, sender, combined_message, future, stream)
+        except RuntimeError:
+            # 线程池已关闭，监控已停止
+            with self._pending_lock:
+                self._pending_batches.pop(sender, None)
+                self._active_senders.discard(sender)
+
+    def _finish_async_batch(self, sender: str, combined_message: str, future,
+                            stream: Optional[StreamingReply] = None):
+        """发送异步请求的回复，然后继续处理该用户的下一个消息组合"""
+        journal_ranges = self._journal_take(sender)
+        try:
+            ai_response = future.result()
+            self._requeue_counts.pop(sender, None)
+            self._record_turn(sender, combined_message, ai_response)
+            self._deliver_reply(sender, ai_response, stream, journal_ranges)
+        except Exception as e:
+            self._handle_batch_failure(sender, combined_message, e, stream, journal_ranges)
+        finally:
+            self._submit_next_async(sender)
+
+    def _build_prompt(self, sender: str, combined_message: str) -> str:
+        """构建发送给AI的提示"""
+        self.logger.info('开始处理来自 %s 的消息组合', sender)
+        self.status_updated.emit(f'开始处理来自 {sender} 的消息组合')
+        
+        prompt = f"用户发送了以下多条消息：\n{combined_message}\n请统一回复这些消息。"
+        self.logger.debug('发送到AI的消息: %s', prompt)
+        self.status_updated.emit(f'发送到AI的消息: {prompt}')
+        return prompt
+
+    def _create_stream(self, sender: str) -> Optional[StreamingReply]:
+        """创建流式回复跟踪器，未启用流式模式时返回None
+        
+        提前发送只是加入发送队列，不会阻塞工作线程或异步后端的事件循环。
+        """
+        if not self.stream_replies:
+            return None
+        stream_id = f'ai_stream_{next(self._stream_seq)}'
+        
+        def on_update(text):
+            self.message_received.emit('AI助手', ChatMessage('Text', text, id=stream_id, partial=True))
+        
+        def on_early_send(chunk):
+            return self._send_reply_part(sender, chunk)
+        
+        return StreamingReply(
+            stream_id,
+            on_update,
+            on_early_send if self.early_send else None,
+            min_chars=self.early_send_min_chars
+        )
+
+    def process_batch(self, sender: str, combined_message: str):
+        """调用AI处理一个消息组合并发送回复"""
+        journal_ranges = self._journal_take(sender)
+        stream = None
+        try:
+            prompt = self._build_prompt(sender, combined_message)
+            stream = self._create_stream(sender)
+            ai_response = self.ai.process_message(prompt, self._get_context(sender),
+                                                  on_delta=stream.feed if stream else None)
+            self._requeue_counts.pop(sender, None)
+            self._record_turn(sender, combined_message, ai_response)
+            self._deliver_reply(sender, ai_response, stream, journal_ranges)
+        except Exception as e:
+            self._handle_batch_failure(sender, combined_message, e, stream, journal_ranges)
+
+    def _handle_batch_failure(self, sender: str, combined_message: str, error: Exception,
+                              stream: Optional[StreamingReply] = None, journal_ranges: SeqRanges = ()):
+        """AI处理失败：将消息组合放回缓存稍后重试，超过重试次数或已提前发送部分回复时放弃
+
+        放弃的消息组合在预写日志中确认，重启后不再重放；放回缓存的随下一个消息组合确认；
+        监控停止时失败（含被取消）的不确认，下次启动时重放。
+        """
+        ERRORS.inc(stage='process', type=type(error).__name__)
+        if isinstance(error, (CircuitOpenError, RateLimitedError)):
+            self.logger.warning('AI处理失败: %s', error)
+        else:
+            self.logger.error(f'AI处理失败: {str(error)}', exc_info=True)
+        self.status_updated.emit(f'AI处理失败: {str(error)}')
+        
+        if stream is not None and stream.sent_text:
+            self.logger.warning('%s 的回复已提前发送一部分，不再重新处理', sender)
+            self._journal_ack(sender, list(journal_ranges))
+            return
+        if not self.running:
+            self.logger.info('监控已停止，来自 %s 的消息组合留在预写日志中，下次启动时重新处理', sender)
+            return
+        attempts = self._requeue_counts.get(sender, 0) + 1
+        if attempts > self.max_requeues:
+            self._requeue_counts.pop(sender, None)
+            self.logger.error('来自 %s 的消息组合处理失败 %d 次，已放弃: %s',
+                              sender, attempts, shorten(combined_message, 100))
+            self.status_updated.emit(f'来自 {sender} 的消息处理失败次数过多，已放弃')
+            self._journal_ack(sender, list(journal_ranges))
+            return
+        self._requeue_counts[sender] = attempts
+        delay = self.requeue_delay
+        if isinstance(error, (CircuitOpenError, RateLimitedError)):
+            delay = max(delay, error.retry_in)
+        if journal_ranges:
+            # 先登记再放回缓存，调度线程取出该消息组合时一定能拿到这些区间
+            with self._pending_lock:
+                self._journal_requeued.setdefault(sender, []).extend(journal_ranges)
+        self.message_cache.requeue(sender, combined_message, delay)
+        self._wakeup.set()  # 让调度循环按新的到期时间休眠
+        self.logger.info('来自 %s 的消息组合将在 %.0f 秒后重新处理（第 %d 次）', sender, delay, attempts)
+        self.status_updated.emit(f'来自 {sender} 的消息将在 {delay:.0f} 秒后重新处理')
+
+    def _get_context(self, sender: str) -> Optional[List[Dict]]:
+        """获取该用户的对话上下文，未启用上下文时返回None"""
+        if self.conversations is None:
+            return None
+        return self.conversations.get_context(sender) or None
+
+    def _record_turn(self, sender: str, combined_message: str, ai_response: Optional[str]):
+        """将本轮用户消息和AI回复写入对话上下文"""
+        if self.conversations is None or not ai_response:
+            return
+        self.conversations.append(sender, 'user', combined_message)
+        self.conversations.append(sender, 'assistant', ai_response)
+
+    def _send_reply_part(self, sender: str, text: str) -> Future:
+        """将一段回复内容加入发送队列，返回发送结果的 Future"""
+        self.wechat.dedup.remember_reply(sender, text)
+        future = self.send_queue.enqueue(sender, text)
+        future.add_done_callback(lambda f: self._on_reply_sent(sender, f.result()))
+        return future
+
+    def _on_reply_sent(self, sender: str, ok: bool):
+        """发送完成回调（在发送线程中执行）"""
+        if ok:
+            self.logger.info('已成功发送回复到 %s', sender)
+            self.status_updated.emit(f'已成功发送回复到 {sender}')
+        else:
+            self.logger.error('发送消息到 %s 失败', sender)
+            self.status_updated.emit(f'发送消息到 {sender} 失败')
+
+    def _deliver_reply(self, sender: str, ai_response: Optional[str], stream: Optional[StreamingReply] = None,
+                       journal_ranges: SeqRanges = ()):
+        """发送AI回复到微信，流式模式下只发送尚未提前发送的部分
+
+        发送队列按聊天保持先进先出，提前发送的首句一定先于剩余部分发出。
+        回复发送成功后在预写日志中确认这些消息，发送失败的下次启动时重新处理。
+        """
+        journal_ranges = list(journal_ranges)
+        if not ai_response:
+            self._journal_ack(sender, journal_ranges)
+            return
+        self.logger.info('收到AI回复: %s', shorten(ai_response, 100))
+        self.status_updated.emit(f'收到AI回复: {ai_response}')
+        
+        reply_message = ChatMessage('Text', ai_response, id=stream.stream_id if stream is not None else 'ai_response')
+        remainder = stream.remainder(ai_response) if stream is not None else ai_response
+        early = stream.early_future if stream is not None else None
+        
+        def on_sent(future):
+            # 同一聊天按入队顺序发送，剩余部分有结果时提前发送的首句也已有结果
+            if future.result() and (early is None or (early.done() and early.result())):
+                self.message_received.emit('AI助手', reply_message)
+                self._journal_ack(sender, journal_ranges)
+        
+        # 整条回复都已提前发送时，等提前发送的结果再确认
+        last = self._send_reply_part(sender, remainder) if remainder else early
+        if last is None:
+            self.message_received.emit('AI助手', reply_message)
+            self._journal_ack(sender, journal_ranges)
+            return
+        last.add_done_callback(on_sent)
+
+    def poll_messages(self) -> int:
+        """轮询一次微信新消息并缓存需要AI回复的文本消息
+        
+        Returns:
+            本次收到的消息数量
+        """
+        received = 0
+        with POLL_SWEEP_SECONDS.time():
+            messages = self.wechat.get_new_messages()
+        for sender, msg_list in messages.items():
+            # 只处理在监听列表中的目标消息
+            if self.listen_targets and sender not in self.listen_targets:
+                self.logger.debug("跳过非监听目标 %s 的消息", sender)
+                continue
+                
+            MESSAGES_RECEIVED.inc(len(msg_list))
+            for msg in msg_list:
+                received += 1
+                self.logger.info("收到来自 %s 的消息: %s", sender, shorten(msg.content, 100))
+                self.message_received.emit(sender, msg)
+                
+                if msg.is_text():
+                    if sender == 'AI助手' or msg.id == 'ai_response':
+                        self.logger.debug("跳过AI助手自己的消息")
+                        continue
+                    
+                    if self.wechat.ui and not self.wechat.ui.is_auto_reply_enabled():
+                        self.logger.debug("自动回复已禁用，跳过处理")
+                        continue
+                    
+                    # 跳过微信回显的AI回复
+                    content = msg.content
+                    if self.wechat.dedup.is_reply_echo(sender, content):
+                        self.logger.info('跳过缓存AI回复内容: %s', shorten(content, 50))
+                        self.status_updated.emit(f'跳过缓存AI回复内容: {content}')
+                        continue
+                    
+                    # 先写入预写日志再缓存，分派时按日志序号确定消息组合覆盖的范围
+                    if self.journal is not None:
+                        self.journal.append(sender, msg)
+                    self.message_cache.add_message(sender, msg)
+                    self.logger.info('已缓存来自 %s 的消息: %s', sender, shorten(content, 50))
+                    self.status_updated.emit(f'已缓存来自 {sender} 的消息: {content}')
+        return received
+
+    def _next_poll_interval(self, interval: float, received: int) -> float:
+        """计算下一次轮询间隔：有新消息时恢复最短间隔，空闲时指数退避"""
+        if received:
+            return self.poll_interval_min
+        return min(interval * self.poll_backoff, self.poll_interval_max)
+
+    def get_scheduler_metrics(self) -> dict:
+        """返回调度器指标快照，用于按部署环境调优轮询参数"""
+        return dict(self.scheduler_metrics)
+
+    def collect_metrics(self) -> Dict[str, float]:
+        """导出指标时采集的队列深度、调度器和缓存状态"""
+        with self._pending_lock:
+            pending = sum(len(queue) for queue in self._pending_batches.values())
+            active = len(self._active_senders)
+            executor_tasks = self._executor_tasks
+        metrics = {
+            'pending_batches': pending,
+            'active_senders': active,
+            'cached_senders': self.message_cache.pending_senders(),
+            'executor_tasks': executor_tasks,
+            'send_queue': len(self.send_queue)
+        }
+        metrics.update({f'scheduler_{k}': v for k, v in self.scheduler_metrics.items()})
+        intervals = self.wechat.get_poll_intervals()
+        self._export_poll_intervals(intervals)
+        if intervals:
+            metrics['poll_interval_min'] = min(intervals.values())
+            metrics['poll_interval_max'] = max(intervals.values())
+        metrics.update({f'message_cache_{k}': v for k, v in self.message_cache.stats().items()})
+        if self.conversations is not None:
+            metrics.update({f'context_{k}': v for k, v in self.conversations.stats().items()})
+        if self.ai.response_cache is not None:
+            metrics.update({f'response_cache_{k}': v for k, v in self.ai.response_cache.stats().items()})
+        if self.ai.rate_limiter is not None:
+            metrics.update({f'rate_limit_{k}': v for k, v in self.ai.rate_limiter.stats().items()})
+        metrics.update({f'dedup_{k}': v for k, v in self.wechat.dedup.stats().items()})
+        journal = self.journal
+        if journal is not None:
+            metrics.update({f'journal_{k}': v for k, v in journal.stats().items()})
+        metrics.update({f'log_{k}': v for k, v in get_log_stats().items()})
+        return metrics
+
+    def _export_poll_intervals(self, intervals: Dict[str, float]) -> None:
+        """把各目标的轮询间隔写入带 target 标签的仪表，删除已移除目标的值"""
+        with self._pending_lock:  # HTTP端点和快照线程可能同时采集
+            for target in self._poll_interval_targets - intervals.keys():
+                POLL_INTERVAL_SECONDS.remove(target=target)
+            for target, interval in intervals.items():
+                POLL_INTERVAL_SECONDS.set(interval, target=target)
+            self._poll_interval_targets = set(intervals)
+
+    def run(self):
+        self.logger.info("消息监控线程启动")
+        self.running = True
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='ai_worker')
+        self.send_queue.start()
+        self.logger.info(f"AI工作线程池已启动，并发上限: {self.max_workers}")
+        self._open_journal()
+        # 采集函数只在线程运行期间注册，停止后不再引用本监控器
+        REGISTRY.register_collector('monitor', self.collect_metrics)
+        
+        poll_interval = self.poll_interval_min
+        next_poll = time.monotonic()
+        while self.running:
+            now = time.monotonic()
+            if now >= next_poll:
+                received = 0
+                try:
+                    received = self.poll_messages()
+                except Exception as e:
+                    ERRORS.inc(stage='poll', type=type(e).__name__)
+                    self.logger.error(f'监听出错: {str(e)}', exc_info=True)
+                    self.status_updated.emit(f'监听出错: {str(e)}')
+                poll_interval = self._next_poll_interval(poll_interval, received)
+                # 微信处理器按目标调度轮询，有目标到期时提前唤醒
+                poll_interval = max(self.poll_interval_min, min(poll_interval, self.wechat.next_poll_delay()))
+                next_poll = time.monotonic() + poll_interval
+                self.scheduler_metrics['polls'] += 1
+                if not received:
+                    self.scheduler_metrics['idle_polls'] += 1
+                self.scheduler_metrics['poll_interval'] = poll_interval
+            
+            try:
+                # 处理已到期的缓存消息
+                self.check_and_process_messages()
+            except Exception as e:
+                ERRORS.inc(stage='dispatch', type=type(e).__name__)
+                self.logger.error(f'处理缓存消息出错: {str(e)}', exc_info=True)
+                self.status_updated.emit(f'处理缓存消息出错: {str(e)}')
+            
+            # 休眠到下一个轮询时间或最早的消息到期时间，stop() 会立即唤醒
+            wake_at = next_poll
+            deadline = self.message_cache.next_deadline()
+            if deadline is not None and deadline < wake_at:
+                wake_at = deadline
+            wait = max(0.0, wake_at - time.monotonic())
+            self.scheduler_metrics['wakeups'] += 1
+            self.scheduler_metrics['last_wait'] = wait
+            self._wakeup.wait(wait)
+            self._wakeup.clear()
+        
+        REGISTRY.unregister_collector('monitor', self.collect_metrics)
+        self._export_poll_intervals({})
+        # 不等待进行中的AI请求，未开始的消息组合会在工作线程中被丢弃
+        self._executor.shutdown(wait=False)
+        self.logger.info("AI工作线程池已关闭")
+        self.send_queue.stop(self.send_drain_timeout)
+        # 发送队列停止后再关闭日志，已发出的回复都能写入确认
+        self._close_journal()
+        if self.conversations is not None:
+            self.conversations.close()
+    
+    def stop(self):
+        self.logger.info("停止消息监控线程")
+        self.running = False
+        self._wakeup.set()
@@ -0,0 +1,331 @@
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# 默认的延迟直方图分桶（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+def _label_key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def _format_labels(key: LabelKey, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ''
+    escaped = (v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """指标基类：按标签组合分别保存数值"""
+    type_name = ''
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._lock = threading.Lock()
+        self._values: Dict[LabelKey, object] = {}
+
+    def _header(self) -> List[str]:
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type_name}']
+
+
+class Counter(_Metric):
+    """只增不减的计数器"""
+    type_name = 'counter'
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return self._header() + [f'{self.name}{_format_labels(k)} {_format_value(v)}' for k, v in items]
+
+    def snapshot(self) -> List[Dict]:
+        with self._lock:
+            return [{'labels': dict(k), 'value': v} for k, v in self._values.items()]
+
+
+class Gauge(Counter):
+    """可任意设置的瞬时值"""
+    type_name = 'gauge'
+
+    def set(self, value: float, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def remove(self, **labels) -> None:
+        """删除一组标签的值，例如已移除的监听目标"""
+        key = _label_key(labels)
+        with self._lock:
+            self._values.pop(key, None)
+
+
+class Histogram(_Metric):
+    """固定分桶的直方图，记录观测值的分布、总和与次数"""
+    type_name = 'histogram'
+
+    def __init__(self, name: str, help_text: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = _label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]  # [各桶计数, 总和, 次数]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def time(self, **labels) -> '_Timer':
+        """返回计时上下文管理器，退出时记录耗时"""
+        return _Timer(self, labels)
+
+    def _items(self) -> List[Tuple[LabelKey, List[int], float, int]]:
+        with self._lock:
+            return [(k, list(s[0]), s[1], s[2]) for k, s in self._values.items()]
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        for key, counts, total, count in self._items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{_format_labels(key, (("le", _format_value(bound)),))} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(key)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(key)} {count}')
+        return lines
+
+    def snapshot(self) -> List[Dict]:
+        return [{'labels': dict(key), 'count': count, 'sum': total,
+                 'buckets': dict(zip([str(b) for b in self.buckets] + ['+Inf'], counts))}
+                for key, counts, total, count in self._items()]
+
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'start')
+
+    def __init__(self, histogram: Histogram, labels: Dict):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class MetricsRegistry:
+    """指标注册表
+
+    除了主动更新的计数器/直方图/仪表外，还可以注册采集函数，
+    在导出时读取队列深度、缓存统计等状态，采集函数返回 {指标名: 数值}。
+    """
+
+    def __init__(self, prefix: str = 'wxai_'):
+        self.prefix = prefix
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: Dict[str, Callable[[], Dict[str, float]]] = {}
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        return self._register(Counter(self.prefix + name, help_text))
+
+    def gauge(self, name: str, help_text: str) -> Gauge:
+        return self._register(Gauge(self.prefix + name, help_text))
+
+    def histogram(self, name: str, help_text: str, buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(self.prefix + name, help_text, buckets))
+
+    def register_collector(self, name: str, collector: Callable[[], Dict[str, float]]) -> None:
+        """注册（或替换同名的）采集函数"""
+        with self._lock:
+            self._collectors[name] = collector
+
+    def unregister_collector(self, name: str, collector: Optional[Callable[[], Dict[str, float]]] = None) -> None:
+        """注销采集函数；指定 collector 时只在当前注册的仍是它时注销，避免误删替换后的新采集函数"""
+        with self._lock:
+            if collector is None or self._collectors.get(name) == collector:
+                self._collectors.pop(name, None)
+
+    def _collect(self) -> Dict[str, float]:
+        with self._lock:
+            collectors = list(self._collectors.items())
+        values = {}
+        for name, collector in collectors:
+            try:
+                for key, value in collector().items():
+                    if isinstance(value, (int, float)) and not isinstance(value, bool):
+                        values[f'{self.prefix}{name}_{key}'] = value
+            except Exception as e:
+                self.logger.debug('采集指标 %s 失败: %s', name, e)
+        return values
+
+    def render_prometheus(self) -> str:
+        """以Prometheus文本格式导出所有指标"""
+        # 采集函数可能更新带标签的仪表，先采集再导出
+        collected = self._collect()
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for name, value in sorted(collected.items()):
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self) -> Dict:
+        """返回可JSON序列化的指标快照"""
+        collected = self._collect()
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {
+            'timestamp': time.time(),
+            'metrics': {m.name: {'type': m.type_name, 'values': m.snapshot()} for m in metrics},
+            'collected': collected
+        }
+
+
+# 全局注册表与消息管线的各项指标
+REGISTRY = MetricsRegistry()
+
+POLL_SWEEP_SECONDS = REGISTRY.histogram('poll_sweep_seconds', '一次轮询所有到期目标的耗时')
+GET_MESSAGES_SECONDS = REGISTRY.histogram('get_listen_message_seconds', '每个目标 GetListenMessage 的耗时')
+POLL_INTERVAL_SECONDS = REGISTRY.gauge('poll_interval_seconds', '各监听目标当前的轮询间隔（按目标）')
+MESSAGES_RECEIVED = REGISTRY.counter('messages_received_total', '收到的消息数')
+DEBOUNCE_WAIT_SECONDS = REGISTRY.histogram('debounce_wait_seconds', '消息从进入缓存到合并分派的等待时间')
+LLM_LATENCY_SECONDS = REGISTRY.histogram('llm_latency_seconds', 'AI请求耗时')
+LLM_REQUESTS = REGISTRY.counter('llm_requests_total', 'AI请求数（按结果）')
+LLM_TOKENS = REGISTRY.counter('llm_tokens_total', 'AI请求消耗的token数（按类型）')
+LLM_TOKENS_PER_REQUEST = REGISTRY.histogram('llm_tokens_per_request', '每个AI请求消耗的token数',
+                                            buckets=(50, 100, 200, 400, 800, 1600, 3200, 6400))
+SEND_SECONDS = REGISTRY.histogram('send_seconds', '发送一条微信消息的耗时')
+SENDS = REGISTRY.counter('sends_total', '发送的微信消息数（按结果）')
+ERRORS = REGISTRY.counter('errors_total', '错误数（按阶段和异常类型）')
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    registry: MetricsRegistry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        body = self.registry.render_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsExporter:
+    """在后台线程中导出指标：本地Prometheus文本HTTP端点和定期写入的JSON快照文件"""
+
+    def __init__(self, registry: MetricsRegistry = REGISTRY, http_host: str = '127.0.0.1',
+                 http_port: Optional[int] = None, snapshot_path: Optional[str] = None,
+                 snapshot_interval: float = 10.0):
+        """
+        Args:
+            registry: 指标注册表
+            http_host: HTTP端点监听地址
+            http_port: HTTP端点端口，为None或0时不启动
+            snapshot_path: JSON快照文件路径，为None时不写入
+            snapshot_interval: 快照写入间隔（秒）
+        """
+        self.logger = logging.getLogger(__name__)
+        self.registry = registry
+        self.http_host = http_host
+        self.http_port = http_port
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self._server = None
+        self._threads: List[threading.Thread] = []
+        self._stop = threading.Event()
+
+    def start(self) -> None:
+        if self.http_port:
+            handler = type('MetricsRequestHandler', (_MetricsRequestHandler,), {'registry': self.registry})
+            try:
+                self._server = ThreadingHTTPServer((self.http_host, self.http_port), handler)
+                self._server.daemon_threads = True
+            except OSError as e:
+                self.logger.error(f'启动指标HTTP端点失败: {str(e)}')
+            else:
+                thread = threading.Thread(target=self._server.serve_forever, name='metrics_http', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+                self.logger.info(f'指标HTTP端点已启动: http://{self.http_host}:{self._server.server_address[1]}/metrics')
+        if self.snapshot_path:
+            thread = threading.Thread(target=self._snapshot_loop, name='metrics_snapshot', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def write_snapshot(self) -> None:
+        """写入一次JSON快照（先写临时文件再替换，避免读到半个文件）"""
+        tmp_path = self.snapshot_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.registry.snapshot(), f, ensure_ascii=False)
+        os.replace(tmp_path, self.snapshot_path)
+
+    def _snapshot_loop(self) -> None:
+        while not self._stop.wait(self.snapshot_interval):
+            try:
+                self.write_snapshot()
+            except Exception as e:
+                self.logger.error(f'写入指标快照失败: {str(e)}')
+
+    @property
+    def port(self) -> Optional[int]:
+        """HTTP端点实际监听的端口"""
+        return self._server.server_address[1] if self._server is not None else None
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self.snapshot_path:
+            try:
+                self.write_snapshot()
+            except Exception as e:
+                self.logger.error(f'写入指标快照失败: {str(e)}')
+        for thread in self._threads:
+            thread.join(timeout=2)
+        self._threads = []
@@ -0,0 +1,213 @@
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+
+from src.resilience import CircuitBreaker
+
+# 计算每分钟token用量的滑动窗口（秒）
+TPM_WINDOW = 60.0
+
+class Provider:
+    """AI服务池中的一个后端（服务地址 + 密钥 + 模型）"""
+
+    def __init__(self, name: str, config: dict, weight: float = 1.0, max_concurrency: int = 0,
+                 tpm: int = 0, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        """
+        Args:
+            name: 后端名称，用于日志和界面显示
+            config: 该后端的完整AI配置（api_key、service、model、连接池参数等）
+            weight: 权重，越大分到的请求越多
+            max_concurrency: 同时进行的请求数上限，0表示不限制
+            tpm: 每分钟token预算，0表示不限制
+            failure_threshold: 熔断器连续失败阈值
+            recovery_timeout: 熔断器恢复时间（秒）
+        """
+        self.name = name
+        self.config = config
+        self.weight = max(0.01, float(weight))
+        self.max_concurrency = max(0, int(max_concurrency))
+        self.tpm = max(0, int(tpm))
+        self.breaker = CircuitBreaker(failure_threshold, recovery_timeout)
+        # 由AI处理器按 config 中的连接参数创建和重建
+        self.client = None
+        self.client_settings = None
+
+        self.inflight = 0
+        self.requests = 0
+        self.errors = 0
+        self._tokens: Deque[Tuple[float, int]] = deque()  # (时间, token数)
+        self._tokens_used = 0
+        self._latencies: Deque[float] = deque(maxlen=256)  # 最近成功请求的耗时（秒）
+
+    @property
+    def model(self) -> str:
+        return self.config.get('model')
+
+    def tokens_in_window(self, now: float) -> int:
+        """最近一分钟内已使用（含预留）的token数"""
+        while self._tokens and self._tokens[0][0] <= now - TPM_WINDOW:
+            self._tokens_used -= self._tokens.popleft()[1]
+        return self._tokens_used
+
+    def _add_tokens(self, now: float, tokens: int) -> None:
+        self._tokens.append((now, tokens))
+        self._tokens_used += tokens
+
+    def _capacity_wait(self, tokens: int, now: float) -> float:
+        """距离该后端能接收一个 tokens 大小的请求还需等待的秒数，0表示可以立即发送"""
+        if self.max_concurrency and self.inflight >= self.max_concurrency:
+            return 0.05  # 等待进行中的请求结束，释放时会被唤醒
+        if not self.tpm:
+            return 0.0
+        used = self.tokens_in_window(now)
+        if used + tokens <= self.tpm or used == 0:
+            return 0.0  # 单个请求超过预算时在窗口空闲后放行，避免永远无法发送
+        # 等到足够多的旧用量滑出窗口
+        excess = used + tokens - self.tpm
+        for stamp, count in self._tokens:
+            excess -= count
+            if excess <= 0:
+                return max(0.01, stamp + TPM_WINDOW - now)
+        return TPM_WINDOW
+
+    def latency_percentile(self, pct: float) -> Optional[float]:
+        if not self._latencies:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+    def stats(self) -> Dict:
+        p50 = self.latency_percentile(50)
+        p95 = self.latency_percentile(95)
+        return {
+            'name': self.name,
+            'model': self.model,
+            'state': self.breaker.state,
+            'inflight': self.inflight,
+            'requests': self.requests,
+            'errors': self.errors,
+            'latency_p50': round(p50, 3) if p50 is not None else None,
+            'latency_p95': round(p95, 3) if p95 is not None else None,
+            'tpm_used': self.tokens_in_window(time.monotonic())
+        }
+
+
+class ProviderPool:
+    """AI服务池
+
+    每个请求分给当前负载最低（进行中请求数 / 权重）的健康后端；
+    后端达到并发上限或每分钟token预算时暂不分配，熔断中的后端跳过，
+    请求失败后由调用方排除该后端重新获取，实现自动切换。
+    """
+
+    def __init__(self, providers: Iterable[Provider]):
+        self.providers: List[Provider] = list(providers)
+        self._cond = threading.Condition()
+
+    def set_providers(self, providers: Iterable[Provider]) -> None:
+        """替换后端列表（配置更新时），进行中的请求仍按原后端归还"""
+        with self._cond:
+            self.providers = list(providers)
+            self._cond.notify_all()
+
+    def try_acquire(self, tokens: int, exclude: Iterable[Provider] = ()) -> Tuple[Optional[Provider], Optional[float]]:
+        """尝试为一个请求分配后端并预留并发名额和token
+
+        优先选择 exclude 以外的后端，只剩被排除的后端时也会分配给它们（原地重试）。
+
+        Returns:
+            (后端, None)：分配成功
+            (None, 秒数)：健康后端都已满载，需要等待的时间
+            (None, None)：所有后端都在熔断中
+        """
+        exclude = set(exclude)
+        now = time.monotonic()
+        with self._cond:
+            healthy = [p for p in self.providers if p.breaker.available()]
+            if not healthy:
+                return None, None
+            preferred = [p for p in healthy if p not in exclude] or healthy
+            wait = None
+            best = None
+            for provider in preferred:
+                provider_wait = provider._capacity_wait(tokens, now)
+                if provider_wait > 0:
+                    wait = provider_wait if wait is None else min(wait, provider_wait)
+                    continue
+                if best is None or self._load(provider) < self._load(best):
+                    best = provider
+            if best is None:
+                return None, wait
+            if not best.breaker.allow():
+                return None, 0.01  # 半开状态的探测名额刚被占用
+            best.inflight += 1
+            best.requests += 1
+            best._add_tokens(now, tokens)
+            return best, None
+
+    def acquire(self, tokens: int, exclude: Iterable[Provider] = (),
+                timeout: Optional[float] = None) -> Optional[Provider]:
+        """阻塞直到分配到后端；所有后端熔断中或等待超时返回None"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            provider, wait = self.try_acquire(tokens, exclude)
+            if provider is not None or wait is None:
+                return provider
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                wait = min(wait, remaining)
+            with self._cond:
+                self._cond.wait(wait)
+
+    def release(self, provider: Provider, outcome: str, reserved: int = 0,
+                used: Optional[int] = None, latency: Optional[float] = None) -> None:
+        """请求结束，归还并发名额并更新熔断器
+
+        Args:
+            outcome: 'ok' 成功，'failure' 后端故障（计入熔断），'retry' 将原地重试的失败（只计错误数），
+                'abort' 与后端健康无关的失败
+            reserved: 分配时预留的token数
+            used: 实际消耗的token数，用于修正预留量
+            latency: 成功请求的耗时（秒）
+        """
+        with self._cond:
+            provider.inflight -= 1
+            if used is not None and used != reserved:
+                provider._add_tokens(time.monotonic(), used - reserved)
+            if outcome == 'ok':
+                provider.breaker.record_success()
+                if latency is not None:
+                    provider._latencies.append(latency)
+            elif outcome == 'failure':
+                provider.errors += 1
+                provider.breaker.record_failure()
+            elif outcome == 'retry':
+                provider.errors += 1
+                provider.breaker.release()
+            else:
+                provider.breaker.release()
+            self._cond.notify_all()
+
+    def has_alternative(self, exclude: Iterable[Provider]) -> bool:
+        """除 exclude 以外是否还有健康的后端"""
+        exclude = set(exclude)
+        with self._cond:
+            return any(p not in exclude and p.breaker.available() for p in self.providers)
+
+    def retry_in(self) -> float:
+        """所有后端都熔断时，距离最早一个允许探测的秒数"""
+        with self._cond:
+            return min((p.breaker.retry_in() for p in self.providers), default=0.0)
+
+    def stats(self) -> List[Dict]:
+        with self._cond:
+            return [p.stats() for p in self.providers]
+
+    @staticmethod
+    def _load(provider: Provider) -> Tuple[float, float]:
+        # 负载相同时优先选择最近延迟更低的后端
+        p50 = provider.latency_percentile(50)
+        return (provider.inflight + 1) / provider.weight, p50 if p50 is not None else 0.0
@@ -0,0 +1,181 @@
+import asyncio
+import threading
+import time
+from typing import Dict, Optional
+
+from src.metrics import REGISTRY
+
+RATE_LIMIT_WAIT_SECONDS = REGISTRY.histogram('rate_limit_wait_seconds', 'AI请求在客户端限流中的排队时间',
+                                             buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0))
+RATE_LIMITED = REGISTRY.counter('rate_limited_total', '被客户端限流排队或拒绝的AI请求数（按处理方式）')
+
+class TokenBucket:
+    """按分钟速率匀速补充的令牌桶
+
+    允许预支：请求总是立即扣减令牌，余额为负时由调用方按欠额等待，
+    先到的请求先被放行，等待中的请求不需要再次竞争。
+    """
+
+    def __init__(self, per_minute: float, burst_seconds: float = 6.0):
+        """
+        Args:
+            per_minute: 每分钟补充的令牌数
+            burst_seconds: 桶容量相当于多少秒的补充量，决定空闲后允许的突发大小
+        """
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.level = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, cost: float, now: float) -> float:
+        """扣减 cost 个令牌后需要等待的秒数（调用方需持有锁）
+
+        单次消耗超过桶容量时只要求桶是满的，避免大请求永远无法放行。
+        """
+        self._refill(now)
+        required = min(cost, self.capacity)
+        if self.level >= required:
+            return 0.0
+        return (required - self.level) / self.rate
+
+    def consume(self, cost: float) -> None:
+        self.level -= cost
+
+    def refund(self, amount: float, now: float) -> None:
+        self._refill(now)
+        self.level = min(self.capacity, self.level + amount)
+
+
+class RateLimiter:
+    """客户端请求数（RPM）和token数（TPM）限流
+
+    在请求发往服务端之前按账户额度匀速放行，避免触发服务端429后的长时间退避。
+    排队模式下请求等待到有额度为止（超过 max_wait 时拒绝），拒绝模式下没有额度的请求立即失败。
+    """
+
+    def __init__(self, rpm: int = 0, tpm: int = 0, mode: str = 'queue', max_wait: float = 30.0,
+                 burst_seconds: float = 6.0):
+        """
+        Args:
+            rpm: 每分钟请求数上限，0表示不限制
+            tpm: 每分钟token数上限（提示词估算值 + max_tokens），0表示不限制
+            mode: 'queue' 排队等待或 'shed' 直接拒绝
+            max_wait: 排队模式下单个请求的最长等待时间（秒）
+            burst_seconds: 空闲后允许一次性使用的额度，相当于多少秒的补充量
+        """
+        self.mode = mode if mode in ('queue', 'shed') else 'queue'
+        self.max_wait = max_wait
+        self._requests = TokenBucket(rpm, burst_seconds) if rpm else None
+        self._tokens = TokenBucket(tpm, burst_seconds) if tpm else None
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.queued = 0
+        self.shed = 0
+        self.last_wait = 0.0
+
+    def reserve(self, tokens: int) -> Optional[float]:
+        """为一个请求预留额度
+
+        Returns:
+            需要等待的秒数（0表示立即发送）；额度不足且不能排队时返回None，此时不扣减额度
+        """
+        now = time.monotonic()
+        with self._lock:
+            wait = 0.0
+            if self._requests is not None:
+                wait = max(wait, self._requests.wait_time(1, now))
+            if self._tokens is not None:
+                wait = max(wait, self._tokens.wait_time(tokens, now))
+            if wait > 0 and (self.mode == 'shed' or wait > self.max_wait):
+                self.shed += 1
+                RATE_LIMITED.inc(action='shed')
+                return None
+            if self._requests is not None:
+                self._requests.consume(1)
+            if self._tokens is not None:
+                self._tokens.consume(tokens)
+            if wait > 0:
+                self.queued += 1
+                RATE_LIMITED.inc(action='queued')
+            self.last_wait = wait
+        RATE_LIMIT_WAIT_SECONDS.observe(wait)
+        return wait
+
+    def acquire(self, tokens: int) -> bool:
+        """阻塞直到有额度，被拒绝时返回False"""
+        wait = self.reserve(tokens)
+        if wait is None:
+            return False
+        if wait > 0:
+            with self._lock:
+                self.waiting += 1
+            try:
+                time.sleep(wait)
+            finally:
+                with self._lock:
+                    self.waiting -= 1
+        return True
+
+    async def acquire_async(self, tokens: int) -> bool:
+        """acquire 的异步版本，在事件循环中等待"""
+        wait = self.reserve(tokens)
+        if wait is None:
+            return False
+        if wait > 0:
+            with self._lock:
+                self.waiting += 1
+            try:
+                await asyncio.sleep(wait)
+            finally:
+                with self._lock:
+                    self.waiting -= 1
+        return True
+
+    def refund(self, tokens: int) -> None:
+        """请求完成后按实际用量退还多预留的token（tokens 为负时补扣）"""
+        if self._tokens is None or not tokens:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if tokens > 0:
+                self._tokens.refund(tokens, now)
+            else:
+                self._tokens.consume(-tokens)
+
+    def cancel(self, tokens: int) -> None:
+        """请求没有发往服务端（本地拒绝或连接失败）时退还预留的请求数和token"""
+        now = time.monotonic()
+        with self._lock:
+            if self._requests is not None:
+                self._requests.refund(1, now)
+            if self._tokens is not None:
+                self._tokens.refund(tokens, now)
+
+    def retry_in(self, tokens: int) -> float:
+        """按当前余额，一个 tokens 大小的请求还需等待多久才有额度"""
+        now = time.monotonic()
+        with self._lock:
+            wait = 0.0
+            if self._requests is not None:
+                wait = max(wait, self._requests.wait_time(1, now))
+            if self._tokens is not None:
+                wait = max(wait, self._tokens.wait_time(tokens, now))
+            return wait
+
+    def stats(self) -> Dict[str, float]:
+        """当前剩余额度（负数为已预支）、排队数和被限流的请求数"""
+        now = time.monotonic()
+        with self._lock:
+            stats = {'waiting': self.waiting, 'queued': self.queued, 'shed': self.shed,
+                     'last_wait': round(self.last_wait, 3)}
+            if self._requests is not None:
+                self._requests._refill(now)
+                stats['rpm_available'] = round(self._requests.level, 2)
+            if self._tokens is not None:
+                self._tokens._refill(now)
+                stats['tpm_available'] = round(self._tokens.level)
+            return stats
@@ -0,0 +1,56 @@
+import time
+from concurrent.futures import Future
+from typing import Callable, Optional
+
+# 句子结束标点，用于判断可以提前发送的完整句子
+SENTENCE_ENDINGS = '。！？!?；;\n'
+
+class StreamingReply:
+    """累积流式AI回复，负责节流界面刷新和首句提前发送"""
+
+    def __init__(self, stream_id: str, on_update: Callable[[str], None],
+                 on_early_send: Optional[Callable[[str], Optional[Future]]] = None,
+                 min_chars: int = 8, update_interval: float = 0.2):
+        """
+        Args:
+            stream_id: 流式消息ID，界面据此原地更新同一条消息
+            on_update: 界面刷新回调，参数为当前已生成的完整内容
+            on_early_send: 提前发送回调，参数为首批完整句子，返回发送结果的 Future；为None时不提前发送
+            min_chars: 提前发送的最少字符数，避免只发出一两个字
+            update_interval: 界面刷新的最小间隔（秒）
+        """
+        self.stream_id = stream_id
+        self.text = ''
+        self.sent_text = ''  # 已提前发送的内容
+        self.early_future: Optional[Future] = None  # 提前发送的发送结果
+        self._on_update = on_update
+        self._on_early_send = on_early_send
+        self._min_chars = min_chars
+        self._update_interval = update_interval
+        self._last_update = 0.0
+        self._early_done = on_early_send is None
+
+    def feed(self, delta: str) -> None:
+        """追加一段新生成的内容"""
+        if not delta:
+            return
+        self.text += delta
+
+        now = time.monotonic()
+        if now - self._last_update >= self._update_interval:
+            self._last_update = now
+            self._on_update(self.text)
+
+        if not self._early_done and any(ch in SENTENCE_ENDINGS for ch in delta):
+            end = max(self.text.rfind(ch) for ch in SENTENCE_ENDINGS) + 1
+            chunk = self.text[:end]
+            if len(chunk.strip()) >= self._min_chars:
+                self._early_done = True
+                self.sent_text = chunk
+                self.early_future = self._on_early_send(chunk.strip())
+
+    def remainder(self, full_text: str) -> str:
+        """返回完整回复中尚未提前发送的部分"""
+        if self.sent_text and full_text.startswith(self.sent_text):
+            return full_text[len(self.sent_text):].strip()
+        return full_text
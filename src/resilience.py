@@ -0,0 +1,142 @@
+import email.utils
+import random
+import threading
+import time
+from typing import Optional
+
+import httpx
+import openai
+
+class RetryPolicy:
+    """AI请求的重试策略
+
+    只重试限流（429）、服务端错误（5xx）、超时和连接错误；
+    等待时间为带随机抖动的指数退避，服务端返回 Retry-After 时以其为准。
+    """
+
+    RETRYABLE_STATUS = {408, 409, 429}
+
+    def __init__(self, max_retries: int = 3, base_delay: float = 0.5, max_delay: float = 20.0):
+        """
+        Args:
+            max_retries: 最大重试次数
+            base_delay: 首次重试的基准等待时间（秒），之后每次翻倍
+            max_delay: 单次等待时间上限（秒），也是 Retry-After 的上限
+        """
+        self.max_retries = max(0, max_retries)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def is_retryable(self, exc: BaseException) -> bool:
+        """判断异常是否值得重试"""
+        if isinstance(exc, (openai.APITimeoutError, openai.APIConnectionError, httpx.TimeoutException,
+                            httpx.NetworkError, httpx.RemoteProtocolError)):
+            return True
+        if isinstance(exc, openai.APIStatusError):
+            return exc.status_code in self.RETRYABLE_STATUS or exc.status_code >= 500
+        return False
+
+    @staticmethod
+    def retry_after(exc: BaseException) -> Optional[float]:
+        """读取响应头中的 Retry-After（秒或HTTP日期）或 retry-after-ms"""
+        response = getattr(exc, 'response', None)
+        if response is None:
+            return None
+        headers = response.headers
+        value = headers.get('retry-after-ms')
+        if value:
+            try:
+                return float(value) / 1000
+            except ValueError:
+                pass
+        value = headers.get('retry-after')
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            pass
+        parsed = email.utils.parsedate_tz(value)
+        if parsed is None:
+            return None
+        return max(0.0, email.utils.mktime_tz(parsed) - time.time())
+
+    def delay(self, attempt: int, exc: Optional[BaseException] = None) -> float:
+        """第 attempt 次重试（从0开始）前的等待时间"""
+        if exc is not None:
+            retry_after = self.retry_after(exc)
+            if retry_after is not None:
+                return min(retry_after, self.max_delay)
+        ceiling = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return random.uniform(ceiling / 2, ceiling)
+
+
+class CircuitBreaker:
+    """熔断器
+
+    连续失败 failure_threshold 次后进入打开状态，期间直接拒绝请求；
+    recovery_timeout 秒后进入半开状态，放行一个探测请求，成功则恢复，失败则重新打开。
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.failure_threshold = max(1, failure_threshold)
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """是否放行请求；打开状态到期后只放行一个探测请求"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.recovery_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def available(self) -> bool:
+        """是否可能放行请求（不占用半开状态的探测名额）"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                return time.monotonic() - self._opened_at >= self.recovery_timeout
+            return not self._probe_in_flight
+
+    def retry_in(self) -> float:
+        """距离允许下一次探测还有多少秒"""
+        with self._lock:
+            if self.state != self.OPEN:
+                return 0.0
+            return max(0.0, self.recovery_timeout - (time.monotonic() - self._opened_at))
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+    def release(self) -> None:
+        """请求以与服务健康无关的原因结束（如参数错误），释放半开状态的探测名额"""
+        with self._lock:
+            self._probe_in_flight = False
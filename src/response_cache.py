@@ -0,0 +1,144 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from src.sqlite_writer import SqliteWriter
+
+class ResponseCache:
+    """AI回复缓存
+
+    以系统提示词、模型、采样参数和归一化后的用户消息的哈希为键缓存AI回复，
+    按LRU顺序和过期时间淘汰，总大小受字节数上限约束。
+    可选使用SQLite持久化，程序重启后缓存仍然有效；写入由后台线程批量提交，不在锁内等待磁盘。
+    """
+
+    def __init__(self, max_entries: int = 1000, max_bytes: int = 4 * 1024 * 1024,
+                 ttl: float = 3600, db_path: Optional[str] = None, commit_interval: float = 0.5):
+        """
+        Args:
+            max_entries: 最大缓存条数
+            max_bytes: 缓存回复内容的总字节数上限
+            ttl: 缓存有效期（秒）
+            db_path: SQLite数据库路径，为None时只缓存在内存中
+            commit_interval: 持久化写入的批量提交间隔（秒）
+        """
+        self.logger = logging.getLogger(__name__)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: 'OrderedDict[str, Tuple[str, float, int]]' = OrderedDict()  # 键 -> (回复, 过期时间, 字节数)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._writer: Optional[SqliteWriter] = None
+        if db_path:
+            self._open_db(db_path, commit_interval)
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """归一化用户消息：合并空白并转为小写"""
+        return ' '.join(text.split()).lower()
+
+    @classmethod
+    def make_key(cls, model: str, params: Dict, messages: List[Dict]) -> str:
+        """根据模型、采样参数和消息列表生成缓存键
+
+        最后一条用户消息会先归一化，系统提示词和上下文按原文参与哈希。
+        """
+        normalized = [dict(m) for m in messages]
+        if normalized and normalized[-1].get('role') == 'user':
+            normalized[-1]['content'] = cls.normalize(normalized[-1].get('content', ''))
+        payload = json.dumps([model, params, normalized], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """查询缓存，命中时刷新LRU顺序"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            reply, expires_at, _ = entry
+            if expires_at <= time.time():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return reply
+
+    def put(self, key: str, reply: str) -> None:
+        """写入缓存，超出条数或字节上限时淘汰最久未使用的条目"""
+        size = len(reply.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (reply, expires_at, size)
+            self._bytes += size
+            self._evict()
+            if self._writer is not None:
+                self._writer.execute('INSERT OR REPLACE INTO response_cache (key, reply, expires_at) VALUES (?, ?, ?)',
+                                     (key, reply, expires_at))
+
+    def _remove(self, key: str) -> None:
+        """删除条目（调用方需持有锁）"""
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+        if self._writer is not None:
+            self._writer.execute('DELETE FROM response_cache WHERE key = ?', (key,))
+
+    def _evict(self) -> None:
+        """按LRU顺序淘汰超出上限的条目（调用方需持有锁）"""
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            key = next(iter(self._entries))
+            self._remove(key)
+            self.evictions += 1
+
+    def _open_db(self, db_path: str, commit_interval: float) -> None:
+        """打开持久化数据库并加载未过期的缓存，之后的写入交给后台写入线程"""
+        try:
+            with sqlite3.connect(db_path) as db:
+                db.execute('CREATE TABLE IF NOT EXISTS response_cache '
+                           '(key TEXT PRIMARY KEY, reply TEXT NOT NULL, expires_at REAL NOT NULL)')
+                db.execute('DELETE FROM response_cache WHERE expires_at <= ?', (time.time(),))
+                rows = db.execute('SELECT key, reply, expires_at FROM response_cache ORDER BY expires_at').fetchall()
+            db.close()
+            self._writer = SqliteWriter(db_path, commit_interval, name='response_cache_writer')
+            with self._lock:
+                for key, reply, expires_at in rows:
+                    size = len(reply.encode('utf-8'))
+                    self._entries[key] = (reply, expires_at, size)
+                    self._bytes += size
+                self._evict()
+            self.logger.info(f'已从 {db_path} 加载 {len(self._entries)} 条AI回复缓存')
+        except sqlite3.Error as e:
+            self.logger.error(f'打开AI回复缓存数据库失败: {str(e)}，仅使用内存缓存', exc_info=True)
+            self._writer = None
+
+    def stats(self) -> Dict[str, int]:
+        """返回缓存统计"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+    def close(self) -> None:
+        """提交剩余写入并关闭持久化数据库"""
+        with self._lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
@@ -0,0 +1,176 @@
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from typing import Deque, Dict, Optional
+
+from src.logger import shorten
+from src.metrics import SENDS
+
+class _SendJob:
+    __slots__ = ('target', 'text', 'future', 'attempts', 'not_before')
+
+    def __init__(self, target: str, text: str):
+        self.target = target
+        self.text = text
+        self.future = Future()
+        self.attempts = 0
+        self.not_before = 0.0
+
+class SendQueue:
+    """微信消息发送队列
+
+    所有发送由一个专用线程完成，调用方入队后立即返回 Future，不再阻塞轮询和AI处理。
+    同一聊天的消息严格按入队顺序发送；切换到某个聊天后连续发送它的待发消息
+    （最多 max_burst 条），减少微信窗口在聊天之间来回切换。
+    相邻两次发送至少间隔 min_interval，同一聊天两轮连续发送之间至少间隔 chat_interval。
+    发送失败按指数退避重试，重试期间该聊天后续的消息排在它之后等待。
+    """
+
+    def __init__(self, wechat_handler, min_interval: float = 0.2, chat_interval: float = 1.0,
+                 max_burst: int = 5, max_retries: int = 3, retry_backoff: float = 1.0,
+                 max_backoff: float = 30.0):
+        """
+        Args:
+            wechat_handler: 提供 send_message(message, target) 的微信处理器
+            min_interval: 相邻两次发送的最小间隔（秒）
+            chat_interval: 同一聊天两轮连续发送之间的最小间隔（秒）
+            max_burst: 切换到一个聊天后最多连续发送的消息数
+            max_retries: 发送失败后的最大重试次数
+            retry_backoff: 首次重试的等待时间（秒），之后每次翻倍
+            max_backoff: 重试等待时间上限（秒）
+        """
+        self.logger = logging.getLogger(__name__)
+        self.wechat = wechat_handler
+        self.min_interval = min_interval
+        self.chat_interval = chat_interval
+        self.max_burst = max(1, max_burst)
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.max_backoff = max_backoff
+
+        self._queues: 'OrderedDict[str, Deque[_SendJob]]' = OrderedDict()  # 按首条消息入队顺序排列
+        self._chat_ready: Dict[str, float] = {}  # 聊天下一轮可发送的时间
+        self._current: Optional[str] = None  # 当前所在的聊天
+        self._burst = 0
+        self._last_send = 0.0
+        self._size = 0
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    def start(self) -> None:
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name='wechat_sender', daemon=True)
+        self._thread.start()
+
+    def enqueue(self, target: str, text: str) -> Future:
+        """加入发送队列，返回发送结果的 Future（True 表示发送成功）"""
+        job = _SendJob(target, text)
+        with self._cond:
+            if not self._running:
+                job.future.set_result(False)
+                return job.future
+            self._queues.setdefault(target, deque()).append(job)
+            self._size += 1
+            self._cond.notify()
+        return job.future
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _next_job(self, now: float):
+        """选择下一条要发送的消息，返回 (消息, 需要等待的秒数)（调用方需持有锁）
+
+        优先继续发送当前聊天，其次选择可发送的聊天中最早入队的一个。
+        """
+        if not self._queues:
+            return None, None
+        global_ready = self._last_send + self.min_interval
+
+        current = self._queues.get(self._current)
+        if current and self._burst < self.max_burst and current[0].not_before <= now:
+            return current[0], max(0.0, global_ready - now)
+
+        earliest = None
+        for target, queue in self._queues.items():
+            ready = max(queue[0].not_before, self._chat_ready.get(target, 0.0))
+            if ready <= now:
+                return queue[0], max(0.0, global_ready - now)
+            if earliest is None or ready < earliest:
+                earliest = ready
+        return None, earliest - now
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while True:
+                    if not self._running and not self._queues:
+                        return
+                    now = time.monotonic()
+                    job, wait = self._next_job(now)
+                    if job is not None and wait <= 0:
+                        break
+                    self._cond.wait(wait)
+                if job.target != self._current:
+                    if self._current is not None:
+                        self._chat_ready[self._current] = now + self.chat_interval
+                    self._current = job.target
+                    self._burst = 0
+
+            ok = False
+            try:
+                ok = self.wechat.send_message(job.text, job.target)
+            except Exception as e:
+                self.logger.error(f'发送消息到 {job.target} 时出错: {str(e)}', exc_info=True)
+
+            with self._cond:
+                self._last_send = time.monotonic()
+                self._burst += 1
+                if ok:
+                    self._pop(job)
+                    if not job.future.done():
+                        job.future.set_result(True)
+                    continue
+                job.attempts += 1
+                if job.attempts > self.max_retries or not self._running:
+                    self._pop(job)
+                    self.logger.error('发送消息到 %s 失败，已放弃: %s', job.target, shorten(job.text, 50))
+                    if not job.future.done():
+                        job.future.set_result(False)
+                    continue
+                delay = min(self.max_backoff, self.retry_backoff * 2 ** (job.attempts - 1))
+                job.not_before = self._last_send + delay * random.uniform(0.8, 1.2)
+                self._burst = self.max_burst  # 等待重试期间先发送其他聊天
+                SENDS.inc(result='retry')
+                self.logger.warning('发送消息到 %s 失败，%.1f 秒后第 %d 次重试', job.target, delay, job.attempts)
+
+    def _pop(self, job: _SendJob) -> None:
+        """移除已完成的队首消息（调用方需持有锁）"""
+        queue = self._queues.get(job.target)
+        if not queue or queue[0] is not job:
+            return  # stop() 超时后已清空队列
+        queue.popleft()
+        self._size -= 1
+        if not queue:
+            del self._queues[job.target]
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """停止接收新消息，在 timeout 内发送完队列中剩余的消息，超时未发送的消息结果为False"""
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        with self._cond:
+            for queue in self._queues.values():
+                for job in queue:
+                    if not job.future.done():
+                        job.future.set_result(False)
+            self._queues.clear()
+            self._size = 0
@@ -0,0 +1,114 @@
+import logging
+import sqlite3
+import threading
+import time
+from typing import List, Optional, Sequence, Tuple
+
+from src.metrics import REGISTRY
+
+SQLITE_COMMIT_SECONDS = REGISTRY.histogram('sqlite_commit_seconds', '后台SQLite写入线程一次批量执行并提交的耗时')
+
+class SqliteWriter:
+    """后台批量写入SQLite
+
+    调用方只把写语句放入内存队列后立即返回，由后台线程把积累的语句放在一个事务中执行
+    并提交一次，相邻两次提交至少间隔 commit_interval；提交（磁盘同步）不在调用方的锁内进行。
+    使用独立的连接，读取方如需看到刚写入的数据应先调用 flush()。
+    """
+
+    def __init__(self, db_path: str, commit_interval: float = 0.5, name: str = 'sqlite_writer'):
+        """
+        Args:
+            db_path: SQLite数据库路径
+            commit_interval: 相邻两次提交的最小间隔（秒），即崩溃时最多丢失的时间窗口
+            name: 后台线程名称
+        """
+        self.logger = logging.getLogger(__name__)
+        self.commit_interval = commit_interval
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        # WAL 模式下提交时读取方不被阻塞
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._pending: List[Tuple[str, Sequence]] = []
+        self._queued = 0  # 已放入队列的语句总数
+        self._done = 0  # 已提交（或执行失败被丢弃）的语句总数
+        self._cond = threading.Condition()
+        self._closing = False
+        self.commits = 0
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def execute(self, sql: str, params: Sequence = ()) -> int:
+        """把一条写语句放入队列，不等待提交
+
+        Returns:
+            语句序号，可传给 flush(upto=...) 只等待到这条语句提交；已关闭时返回0
+        """
+        with self._cond:
+            if self._closing:
+                return 0
+            self._pending.append((sql, params))
+            self._queued += 1
+            if len(self._pending) == 1:
+                self._cond.notify_all()
+            return self._queued
+
+    def committed(self, seq: int) -> bool:
+        """序号为 seq 的语句是否已提交（或执行失败被丢弃）"""
+        with self._cond:
+            return self._done >= seq
+
+    def _run(self) -> None:
+        last_commit = 0.0
+        while True:
+            with self._cond:
+                while not self._pending and not self._closing:
+                    self._cond.wait()
+                # 距上次提交不足 commit_interval 时继续收集语句
+                remaining = last_commit + self.commit_interval - time.monotonic()
+                if remaining > 0 and not self._closing:
+                    self._cond.wait(remaining)
+                if not self._pending and self._closing:
+                    return
+                batch, self._pending = self._pending, []
+                queued = self._queued
+            try:
+                with SQLITE_COMMIT_SECONDS.time():
+                    for sql, params in batch:
+                        self._db.execute(sql, params)
+                    self._db.commit()
+                self.commits += 1
+            except sqlite3.Error as e:
+                self.logger.error('批量写入SQLite失败，丢弃 %d 条语句: %s', len(batch), e)
+                try:
+                    self._db.rollback()
+                except sqlite3.Error:
+                    pass
+            last_commit = time.monotonic()
+            with self._cond:
+                self._done = queued
+                self._cond.notify_all()
+
+    def flush(self, timeout: Optional[float] = None, upto: Optional[int] = None) -> bool:
+        """等待目前为止（或序号不超过 upto）的写语句全部提交
+
+        Returns:
+            是否在 timeout 内完成
+        """
+        with self._cond:
+            target = self._queued if upto is None else upto
+            if self._done >= target:
+                return True
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: self._done >= target, timeout)
+
+    def close(self, timeout: float = 5.0) -> None:
+        """提交剩余语句并关闭连接"""
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            # 写入线程仍在使用连接，不能关闭
+            self.logger.warning('SQLite写入线程在 %.0f 秒内没有写完，未关闭连接', timeout)
+            return
+        self._db.close()
@@ -6,6 +6,9 @@ import json
 import os
 from typing import Dict, List, Optional, Callable
 
+from src.chat_message import ChatMessage
+from src.message_log import MessageLogDelegate, MessageLogModel, format_message_entry, format_status_entry
+
 class ConfigDialog(QDialog):
     def __init__(self, config: dict, parent=None):
         super().__init__(parent)
@@ -363,6 +366,8 @@ class ChatWindow(QMainWindow):
         super().__init__()
         self.config = config
         self.config_file = os.path.join(os.path.dirname(__file__), '..', 'config.json')
+        self._streaming_ids = set()  # 正在流式更新的消息ID
+        self._scroll_pending = False
         self.load_config()
         
         # 尝试加载图标
@@ -462,10 +467,18 @@ class ChatWindow(QMainWindow):
         
         right_layout.addLayout(log_toolbar)
         
-        self.message_display = QTextEdit()
-        self.message_display.setReadOnly(True)
+        # 消息日志：虚拟化列表，只绘制可见行；内存中只保留最近 log_capacity 条，其余溢出到磁盘
+        self.message_log = MessageLogModel(self.config.get('log_capacity', 5000), self)
+        self.message_display = QListView()
+        self.message_display.setModel(self.message_log)
+        self.message_display.setItemDelegate(MessageLogDelegate(self.message_display))
+        self.message_display.setLayoutMode(QListView.Batched)
+        self.message_display.setBatchSize(200)
+        self.message_display.setResizeMode(QListView.Adjust)
+        self.message_display.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.message_display.setSelectionMode(QAbstractItemView.ExtendedSelection)
         self.message_display.setStyleSheet("""
-            QTextEdit {
+            QListView {
                 background-color: #ffffff;
                 border: 1px solid #cccccc;
                 border-radius: 5px;
@@ -498,6 +511,11 @@ class ChatWindow(QMainWindow):
         self.auto_reply_checkbox.setStyleSheet("QCheckBox { font-weight: bold; }")
         control_panel.addWidget(self.auto_reply_checkbox)
         
+        # AI服务池各后端的状态和延迟，详细统计显示在鼠标悬停提示中
+        self.provider_label = QLabel()
+        self.provider_label.setStyleSheet("color: #555555;")
+        control_panel.addWidget(self.provider_label)
+        
         control_panel.addStretch()
         
         # 控制按钮
@@ -610,7 +628,8 @@ class ChatWindow(QMainWindow):
         reply = QMessageBox.question(self, '确认', '确定要清空所有日志吗？',
                                      QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
         if reply == QMessageBox.Yes:
-            self.message_display.clear()
+            self.message_log.clear()
+            self._streaming_ids.clear()
             self.update_status("日志已清空")
     
     def save_logs(self):
@@ -618,31 +637,80 @@ class ChatWindow(QMainWindow):
         file_path, _ = QFileDialog.getSaveFileName(self, "保存日志", "", "文本文件 (*.txt);;所有文件 (*)")
         if file_path:
             try:
-                with open(file_path, 'w', encoding='utf-8') as f:
-                    f.write(self.message_display.toPlainText())
+                self.message_log.export(file_path)
                 self.update_status(f"日志已保存到: {file_path}")
             except Exception as e:
                 QMessageBox.critical(self, "错误", f"保存日志失败: {str(e)}")
     
     def update_status(self, status: str) -> None:
         """更新状态显示"""
-        self.message_display.append(f"[系统] {status}")
+        self._append_log_entry(format_status_entry(status))
+        self._show_status(status)
+
+    def _show_status(self, status: str) -> None:
         self.status_indicator.setText(f"状态: {status}")
         self.statusBar().showMessage(status, 3000)  # 在状态栏显示3秒
     
-    def add_message(self, sender: str, message: Dict[str, str]) -> None:
-        """添加新消息到显示区域"""
-        msg_html = f"""<p>
-            <b>{sender}</b> ({message['time']})<br/>
-            <span style='color: {'blue' if message['type'] != '处理错误' else 'red'};'>
-                [{message['type']}] {message['content']}
-            </span>
-        </p>"""
-        self.message_display.append(msg_html)
-        # 自动滚动到底部
-        self.message_display.verticalScrollBar().setValue(
-            self.message_display.verticalScrollBar().maximum()
-        )
+    def add_message(self, sender: str, message: ChatMessage) -> None:
+        """添加新消息到显示区域
+        
+        流式回复（partial为True）会按消息ID原地更新同一条记录，不重复追加。
+        """
+        entry = self._message_entry(sender, message)
+        if entry is not None:
+            self._append_log_entry(entry)
+
+    def apply_updates(self, events: List[tuple]) -> None:
+        """批量应用界面更新，一次追加所有新条目
+
+        Args:
+            events: (发送者, ChatMessage) 或 (None, 状态信息) 组成的列表
+        """
+        entries = []
+        last_status = None
+        for sender, payload in events:
+            if sender is None:
+                entries.append(format_status_entry(payload))
+                last_status = payload
+            else:
+                entry = self._message_entry(sender, payload)
+                if entry is not None:
+                    entries.append(entry)
+        if entries:
+            self.message_log.append_entries(entries)
+            self._schedule_scroll()
+        if last_status is not None:
+            self._show_status(last_status)
+
+    def _message_entry(self, sender: str, message: ChatMessage) -> Optional[list]:
+        """生成消息的日志条目；流式消息已在日志中时原地更新并返回None"""
+        entry = format_message_entry(sender, message)
+        msg_id = message.id
+        if msg_id in self._streaming_ids:
+            if not message.partial:
+                self._streaming_ids.discard(msg_id)
+            if self.message_log.update_entry(entry):
+                return None
+        elif message.partial:
+            self._streaming_ids.add(msg_id)
+        return entry
+
+    def _append_log_entry(self, entry: list) -> None:
+        """追加日志条目并自动滚动到底部
+
+        滚动推迟到事件循环空闲时执行，连续追加多条只触发一次重新布局。
+        """
+        self.message_log.append_entry(entry)
+        self._schedule_scroll()
+
+    def _schedule_scroll(self) -> None:
+        if not self._scroll_pending:
+            self._scroll_pending = True
+            QTimer.singleShot(0, self._scroll_to_bottom)
+
+    def _scroll_to_bottom(self) -> None:
+        self._scroll_pending = False
+        self.message_display.scrollToBottom()
     
     def set_start_handler(self, handler: Callable[[], None]) -> None:
         """设置开始按钮的处理函数"""
@@ -779,6 +847,23 @@ class ChatWindow(QMainWindow):
             if not self.config.get('api_key'):
                 self.update_status("警告: API Key 未设置，请在开始监听前完成配置")
     
+    def update_provider_stats(self, stats: List[Dict]) -> None:
+        """显示AI服务池各后端的状态、负载和延迟"""
+        states = {'closed': '正常', 'open': '熔断', 'half_open': '探测中'}
+        summary = []
+        details = []
+        for item in stats:
+            p50 = f"{item['latency_p50']:.2f}s" if item['latency_p50'] is not None else '-'
+            p95 = f"{item['latency_p95']:.2f}s" if item['latency_p95'] is not None else '-'
+            summary.append(f"{item['name']}: {states.get(item['state'], item['state'])} {p50}")
+            details.append(
+                f"{item['name']} ({item['model']}) {states.get(item['state'], item['state'])}\n"
+                f"  进行中 {item['inflight']}，请求 {item['requests']}，失败 {item['errors']}\n"
+                f"  延迟 p50 {p50} / p95 {p95}，最近一分钟 {item['tpm_used']} tokens"
+            )
+        self.provider_label.setText('AI服务 ' + ' | '.join(summary) if summary else '')
+        self.provider_label.setToolTip('\n'.join(details))
+    
     def is_auto_reply_enabled(self) -> bool:
         """获取自动回复开关状态"""
         return self.auto_reply_checkbox.isChecked()
@@ -0,0 +1,90 @@
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from PyQt5.QtCore import QObject, QTimer, Qt
+
+from src.chat_message import ChatMessage
+
+class UIUpdateBridge(QObject):
+    """合并监控线程发往界面的更新
+
+    监控线程的信号以直接连接方式进入本对象，只在锁内写入缓冲区，不经过Qt事件队列；
+    界面线程的定时器每秒最多刷新 max_flush_per_second 次，把缓冲区一次性交给
+    ChatWindow.apply_updates。同一流式消息只保留最新内容；聊天消息总是全部转交，
+    由消息日志模型按容量溢出到磁盘以保证导出完整；状态信息过多时丢弃超出部分并在
+    下次刷新时汇总提示，过长的状态信息会被截断。
+    """
+
+    def __init__(self, window, max_flush_per_second: float = 10, max_pending_status: int = 50,
+                 max_status_chars: int = 200, parent=None):
+        """
+        Args:
+            window: 接收批量更新的 ChatWindow
+            max_flush_per_second: 每秒最多刷新界面的次数
+            max_pending_status: 两次刷新之间最多保留的状态信息条数
+            max_status_chars: 单条状态信息的最大长度
+        """
+        super().__init__(parent)
+        self.window = window
+        self.max_pending_status = max_pending_status
+        self.max_status_chars = max_status_chars
+        self._lock = threading.Lock()
+        self._events: List[Tuple[Optional[str], object]] = []  # (发送者, 消息) 或 (None, 状态)
+        self._stream_index: Dict[str, int] = {}  # 流式消息ID -> 在缓冲区中的位置
+        self._pending_status = 0
+        self._dropped_status = 0
+        self.dropped_total = 0
+
+        self._timer = QTimer(self)
+        self._timer.setInterval(max(1, int(1000 / max(0.1, max_flush_per_second))))
+        self._timer.timeout.connect(self.flush)
+        self._timer.start()
+
+    def attach(self, monitor) -> None:
+        """连接监控线程的信号（直接连接，在监控线程中写入缓冲区）"""
+        monitor.message_received.connect(self.on_message, Qt.DirectConnection)
+        monitor.status_updated.connect(self.on_status, Qt.DirectConnection)
+
+    def on_message(self, sender: str, message: ChatMessage) -> None:
+        """缓冲一条聊天消息，同一流式消息ID的更新合并为最新一条"""
+        msg_id = message.id
+        with self._lock:
+            index = self._stream_index.get(msg_id) if msg_id is not None else None
+            if index is not None:
+                self._events[index] = (sender, message)
+            else:
+                if message.partial:
+                    self._stream_index[msg_id] = len(self._events)
+                self._events.append((sender, message))
+
+    def on_status(self, status: str) -> None:
+        """缓冲一条状态信息，超出上限时丢弃并计数"""
+        if len(status) > self.max_status_chars:
+            status = status[:self.max_status_chars] + '...'
+        with self._lock:
+            if self._pending_status >= self.max_pending_status:
+                self._dropped_status += 1
+                self.dropped_total += 1
+                return
+            self._pending_status += 1
+            self._events.append((None, status))
+
+    def flush(self) -> None:
+        """把缓冲的更新一次性交给界面（在界面线程中由定时器调用）"""
+        with self._lock:
+            if not self._events and not self._dropped_status:
+                return
+            events = self._events
+            dropped = self._dropped_status
+            self._events = []
+            self._stream_index = {}
+            self._pending_status = 0
+            self._dropped_status = 0
+        if dropped:
+            events.append((None, f'界面更新繁忙，已省略 {dropped} 条状态信息'))
+        self.window.apply_updates(events)
+
+    def stop(self) -> None:
+        """停止定时刷新，并把剩余更新交给界面"""
+        self._timer.stop()
+        self.flush()
@@ -0,0 +1,178 @@
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Dict, List, Optional
+
+class WeChatBackend(ABC):
+    """微信客户端后端接口
+
+    方法命名与 wxauto.WeChat 保持一致，WeChatHandler 只依赖这些方法。
+    """
+
+    @property
+    @abstractmethod
+    def nickname(self) -> str:
+        """当前登录账号名称"""
+
+    @abstractmethod
+    def GetListenMessage(self, who: str) -> list:
+        """获取监听对象的新消息"""
+
+    @abstractmethod
+    def AddListenChat(self, who: str, savepic: bool = False, savefile: bool = False,
+                      savevoice: bool = False) -> None:
+        """添加监听对象"""
+
+    @abstractmethod
+    def RemoveListenChat(self, who: str) -> None:
+        """移除监听对象"""
+
+    @abstractmethod
+    def SendMsg(self, msg: str, who: Optional[str] = None) -> None:
+        """发送消息到指定聊天"""
+
+
+class WxautoBackend(WeChatBackend):
+    """基于 wxauto 的真实微信后端（仅支持Windows）"""
+
+    def __init__(self):
+        from wxauto import WeChat
+        self._wx = WeChat()
+
+    @property
+    def nickname(self) -> str:
+        return self._wx.nickname
+
+    def GetListenMessage(self, who: str) -> list:
+        return self._wx.GetListenMessage(who)
+
+    def AddListenChat(self, who: str, savepic: bool = False, savefile: bool = False,
+                      savevoice: bool = False) -> None:
+        self._wx.AddListenChat(who, savepic=savepic, savefile=savefile, savevoice=savevoice)
+
+    def RemoveListenChat(self, who: str) -> None:
+        self._wx.RemoveListenChat(who)
+
+    def SendMsg(self, msg: str, who: Optional[str] = None) -> None:
+        self._wx.SendMsg(msg, who=who)
+
+
+class FakeWeChatBackend(WeChatBackend):
+    """可编程的模拟微信后端，用于在非Windows环境下压测整个消息管线
+
+    每个聊天按固定速率产生文本消息，可叠加周期性突发；消息在
+    GetListenMessage 被调用时按经过的时间一次性返回。SendMsg 会记录
+    该聊天中尚未回复的最早消息到发送时的延迟。
+    """
+
+    def __init__(self, chats: int = 10, rate: float = 0.2, hot_chats: int = 0, hot_rate: float = 2.0,
+                 burst_size: int = 0, burst_interval: float = 0.0, poll_delay: float = 0.0,
+                 send_delay: float = 0.0, chat_prefix: str = '模拟群', contents: Optional[List[str]] = None,
+                 seed: Optional[int] = None, nickname: str = '模拟账号'):
+        """
+        Args:
+            chats: 聊天数量
+            rate: 普通聊天每秒产生的消息数
+            hot_chats: 其中高频聊天的数量
+            hot_rate: 高频聊天每秒产生的消息数
+            burst_size: 每次突发额外产生的消息数，0表示不突发
+            burst_interval: 突发周期（秒），各聊天的突发时间随机错开
+            poll_delay: 模拟每次 GetListenMessage 的界面自动化耗时（秒）
+            send_delay: 模拟每次 SendMsg 的耗时（秒）
+            chat_prefix: 聊天名称前缀
+            contents: 随机选取的消息内容
+            seed: 随机数种子
+            nickname: 模拟的登录账号名称
+        """
+        self._nickname = nickname
+        self._random = random.Random(seed)
+        self.chat_names = [f'{chat_prefix}{i}' for i in range(chats)]
+        self.rates = {name: (hot_rate if i < hot_chats else rate) for i, name in enumerate(self.chat_names)}
+        self.burst_size = burst_size
+        self.burst_interval = burst_interval
+        self.poll_delay = poll_delay
+        self.send_delay = send_delay
+        self.contents = contents or ['在吗', '请问这个怎么用？', '收到，谢谢', '今天几点开会？', '哈哈哈']
+        self.listening = set()
+        self._lock = threading.Lock()
+        self._state: Dict[str, List[float]] = {}  # 聊天 -> [上次生成时间, 小数部分累积, 下次突发时间]
+        self._pending: Dict[str, List[float]] = {}  # 聊天 -> 未回复消息的生成时间
+        self._seq = 0
+        self.generated = 0
+        self.sent: List[tuple] = []  # (发送时间, 聊天, 内容)
+        self.latencies: List[float] = []  # 从消息产生到回复发送的延迟（秒）
+
+    @property
+    def nickname(self) -> str:
+        return self._nickname
+
+    def AddListenChat(self, who: str, savepic: bool = False, savefile: bool = False,
+                      savevoice: bool = False) -> None:
+        with self._lock:
+            self.listening.add(who)
+
+    def RemoveListenChat(self, who: str) -> None:
+        with self._lock:
+            self.listening.discard(who)
+            self._state.pop(who, None)
+
+    def GetListenMessage(self, who: str) -> list:
+        if self.poll_delay:
+            time.sleep(self.poll_delay)
+        now = time.monotonic()
+        with self._lock:
+            if who not in self.rates:
+                return []
+            state = self._state.get(who)
+            if state is None:
+                first_burst = now + self._random.uniform(0, self.burst_interval) if self.burst_interval else 0.0
+                self._state[who] = [now, 0.0, first_burst]
+                return []
+
+            expected = (now - state[0]) * self.rates[who] + state[1]
+            count = int(expected)
+            state[0], state[1] = now, expected - count
+            if self.burst_size and self.burst_interval and now >= state[2]:
+                count += self.burst_size
+                state[2] += self.burst_interval
+
+            messages = []
+            time_str = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            for _ in range(count):
+                self._seq += 1
+                messages.append(['Text', self._random.choice(self.contents), time_str, f'fake_{self._seq}'])
+            if count:
+                self.generated += count
+                self._pending.setdefault(who, []).extend([now] * count)
+            return messages
+
+    def SendMsg(self, msg: str, who: Optional[str] = None) -> None:
+        if self.send_delay:
+            time.sleep(self.send_delay)
+        now = time.monotonic()
+        with self._lock:
+            self.sent.append((now, who, msg))
+            pending = self._pending.pop(who, [])
+            self.latencies.extend(now - generated_at for generated_at in pending)
+
+    def stats(self) -> Dict[str, int]:
+        """返回已产生和已回复的消息统计"""
+        with self._lock:
+            return {
+                'generated': self.generated,
+                'replied': len(self.latencies),
+                'sent': len(self.sent),
+                'unreplied': sum(len(pending) for pending in self._pending.values())
+            }
+
+
+def create_backend(config: dict) -> WeChatBackend:
+    """根据配置创建微信后端，默认使用 wxauto"""
+    backend = config.get('backend', 'wxauto')
+    if backend == 'fake':
+        return FakeWeChatBackend(**config.get('fake_backend', {}))
+    if backend == 'wxauto':
+        return WxautoBackend()
+    raise ValueError(f'未知的微信后端: {backend}')
@@ -1,24 +1,71 @@
-from wxauto import WeChat
-import datetime
 import time
 
 import logging
 from typing import Dict, List, Optional
 import threading
 
+from src.chat_message import ChatMessage
+from src.dedup import DedupIndex, is_fingerprint, message_fingerprint
+from src.logger import shorten
+from src.metrics import ERRORS, GET_MESSAGES_SECONDS, SEND_SECONDS, SENDS
+from src.wechat_backend import WeChatBackend, create_backend
+
 class WeChatHandler:
-    def __init__(self, config: dict):
+    def __init__(self, config: dict, backend: Optional[WeChatBackend] = None):
+        """
+        Args:
+            config: 微信配置
+            backend: 微信后端，为None时按配置创建（默认wxauto）
+        """
         self.logger = logging.getLogger(__name__)
-        self.wx = WeChat()
+        self.wx = backend if backend is not None else create_backend(config)
+        self._wx_lock = threading.RLock()  # wxauto基于界面自动化，不支持多线程并发调用
         self.listen_targets = config.get('listen_targets', [])
         self.start_time = time.time()
+        
+        # 按目标自适应轮询：有消息的聊天保持短间隔，长时间无消息的聊天逐步拉长间隔
+        self.poll_interval_min = float(config.get('poll_interval_min', 0.5))
+        self.poll_interval_max = max(self.poll_interval_min, float(config.get('poll_interval_max', 10.0)))
+        self.poll_backoff = max(1.0, float(config.get('poll_backoff', 1.5)))
+        # GetListenMessage 调用速率上限（次/秒），令牌桶容量为1秒的调用量
+        self.max_calls_per_second = max(1.0, float(config.get('max_calls_per_second', 20)))
+        self._poll_state: Dict[str, List[float]] = {}  # 目标 -> [下次轮询时间, 当前间隔]
+        self._call_tokens = self.max_calls_per_second
+        self._tokens_updated = time.monotonic()
+        # 消息去重：跨轮询和重启跳过已处理过的消息
+        dedup_config = config.get('dedup') or {}
+        self.dedup = DedupIndex(
+            ttl=dedup_config.get('ttl', 24 * 3600),
+            max_per_target=dedup_config.get('max_per_target', 10000),
+            reply_ttl=dedup_config.get('reply_ttl', 600),
+            snapshot_path=dedup_config.get('snapshot_path') or None,
+            snapshot_interval=dedup_config.get('snapshot_interval', 30)
+        )
         self.ui = None
+        self.ui_bridge = None
         self.logger.info("微信处理器初始化完成")
     
-    def set_ui(self, ui):
-        """设置UI引用"""
+    def set_ui(self, ui, ui_bridge=None):
+        """设置UI引用
+
+        Args:
+            ui: 主窗口，只用于读取自动回复开关
+            ui_bridge: UIUpdateBridge，消息和状态经由它在界面线程中刷新；
+                本处理器的方法会在监控、发送和设置监听等后台线程中调用，不能直接修改界面
+        """
         self.ui = ui
+        self.ui_bridge = ui_bridge
         self.logger.debug("UI引用已设置")
+
+    def _show_message(self, message: ChatMessage) -> None:
+        """在界面上显示一条系统消息（线程安全）"""
+        if self.ui_bridge is not None:
+            self.ui_bridge.on_message('系统', message)
+
+    def _show_status(self, status: str) -> None:
+        """更新界面状态栏（线程安全）"""
+        if self.ui_bridge is not None:
+            self.ui_bridge.on_status(status)
     
     def initialize(self) -> str:
         """初始化微信客户端并返回当前登录账号"""
@@ -30,42 +77,131 @@ class WeChatHandler:
             self.logger.error(f"微信初始化失败: {str(e)}", exc_info=True)
             raise Exception(f"微信初始化失败: {str(e)}")
     
-    def get_new_messages(self) -> Dict[str, List[Dict[str, str]]]:
-        """获取并处理新消息"""
+    def get_new_messages(self) -> Dict[str, List[ChatMessage]]:
+        """获取并处理新消息
+        
+        只轮询已到轮询时间的目标，活跃目标优先，
+        超出每秒调用上限的目标留到下一次。
+        """
         messages_by_sender = {}
         try:
             if not self.listen_targets:
                 return messages_by_sender
+            
+            now = time.monotonic()
+            self._refill_call_tokens(now)
+            due_targets = sorted(
+                (target for target in self.listen_targets if self._poll_entry(target, now)[0] <= now),
+                key=lambda target: self._poll_priority(target, now)
+            )
                 
-            for target in self.listen_targets:
+            for target in due_targets:
+                if self._call_tokens < 1:
+                    self.logger.debug("已达到每秒 %g 次调用上限，剩余 %s 等目标延后轮询", self.max_calls_per_second, target)
+                    break
+                self._call_tokens -= 1
+                new_messages = None
                 try:
-                    new_messages = self.wx.GetListenMessage(target)
+                    started = time.perf_counter()
+                    with self._wx_lock:
+                        new_messages = self.wx.GetListenMessage(target)
+                    GET_MESSAGES_SECONDS.observe(time.perf_counter() - started, target=target)
                     if new_messages:
-                        self.logger.info(f"从 {target} 获取到 {len(new_messages)} 条新消息")
-                        messages_by_sender[target] = [
-                            self._process_message(msg)
-                            for msg in new_messages
-                        ]
+                        self.logger.info("从 %s 获取到 %d 条新消息", target, len(new_messages))
+                        processed = self._dedup_messages(target, new_messages)
+                        if processed:
+                            messages_by_sender[target] = processed
                 except Exception as e:
+                    ERRORS.inc(stage='get_messages', type=type(e).__name__)
                     self.logger.error(f"获取 {target} 的消息时出错: {str(e)}", exc_info=True)
-                    if self.ui:
-                        self.ui.add_message('系统', {
-                            'type': '错误',
-                            'content': f"获取 {target} 的消息时出错: {str(e)}",
-                            'time': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                            'id': f'error_get_{target}'
-                        })
+                    self._show_message(ChatMessage(
+                        '错误',
+                        f"获取 {target} 的消息时出错: {str(e)}",
+                        id=f'error_get_{target}'
+                    ))
+                self._reschedule_target(target, bool(new_messages))
+            self.dedup.maybe_save()
         except Exception as e:
             self.logger.error(f"获取消息时出错: {str(e)}", exc_info=True)
-            if self.ui:
-                self.ui.add_message('系统', {
-                    'type': '错误',
-                    'content': f"获取消息时出错: {str(e)}",
-                    'time': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                    'id': 'error_get'
-                })
+            self._show_message(ChatMessage(
+                '错误',
+                f"获取消息时出错: {str(e)}",
+                id='error_get'
+            ))
         return messages_by_sender  # 始终返回字典，即使是空的
 
+    def _dedup_messages(self, target: str, new_messages: list) -> List[ChatMessage]:
+        """处理一批原始消息并跳过已处理过的消息
+
+        有消息id的按去重索引判断（跨轮询和重启有效）；没有id的只与上一次轮询的指纹比对，
+        避免不同时间重复发送的相同内容（如“好的”）在整个 ttl 内被丢弃。
+        """
+        occurrences = {}
+        messages = [self._process_message(msg, target, occurrences) for msg in new_messages]
+        overlap = self.dedup.overlaps_last_poll(
+            target, [m.id for m in messages if m.type not in ('系统消息', '处理错误') and is_fingerprint(m.id)])
+        processed = []
+        for message in messages:
+            if message.type in ('系统消息', '处理错误'):
+                processed.append(message)
+                continue
+            if is_fingerprint(message.id):
+                duplicate = message.id in overlap
+            else:
+                duplicate = self.dedup.seen(target, message.id)
+            if duplicate:
+                self.logger.debug("跳过 %s 的重复消息: %s", target, message.id)
+                continue
+            processed.append(message)
+        return processed
+
+    def _poll_entry(self, target: str, now: float) -> List[float]:
+        """获取目标的轮询状态，新目标立即到期"""
+        entry = self._poll_state.get(target)
+        if entry is None:
+            entry = self._poll_state[target] = [now, self.poll_interval_min]
+        return entry
+
+    def _poll_priority(self, target: str, now: float) -> tuple:
+        """到期目标的轮询顺序：活跃（间隔短）的目标优先，
+        超时超过最长间隔的冷目标提到最前，避免被活跃目标饿死"""
+        next_due, interval = self._poll_state[target]
+        starving = now - next_due > self.poll_interval_max
+        return (not starving, interval, next_due)
+
+    def _reschedule_target(self, target: str, active: bool) -> None:
+        """根据本次是否收到消息调整目标的轮询间隔"""
+        entry = self._poll_entry(target, time.monotonic())
+        if active:
+            entry[1] = self.poll_interval_min
+        else:
+            entry[1] = min(entry[1] * self.poll_backoff, self.poll_interval_max)
+        entry[0] = time.monotonic() + entry[1]
+
+    def _refill_call_tokens(self, now: float) -> None:
+        """按经过的时间补充调用令牌"""
+        elapsed = now - self._tokens_updated
+        self._tokens_updated = now
+        self._call_tokens = min(self.max_calls_per_second,
+                                self._call_tokens + elapsed * self.max_calls_per_second)
+
+    def next_poll_delay(self) -> float:
+        """距离下一个目标需要轮询的秒数，供监控线程决定休眠时长"""
+        if not self.listen_targets:
+            return self.poll_interval_max
+        now = time.monotonic()
+        next_due = min(self._poll_entry(target, now)[0] for target in self.listen_targets)
+        delay = max(0.0, next_due - now)
+        if self._call_tokens < 1:
+            # 令牌不足时至少等到补充出一个令牌
+            delay = max(delay, (1 - self._call_tokens) / self.max_calls_per_second)
+        return delay
+
+    def get_poll_intervals(self) -> Dict[str, float]:
+        """返回各监听目标当前的轮询间隔（秒）"""
+        # 由指标导出线程调用，先复制一份避免与轮询线程的增删冲突
+        return {target: entry[1] for target, entry in list(self._poll_state.items())}
+
     def remove_listener(self, target: str) -> bool:
         """移除监听目标"""
         try:
@@ -75,12 +211,12 @@ class WeChatHandler:
             self.wx.RemoveListenChat(target)
             if target in self.listen_targets:
                 self.listen_targets.remove(target)
+            self._poll_state.pop(target, None)
             self.logger.info(f"成功移除监听目标: {target}")
             return True
         except Exception as e:
             self.logger.error(f"移除监听目标 {target} 失败: {str(e)}", exc_info=True)
-            if self.ui:
-                self.ui.update_status(f'移除监听失败: {str(e)}')
+            self._show_status(f'移除监听失败: {str(e)}')
             return False
     
     def cleanup(self):
@@ -88,12 +224,13 @@ class WeChatHandler:
         try:
             self.logger.info("开始清理所有监听目标")
             self.listen_targets.clear()
+            self._poll_state.clear()
+            self.dedup.save()
             self.logger.info("所有监听目标已清理完成")
             return True
         except Exception as e:
             self.logger.error(f"清理监听失败: {str(e)}", exc_info=True)
-            if self.ui:
-                self.ui.update_status(f'清理监听失败: {str(e)}')
+            self._show_status(f'清理监听失败: {str(e)}')
 
     def setup_listeners(self) -> List[str]:
         """设置监听对象并返回成功添加的监听对象列表"""
@@ -107,9 +244,7 @@ class WeChatHandler:
         for target in self.listen_targets:
             try:
                 self.logger.info(f"尝试添加监听目标: {target}")
-                # 如果UI引用存在，显示提示信息
-                if self.ui:
-                    self.ui.update_status(f"正在设置监听 {target}，请勿操作微信窗口...")
+                self._show_status(f"正在设置监听 {target}，请勿操作微信窗口...")
                 
                 # 添加监听
                 self.wx.AddListenChat(target, savepic=True, savefile=True, savevoice=True)
@@ -120,50 +255,54 @@ class WeChatHandler:
                     self.logger.info(f"成功添加监听目标: {target}")
             except Exception as e:
                 self.logger.error(f"添加监听目标 {target} 失败: {str(e)}", exc_info=True)
-                if self.ui:
-                    self.ui.add_message('系统', {
-                        'type': '错误',
-                        'content': f"添加监听对象 {target} 失败: {str(e)}",
-                        'time': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                        'id': f'error_add_listen_{target}'
-                    })
+                self._show_message(ChatMessage(
+                    '错误',
+                    f"添加监听对象 {target} 失败: {str(e)}",
+                    id=f'error_add_listen_{target}'
+                ))
                 # 继续处理下一个目标，不要中断整个过程
         
         self.logger.info(f"监听设置完成，成功添加 {len(success_targets)} 个目标")
         return success_targets
 
-    def _process_message(self, msg) -> Dict[str, str]:
+    def _process_message(self, msg, target: str = '', occurrences: Optional[dict] = None) -> ChatMessage:
         """处理单条消息
         
         Args:
             msg: 原始消息对象
+            target: 消息所在的聊天，用于生成消息指纹
+            occurrences: 本批消息中各 (类型, 内容, 时间) 已出现的次数，用于区分相同的消息
             
         Returns:
-            处理后的消息字典，包含 type, content, time, id 等字段
+            处理后的消息，时间为收到消息的时间戳
         """
         try:
             if hasattr(msg, '__class__') and msg.__class__.__name__ == 'SysMessage':
-                return {
-                    'type': '系统消息',
-                    'content': str(msg),
-                    'time': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                    'id': f'sys_{time.time()}'
-                }
+                return ChatMessage('系统消息', str(msg), id=f'sys_{time.time()}')
+            
+            is_sequence = isinstance(msg, (list, tuple))
+            msg_type = msg[0] if is_sequence and len(msg) > 0 else '文本消息'
+            content = msg[1] if is_sequence and len(msg) > 1 else str(msg)
+            # wxauto 的消息对象带有 id（控件的 runtime id），列表形式的消息id在最后一项
+            msg_id = getattr(msg, 'id', None) or getattr(msg, 'runtimeid', None)
+            if not msg_id and is_sequence and len(msg) > 3:
+                msg_id = msg[-1]
+            now = time.time()
+            if msg_id:
+                msg_id = str(msg_id)
             else:
-                return {
-                    'type': msg[0] if isinstance(msg, (list, tuple)) and len(msg) > 0 else '文本消息',
-                    'content': msg[1] if isinstance(msg, (list, tuple)) and len(msg) > 1 else str(msg),
-                    'time': msg[2] if isinstance(msg, (list, tuple)) and len(msg) > 2 else datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                    'id': msg[-1] if isinstance(msg, (list, tuple)) and len(msg) > 3 else f'msg_{time.time()}'
-                }
+                # 没有消息id时使用指纹，只用于识别相邻两次轮询返回的同一条消息
+                msg_time = str(msg[2]) if is_sequence and len(msg) > 2 else ''
+                key = (msg_type, content, msg_time)
+                occurrence = 0
+                if occurrences is not None:
+                    occurrence = occurrences.get(key, 0)
+                    occurrences[key] = occurrence + 1
+                msg_id = message_fingerprint(target, str(msg_type), str(content), msg_time, occurrence)
+            return ChatMessage(msg_type, content, now, msg_id)
         except Exception as e:
             self.logger.error(f"消息处理错误: {str(e)}, 原始消息: {str(msg)}", exc_info=True)
-            return {
-                'type': '处理错误',
-                'content': f'消息处理错误: {str(e)}, 原始消息: {str(msg)}',
-                'time': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                'id': f'error_{time.time()}'
-            }
+            return ChatMessage('处理错误', f'消息处理错误: {str(e)}, 原始消息: {str(msg)}', id=f'error_{time.time()}')
 
     def add_listener(self, target: str) -> bool:
         """添加单个监听目标
@@ -182,16 +321,16 @@ class WeChatHandler:
             # 添加监听
             self.wx.AddListenChat(target, savepic=True, savefile=True, savevoice=True)
             
-            # 添加到监听列表
+            # 添加到监听列表，并立即轮询一次
             if target not in self.listen_targets:
                 self.listen_targets.append(target)
+            self._poll_state.pop(target, None)
             
             self.logger.info(f"成功添加监听目标: {target}")
             return True
         except Exception as e:
             self.logger.error(f"添加监听目标 {target} 失败: {str(e)}", exc_info=True)
-            if self.ui:
-                self.ui.update_status(f'添加监听失败: {str(e)}')
+            self._show_status(f'添加监听失败: {str(e)}')
             return False
 
     def send_message(self, message: str, target: str) -> bool:
@@ -205,18 +344,22 @@ class WeChatHandler:
             bool: 发送是否成功
         """
         try:
-            self.logger.info(f"尝试发送消息到 {target}: {message[:50]}{'...' if len(message) > 50 else ''}")
+            self.logger.info("尝试发送消息到 %s: %s", target, shorten(message, 50))
             # 直接使用 SendMsg 方法，通过 who 参数指定接收者
-            self.wx.SendMsg(message, who=target)
-            self.logger.info(f"成功发送消息到 {target}")
+            started = time.perf_counter()
+            with self._wx_lock:
+                self.wx.SendMsg(message, who=target)
+            SEND_SECONDS.observe(time.perf_counter() - started)
+            SENDS.inc(result='ok')
+            self.logger.info("成功发送消息到 %s", target)
             return True
         except Exception as e:
+            SENDS.inc(result='error')
+            ERRORS.inc(stage='send', type=type(e).__name__)
             self.logger.error(f"发送消息到 {target} 失败: {str(e)}", exc_info=True)
-            if self.ui:
-                self.ui.add_message('系统', {
-                    'type': 'Text',
-                    'content': f'发送消息失败: {str(e)}',
-                    'time': datetime.datetime.now(),
-                    'id': f'error_send_{time.time()}'
-                })
+            self._show_message(ChatMessage(
+                'Text',
+                f'发送消息失败: {str(e)}',
+                id=f'error_send_{time.time()}'
+            ))
                     